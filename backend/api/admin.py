@@ -2,10 +2,46 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import ProcessedImage
+from .models import AnalysisCache, AnalysisJob, ImageLabel, ProcessedImage, Purchase, UserStats
 
 @admin.register(ProcessedImage)
 class ProcessedImageAdmin(admin.ModelAdmin):
     list_display = ('id', 'image_file', 'owner', 'is_public', 'uploaded_at')
     list_filter = ('is_public', 'owner')
-    search_fields = ('detailed_labels',)
\ No newline at end of file
+    search_fields = ('detailed_labels',)
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'image', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+
+
+@admin.register(AnalysisCache)
+class AnalysisCacheAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'pipeline_version', 'created_at')
+    search_fields = ('content_hash',)
+
+
+@admin.register(ImageLabel)
+class ImageLabelAdmin(admin.ModelAdmin):
+    list_display = ('image', 'owner', 'kind', 'value')
+    list_filter = ('kind',)
+    search_fields = ('value',)
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'image_count', 'for_sale_count', 'sold_count', 'updated_at')
+
+
+@admin.register(Purchase)
+class PurchaseAdmin(admin.ModelAdmin):
+    list_display = ('id', 'image', 'buyer', 'seller', 'price', 'created_at')
+    readonly_fields = ('image', 'buyer', 'seller', 'price', 'idempotency_key', 'created_at')
+
+    # The ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -1,164 +1,372 @@
+import logging
 import sys
+import threading
+import time
 from pathlib import Path
-from typing import List, Set, Dict
-import json
+from typing import List, Optional, Set, Dict, Iterable, Tuple, Union
 
 # Computer Vision and ML
+# torch / ultralytics are imported by model_registry only when a model is first used
 import cv2
 import numpy as np
-import torch
-import nltk
 from PIL import Image
-from nltk.corpus.reader.wordnet import Synset
-from ultralytics import YOLO
-from torchvision import models
-from torchvision.models import ResNet50_Weights
-
-# --- One-time NLTK setup ---
-try:
-    from nltk.corpus import wordnet
-    wordnet.ensure_loaded()
-except LookupError:
-    print("[INFO] First time setup: Downloading WordNet data...")
-    nltk.download("wordnet")
-    from nltk.corpus import wordnet
-    print("[INFO] WordNet download complete.")
-
-# --- EAGER LOAD MODELS ON STARTUP (This is the fix for the timeout) ---
-print("[STARTUP] Loading YOLOv8n model into memory...")
-YOLO_MODEL = YOLO("yolov8n.pt")
-print("[STARTUP] YOLOv8n model loaded successfully.")
-
-print("[STARTUP] Loading ResNet50 model into memory...")
-RESNET_WEIGHTS = ResNet50_Weights.DEFAULT
-RESNET_MODEL = models.resnet50(weights=RESNET_WEIGHTS)
-RESNET_MODEL.eval()
-RESNET_PREPROCESS = RESNET_WEIGHTS.transforms()
-RESNET_CATEGORIES = RESNET_WEIGHTS.meta["categories"]
-print("[STARTUP] ResNet50 model loaded successfully.")
-
-
-# --- Helper Functions (from your script) ---
-def load_category_map_from_json(file_path: str) -> Dict[str, List[Synset]]:
-    try:
-        with open(file_path, "r") as f:
-            json_data = json.load(f)
-    except FileNotFoundError:
-        # For a Django app, it's better to raise an error than to exit
-        raise FileNotFoundError(f"❌ Error: Category file not found at '{file_path}'. Make sure 'categories.json' exists.")
-    except json.JSONDecodeError:
-        raise json.JSONDecodeError(f"❌ Error: Could not parse '{file_path}'. Make sure it is a valid JSON file.")
-    
-    category_map = {}
-    for category, synset_strings in json_data.items():
-        try:
-            category_map[category] = [wordnet.synset(s) for s in synset_strings]
-        except Exception as e:
-            print(f"⚠️ Warning: Could not understand a synset for category '{category}'. Error: {e}")
-    print("[INFO] Successfully loaded category map from categories.json")
-    return category_map
-
-def get_hypernym_chain(synset: Synset) -> Set[Synset]:
-    hypernyms = set()
-    for s in synset.hypernyms():
-        hypernyms.update(get_hypernym_chain(s))
-    return hypernyms | {synset}
-
-def get_general_category(word: str, category_map: Dict[str, List[Synset]]) -> str | None:
-    search_word = word.replace(" ", "_")
-    try:
-        synsets = wordnet.synsets(search_word)
-        if not synsets:
-            return None
-        all_hypernyms = get_hypernym_chain(synsets[0])
-        for category_name, trigger_synsets in category_map.items():
-            for trigger in trigger_synsets:
-                if trigger in all_hypernyms:
-                    return category_name
-    except Exception as e:
-        print(f"WordNet error for word '{search_word}': {e}")
-    return None
-
-def load_image_bgr(image_path: Path) -> np.ndarray:
-    image = cv2.imdecode(np.fromfile(str(image_path), dtype=np.uint8), cv2.IMREAD_COLOR)
-    if image is None:
-        raise ValueError(f"Failed to load image: {image_path}")
-    return image
-
-def detect_faces_and_people(image_bgr: np.ndarray) -> bool:
-    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+
+from .category_index import CategoryIndex, get_general_category
+from .image_limits import decode_buffer, decode_file
+from .metrics import BATCH_SIZE, BRANCH_TAKEN, GATE_DECISIONS, IMAGES_ANALYZED, STAGE_SECONDS
+from .model_registry import BACKEND_ONNX, INFERENCE_BACKEND, get_resnet, get_yolo
+
+logger = logging.getLogger(__name__)
+
+# Either the precomputed CategoryIndex or a raw map from load_category_map_from_json
+CategoryMap = Union[CategoryIndex, Dict[str, list]]
+
+
+def model_label_vocabulary() -> Iterable[str]:
+    """Every label either model can emit; used to precompute the category index."""
+    return list(get_yolo().names.values()) + list(get_resnet().categories)
+
+def load_image_bgr(image_path: Path, reduce: bool = True) -> np.ndarray:
+    """Upright BGR array; with `reduce`, JPEGs decode at the smallest DCT scale the pipeline can use."""
+    return decode_file(Path(image_path), reduce=reduce)[0]
+
+class DecodedImage:
+    """
+    One decoded image shared by every pipeline stage. The BGR array from
+    OpenCV is the single source of truth; other views are derived from it
+    (and cached) instead of re-reading the file.
+
+    `bgr` may be smaller than the file (see image_limits.py); `original_size`
+    is the upright (width, height) of the original.
+    """
+
+    def __init__(self, bgr: np.ndarray, name: str = "image", original_size: Tuple[int, int] = None):
+        self.bgr = bgr
+        self.name = name
+        self.original_size = original_size or (bgr.shape[1], bgr.shape[0])
+        self._rgb = None
+        self._gray = None
+
+    @classmethod
+    def from_path(cls, image_path, reduce: bool = True) -> "DecodedImage":
+        image_path = Path(image_path)
+        bgr, header = decode_file(image_path, reduce=reduce)
+        return cls(bgr, name=image_path.name, original_size=(header.width, header.height))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = "upload", reduce: bool = True) -> "DecodedImage":
+        """Decodes in-memory upload bytes without writing them to disk first."""
+        bgr, header = decode_buffer(data, name=name, reduce=reduce)
+        return cls(bgr, name=name, original_size=(header.width, header.height))
+
+    @property
+    def scale(self) -> float:
+        """Decoded width / original width (1.0 unless decoded reduced)."""
+        return self.bgr.shape[1] / self.original_size[0]
+
+    @property
+    def rgb(self) -> np.ndarray:
+        # One contiguous conversion; a [..., ::-1] view would be copied by PIL anyway
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def to_pil(self) -> Image.Image:
+        return Image.fromarray(self.rgb)
+
+ImageSource = Union[DecodedImage, Path, str, bytes]
+
+def decode_image(source: ImageSource) -> DecodedImage:
+    if isinstance(source, DecodedImage):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return DecodedImage.from_bytes(bytes(source))
+    return DecodedImage.from_path(source)
+
+def perceptual_hash(image_bgr: np.ndarray, gray: np.ndarray = None) -> str:
+    """64-bit DCT pHash as 16 hex chars; near-identical images differ in few bits."""
+    if gray is None:
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:8, :8].flatten()
+    bits = low_freq > np.median(low_freq[1:])  # ignore the DC term
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+# --- Person gate ---
+# Detectors are built once per thread (OpenCV detectors aren't thread-safe)
+# instead of re-reading the cascade XML on every call.
+_detectors = threading.local()
+
+# Longest side the gate works at; HOG at full 12MP resolution is slower than YOLO.
+GATE_MAX_SIDE = 640
+PERSON_GATES = ("hog", "yolo")
+
+def _face_cascade() -> "cv2.CascadeClassifier":
+    if getattr(_detectors, "face_cascade", None) is None:
+        _detectors.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    return _detectors.face_cascade
+
+def _hog() -> "cv2.HOGDescriptor":
+    if getattr(_detectors, "hog", None) is None:
+        hog = cv2.HOGDescriptor()
+        hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        _detectors.hog = hog
+    return _detectors.hog
+
+def _downscale(image: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    if scale >= 1.0:
+        return image, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+def detect_faces_and_people(image_bgr: np.ndarray, gray: np.ndarray = None, max_side: int = GATE_MAX_SIDE) -> bool:
+    """Haar face + HOG pedestrian check on a copy bounded to `max_side` pixels (0 = full size)."""
+    if gray is None:
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    small_gray, scale = _downscale(gray, max_side)
+    min_face = max(24, round(40 * scale))  # 40px at full size, never below the 24px cascade window
+    faces = _face_cascade().detectMultiScale(small_gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_face, min_face))
     if len(faces) > 0:
         return True
-    
-    hog = cv2.HOGDescriptor()
-    hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-    rects, _ = hog.detectMultiScale(image_bgr, winStride=(4, 4), padding=(8, 8), scale=1.05)
+
+    small_bgr, _ = _downscale(image_bgr, max_side)
+    rects, _ = _hog().detectMultiScale(small_bgr, winStride=(4, 4), padding=(8, 8), scale=1.05)
     return len(rects) > 0
 
-# --- Model Functions (Modified to use pre-loaded models) ---
-def run_yolo_detection(image_path: Path, device: str = "cpu", conf: float = 0.25) -> List[str]:
-    # MODIFIED: Use the pre-loaded YOLO_MODEL
-    results = YOLO_MODEL.predict(source=str(image_path), device=device, conf=conf, verbose=False)
-    if not results or not results[0].boxes:
-        return []
-    names = YOLO_MODEL.names
-    detected_labels = {names.get(int(box.cls[0]), "unknown") for box in results[0].boxes}
-    return list(detected_labels)
-
-def run_resnet_classification(image_path: Path, device: str = "cpu", topk: int = 5) -> List[str]:
-    # MODIFIED: Use the pre-loaded RESNET tools
-    pil_image = Image.open(image_path).convert("RGB")
-    input_tensor = RESNET_PREPROCESS(pil_image).unsqueeze(0).to(device)
+def run_yolo_detection_batch(images_bgr: List[np.ndarray], device: str = "cpu", conf: float = 0.25) -> List[List[str]]:
+    """
+    Runs YOLO over several decoded images with one forward pass per input shape.
+    Ultralytics letterboxes a mixed-shape batch differently from a single image,
+    so images are grouped by shape to keep results identical to per-image calls.
+    """
+    if INFERENCE_BACKEND == BACKEND_ONNX:
+        # Fixed 640x640 letterbox input, so any mix of shapes is one batch
+        return get_yolo().detect_labels(images_bgr, conf=conf)
+
+    results_by_index: Dict[int, List[str]] = {}
+    by_shape: Dict[tuple, List[int]] = {}
+    for idx, image in enumerate(images_bgr):
+        by_shape.setdefault(image.shape, []).append(idx)
+
+    yolo_model = get_yolo()
+    names = yolo_model.names
+    for indices in by_shape.values():
+        results = yolo_model.predict(
+            source=[images_bgr[i] for i in indices], device=device, conf=conf, verbose=False
+        )
+        for idx, result in zip(indices, results):
+            if not result.boxes:
+                results_by_index[idx] = []
+                continue
+            results_by_index[idx] = list({names.get(int(box.cls[0]), "unknown") for box in result.boxes})
+    return [results_by_index[i] for i in range(len(images_bgr))]
+
+def run_yolo_detection(image_path: ImageSource, device: str = "cpu", conf: float = 0.25) -> List[str]:
+    return run_yolo_detection_batch([decode_image(image_path).bgr], device=device, conf=conf)[0]
+
+def resnet_forward(model, input_batch):
+    """torchvision ResNet forward that also returns the pooled 2048-d features fed to `fc`."""
+    import torch
+
+    x = model.maxpool(model.relu(model.bn1(model.conv1(input_batch))))
+    x = model.layer4(model.layer3(model.layer2(model.layer1(x))))
+    features = torch.flatten(model.avgpool(x), 1)
+    return model.fc(features), features
+
+def run_resnet_batch(images: List[ImageSource], device: str = "cpu", topk: int = 5,
+                     embed: bool = False) -> Tuple[List[List[str]], Optional[np.ndarray]]:
+    """
+    Top-k labels for several images with a single ResNet forward pass and,
+    with `embed`, their penultimate-layer embeddings as an (N, 2048) float32
+    array (None if the loaded model can't provide them).
+    """
+    if not images:
+        return [], (np.zeros((0, 2048), dtype=np.float32) if embed else None)
+    resnet = get_resnet()
+    if INFERENCE_BACKEND == BACKEND_ONNX:
+        batch = np.stack([resnet.preprocess(decode_image(image).to_pil()) for image in images])
+        if embed:
+            logits, embeddings = resnet.forward(batch)
+        else:
+            logits, embeddings = resnet.logits(batch), None
+        # Softmax is monotonic, so the top-k of the logits is the top-k of the probabilities
+        topk_idxs = np.argsort(-logits, axis=1, kind="stable")[:, :topk]
+        labels = [[resnet.categories[idx] for idx in row] for row in topk_idxs]
+        return labels, None if embeddings is None else np.asarray(embeddings, dtype=np.float32)
+
+    import torch
+
+    input_batch = torch.stack([
+        resnet.preprocess(decode_image(image).to_pil()) for image in images
+    ]).to(device)
     with torch.inference_mode():
-        logits = RESNET_MODEL(input_tensor)
-        probs = torch.nn.functional.softmax(logits, dim=1)[0]
-    _, topk_idxs = torch.topk(probs, k=topk)
-    return [RESNET_CATEGORIES[idx] for idx in topk_idxs.cpu().numpy()]
+        logits, features = resnet_forward(resnet.model, input_batch)
+        probs = torch.nn.functional.softmax(logits, dim=1)
+    _, topk_idxs = torch.topk(probs, k=topk, dim=1)
+    labels = [[resnet.categories[idx] for idx in row] for row in topk_idxs.cpu().numpy()]
+    return labels, features.float().cpu().numpy() if embed else None
+
+def run_resnet_classification_batch(images: List[ImageSource], device: str = "cpu", topk: int = 5) -> List[List[str]]:
+    """Classifies several images with a single ResNet forward pass."""
+    return run_resnet_batch(images, device=device, topk=topk)[0]
+
+def run_resnet_classification(image_path: ImageSource, device: str = "cpu", topk: int = 5) -> List[str]:
+    return run_resnet_classification_batch([image_path], device=device, topk=topk)[0]
+
+def _categorize(labels: List[str], category_map: CategoryMap) -> Set[str]:
+    categories = set()
+    for label in labels:
+        if isinstance(category_map, CategoryIndex):
+            category = category_map.lookup(label)
+        else:
+            category = get_general_category(label, category_map)
+        if category:
+            categories.add(category)
+    return categories
+
+def _record_stage(timings: List[Dict[str, float]], idxs: List[int], stage: str, seconds: float):
+    """Spreads a (possibly batched) stage's time evenly over the images it covered."""
+    if not idxs:
+        return
+    per_image = seconds / len(idxs)
+    for idx in idxs:
+        timings[idx][stage] = timings[idx].get(stage, 0.0) + per_image * 1000
+        STAGE_SECONDS.observe(per_image, stage=stage)
 
 # --- Main Analysis Function (from your script, with return statement) ---
-def analyze_image_and_categorize(image_path: Path, device: str, category_map: Dict[str, List[Synset]]):
-    print(f"\n📸 Processing Image: {image_path.name}")
-    detailed_labels = []
-    general_categories = set()
-    image_bgr = load_image_bgr(image_path)
-    run_resnet_as_fallback = False
-    
-    if detect_faces_and_people(image_bgr):
-        print("🧠 Decision: Person/face suspected. Trying YOLO for object detection...")
-        yolo_labels = run_yolo_detection(image_path=image_path, device=device)
-        print(f"🔎 YOLO Raw Detections: {yolo_labels}")
+def analyze_images_batch(image_paths: List[ImageSource], device: str, category_map: CategoryMap,
+                         compute_phash: bool = False, gate: str = "hog",
+                         gate_max_side: int = GATE_MAX_SIDE, compute_embedding: bool = False) -> List[dict]:
+    """
+    Same decision flow as analyze_image_and_categorize, but every model runs
+    once for the whole batch: one YOLO pass over the images where a person
+    was suspected, then one ResNet pass over the rest plus YOLO misses.
+    Each image is decoded exactly once; paths, raw bytes or DecodedImage
+    objects are all accepted.
+
+    `gate` picks how a person is suspected: "hog" (Haar faces + HOG people on
+    a copy bounded to `gate_max_side`) or "yolo" (YOLO runs on every image and
+    its own "person" class is the gate). Each result carries a "route" entry
+    recording the gate, its verdict and the branch taken, and "timings_ms"
+    with the time spent per stage (batched stages are split evenly).
+
+    With `compute_embedding` the ResNet pass also covers the images labelled
+    by YOLO (their labels are unchanged) and each result gets an "embedding"
+    (float32 array, not JSON: store it, don't cache it).
+    """
+    if gate not in PERSON_GATES:
+        raise ValueError(f"Unknown person gate '{gate}', expected one of {PERSON_GATES}")
+    detailed_labels: List[List[str]] = [[] for _ in image_paths]
+    general_categories: List[Set[str]] = [set() for _ in image_paths]
+    timings: List[Dict[str, float]] = [{} for _ in image_paths]
+    all_idxs = list(range(len(image_paths)))
+    BATCH_SIZE.observe(len(image_paths))
+
+    images = []
+    for idx, source in enumerate(image_paths):
+        started = time.perf_counter()
+        images.append(decode_image(source))
+        _record_stage(timings, [idx], "decode", time.perf_counter() - started)
+    routes = [{"gate": gate, "person_suspected": False, "branch": "resnet"} for _ in images]
+
+    person_idxs = []
+    yolo_by_idx: Dict[int, List[str]] = {}
+    if gate == "yolo":
+        started = time.perf_counter()
+        yolo_batch = run_yolo_detection_batch([image.bgr for image in images], device=device)
+        _record_stage(timings, all_idxs, "gate", time.perf_counter() - started)
+        for idx, yolo_labels in enumerate(yolo_batch):
+            if "person" in yolo_labels:
+                person_idxs.append(idx)
+                yolo_by_idx[idx] = yolo_labels
+    else:
+        for idx, image in enumerate(images):
+            started = time.perf_counter()
+            suspected = detect_faces_and_people(image.bgr, gray=image.gray, max_side=gate_max_side)
+            _record_stage(timings, [idx], "gate", time.perf_counter() - started)
+            if suspected:
+                person_idxs.append(idx)
+
+    gated = set(person_idxs)
+    for idx, image in enumerate(images):
+        GATE_DECISIONS.inc(gate=gate, person=str(idx in gated).lower())
+        if idx in gated:
+            logger.info("%s: person/face suspected (%s gate), using YOLO labels", image.name, gate)
+        else:
+            logger.info("%s: no person suspected (%s gate), analyzing scene with ResNet", image.name, gate)
+
+    resnet_idxs = [idx for idx in all_idxs if idx not in gated]
+    if gate == "hog" and person_idxs:
+        started = time.perf_counter()
+        yolo_batch = run_yolo_detection_batch([images[i].bgr for i in person_idxs], device=device)
+        _record_stage(timings, person_idxs, "yolo", time.perf_counter() - started)
+        yolo_by_idx.update(zip(person_idxs, yolo_batch))
+    for idx in person_idxs:
+        yolo_labels = yolo_by_idx[idx]
+        routes[idx]["person_suspected"] = True
+        logger.debug("%s: YOLO raw detections %s", images[idx].name, yolo_labels)
         if yolo_labels:
-            detailed_labels = yolo_labels
-            for label in detailed_labels:
-                category = get_general_category(label, category_map)
-                if category:
-                    general_categories.add(category)
+            routes[idx]["branch"] = "yolo"
+            detailed_labels[idx] = yolo_labels
+            started = time.perf_counter()
+            general_categories[idx] |= _categorize(yolo_labels, category_map)
+            _record_stage(timings, [idx], "categorize", time.perf_counter() - started)
         else:
-            print("⚠️ YOLO found no objects. Falling back to ResNet.")
-            run_resnet_as_fallback = True
-    else:
-        run_resnet_as_fallback = True
-
-    if run_resnet_as_fallback:
-        print("🧠 Decision: Analyzing general scene with ResNet.")
-        top_5_labels = run_resnet_classification(image_path=image_path, device=device, topk=5)
-        print(f"🕵️  ResNet Raw Predictions: {top_5_labels}")
+            logger.info("%s: YOLO found no objects, falling back to ResNet", images[idx].name)
+            routes[idx]["branch"] = "yolo->resnet"
+            resnet_idxs.append(idx)
+
+    # Embeddings need every image through ResNet; the YOLO-labelled ones ride along at the end
+    forward_idxs = resnet_idxs + ([idx for idx in all_idxs if idx not in resnet_idxs] if compute_embedding else [])
+    started = time.perf_counter()
+    resnet_batch, embeddings = run_resnet_batch([images[i] for i in forward_idxs], device=device, topk=5,
+                                                embed=compute_embedding)
+    _record_stage(timings, forward_idxs, "resnet", time.perf_counter() - started)
+    embedding_by_idx = dict(zip(forward_idxs, embeddings)) if embeddings is not None else {}
+    for idx, top_5_labels in zip(resnet_idxs, resnet_batch):
+        logger.debug("%s: ResNet raw predictions %s", images[idx].name, top_5_labels)
         if top_5_labels:
-            if not detailed_labels:
-                detailed_labels.append(top_5_labels[0])
-            for label in top_5_labels:
-                category = get_general_category(label, category_map)
-                if category:
-                    general_categories.add(category)
-    
-    print("\n--- ✅ Analysis Complete ---")
-    return {
-        "detailed_labels": sorted(list(set(detailed_labels))) if detailed_labels else [],
-        "general_categories": sorted(list(general_categories)) if general_categories else [],
-    }
-
+            if not detailed_labels[idx]:
+                detailed_labels[idx].append(top_5_labels[0])
+            started = time.perf_counter()
+            general_categories[idx] |= _categorize(top_5_labels, category_map)
+            _record_stage(timings, [idx], "categorize", time.perf_counter() - started)
+
+    results = []
+    for idx, (labels, categories) in enumerate(zip(detailed_labels, general_categories)):
+        result = {
+            "detailed_labels": sorted(set(labels)) if labels else [],
+            "general_categories": sorted(categories) if categories else [],
+            "route": routes[idx],
+            "timings_ms": timings[idx],
+        }
+        if idx in embedding_by_idx:
+            result["embedding"] = embedding_by_idx[idx]
+        if compute_phash:
+            started = time.perf_counter()
+            result["perceptual_hash"] = perceptual_hash(images[idx].bgr, gray=images[idx].gray)
+            _record_stage(timings, [idx], "phash", time.perf_counter() - started)
+        IMAGES_ANALYZED.inc()
+        BRANCH_TAKEN.inc(branch=routes[idx]["branch"])
+        logger.info("%s: analysis complete, labels=%s categories=%s",
+                    images[idx].name, result["detailed_labels"], result["general_categories"])
+        results.append(result)
+    return results
+
+def analyze_image_and_categorize(image_path: ImageSource, device: str, category_map: CategoryMap,
+                                 compute_phash: bool = False, gate: str = "hog",
+                                 gate_max_side: int = GATE_MAX_SIDE, compute_embedding: bool = False):
+    return analyze_images_batch([image_path], device=device, category_map=category_map,
+                                compute_phash=compute_phash, gate=gate, gate_max_side=gate_max_side,
+                                compute_embedding=compute_embedding)[0]
 
 
 
@@ -0,0 +1,66 @@
+"""
+Analysis results cached by content hash + pipeline version.
+
+An exact re-upload of a photo skips inference entirely: its labels are
+copied from the cache. Changing the models, the inference backend,
+categories.json or pipeline.PIPELINE_REVISION changes the version key, so stale entries are
+simply never read again.
+"""
+from django.conf import settings
+from django.db import IntegrityError
+
+from .metrics import CACHE_LOOKUPS
+from .model_registry import INFERENCE_BACKEND_ID
+from .models import AnalysisCache, ProcessedImage
+from .image_limits import decode_policy
+from .pipeline import pipeline_version
+
+CATEGORY_FILE = getattr(settings, 'CATEGORY_FILE', settings.BASE_DIR / 'categories.json')
+
+
+def current_pipeline_version() -> str:
+    return pipeline_version(CATEGORY_FILE, INFERENCE_BACKEND_ID, decode_policy())
+
+
+def get_cached_results(content_hash):
+    """Returns the cached result dict for these bytes, or None."""
+    if not content_hash:
+        return None
+    entry = AnalysisCache.objects.filter(
+        content_hash=content_hash, pipeline_version=current_pipeline_version()
+    ).first()
+    if entry is None:
+        CACHE_LOOKUPS.inc(result="miss")
+        return None
+    CACHE_LOOKUPS.inc(result="hit")
+    results = {
+        "detailed_labels": entry.detailed_labels,
+        "general_categories": entry.general_categories,
+    }
+    # Same bytes, same perceptual hash: reuse it from any earlier copy
+    perceptual_hash = (
+        ProcessedImage.objects
+        .filter(content_hash=content_hash, perceptual_hash__isnull=False)
+        .values_list('perceptual_hash', flat=True)
+        .first()
+    )
+    if perceptual_hash:
+        results["perceptual_hash"] = perceptual_hash
+    return results
+
+
+def store_results(content_hash, results: dict):
+    if not content_hash:
+        return
+    try:
+        AnalysisCache.objects.get_or_create(
+            content_hash=content_hash,
+            pipeline_version=current_pipeline_version(),
+            defaults={
+                "detailed_labels": results.get("detailed_labels", []),
+                "general_categories": results.get("general_categories", []),
+            },
+        )
+    except IntegrityError:
+        # Another worker cached the same bytes first; its entry is equivalent
+        pass
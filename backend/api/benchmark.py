@@ -0,0 +1,402 @@
+"""
+Reproducible, offline benchmark of the analysis pipeline.
+
+`generate_corpus` writes a deterministic synthetic corpus (mixed sizes, half
+of the images with drawn human figures, half plain scenes); `run_benchmark`
+times the full pipeline and each stage in isolation and returns a JSON-able
+report. Used by `manage.py benchmark_analysis`; compare two saved reports
+with `compare_reports` to spot regressions between commits.
+"""
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from .process_info import current_rss_mb
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+CORPUS_SIZES = [(320, 240), (640, 480), (1280, 960), (1920, 1080), (3000, 2000), (4032, 3024)]
+MANIFEST = "manifest.json"
+
+
+# --- Corpus ---
+def _scene(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    """Sky/ground gradient with random rectangles and circles as 'objects'."""
+    top, bottom = rng.integers(0, 256, size=(2, 3))
+    ramp = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    image = (top * (1 - ramp) + bottom * ramp).astype(np.uint8).repeat(width, axis=1)
+    for _ in range(rng.integers(3, 12)):
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(max(4, width // 40), max(5, width // 6)))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x, y), (x + size, y + size), color, -1)
+        else:
+            cv2.circle(image, (x, y), size // 2, color, -1)
+    noise = rng.normal(0, 6, size=image.shape).astype(np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def _draw_person(image: np.ndarray, rng: np.random.Generator):
+    """Upright human silhouette (head, torso, arms, legs) sized for HOG's 64x128 window."""
+    height, width = image.shape[:2]
+    body = int(height * rng.uniform(0.35, 0.7))
+    cx = int(rng.integers(body // 4, max(body // 4 + 1, width - body // 4)))
+    top = int(rng.integers(0, max(1, height - body)))
+    color = tuple(int(c) for c in rng.integers(0, 90, size=3))
+    head = body // 8
+    thickness = max(2, body // 12)
+    cv2.circle(image, (cx, top + head), head, color, -1)
+    neck, hip = top + 2 * head, top + body // 2
+    cv2.line(image, (cx, neck), (cx, hip), color, thickness * 2)
+    cv2.line(image, (cx, neck + head), (cx - body // 5, hip), color, thickness)
+    cv2.line(image, (cx, neck + head), (cx + body // 5, hip), color, thickness)
+    cv2.line(image, (cx, hip), (cx - body // 8, top + body), color, thickness)
+    cv2.line(image, (cx, hip), (cx + body // 8, top + body), color, thickness)
+
+
+def generate_corpus(out_dir, count: int = 60, seed: int = 1234) -> List[dict]:
+    """Writes `count` JPEGs plus a manifest; the same seed always gives the same bytes."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    manifest = []
+    for i in range(count):
+        width, height = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        has_people = i % 2 == 0
+        image = _scene(rng, width, height)
+        if has_people:
+            for _ in range(rng.integers(1, 4)):
+                _draw_person(image, rng)
+        name = f"{i:04d}_{width}x{height}_{'people' if has_people else 'scene'}.jpg"
+        cv2.imwrite(str(out_dir / name), image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        manifest.append({"file": name, "width": width, "height": height, "has_people": has_people})
+    with open(out_dir / MANIFEST, "w") as f:
+        json.dump({"seed": seed, "images": manifest}, f, indent=1)
+    return manifest
+
+
+def load_corpus(corpus_dir) -> List[dict]:
+    """Reads the manifest if there is one; otherwise people/ and no_people/ subfolders label the images."""
+    corpus_dir = Path(corpus_dir)
+    manifest_path = corpus_dir / MANIFEST
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            entries = json.load(f)["images"]
+        return [{**e, "path": str(corpus_dir / e["file"])} for e in entries]
+    entries = []
+    for path in sorted(p for p in corpus_dir.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS):
+        top = path.relative_to(corpus_dir).parts[0]
+        has_people = True if top == "people" else False if top == "no_people" else None
+        entries.append({"file": str(path.relative_to(corpus_dir)), "path": str(path), "has_people": has_people})
+    return entries
+
+
+# --- Measurement helpers ---
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def _proc_status_mb(field: str):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024  # kB
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """Resets this process' high-water mark (Linux >= 4.0), so a peak can be measured per step."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_since_reset_mb() -> float:
+    peak = _proc_status_mb("VmHWM")
+    return peak if peak is not None else peak_rss_mb()
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"n": 0}
+    ordered = sorted(values)
+    return {
+        "n": len(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max": ordered[-1],
+    }
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    if not seconds:
+        return {"n": 0}
+    ms = sorted(s * 1000 for s in seconds)
+
+    def pct(p):
+        return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))]
+
+    total = sum(seconds)
+    return {
+        "n": len(ms),
+        "mean_ms": statistics.mean(ms),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": ms[-1],
+        "throughput_per_s": len(ms) / total if total else None,
+    }
+
+
+def _time_each(items, fn: Callable) -> List[float]:
+    timings = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=Path(__file__).resolve().parent).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# --- Benchmark ---
+def run_benchmark(corpus: List[dict], device: str = "cpu", batch_size: int = 8, gate: str = "hog",
+                  gate_max_side: int = 640, repeat: int = 1) -> dict:
+    from . import analysis
+    from .jobs import get_category_map
+    from .model_registry import INFERENCE_BACKEND_ID, registry, thread_settings
+
+    rss_before_models = peak_rss_mb()
+    registry.warm_up()
+    category_map = get_category_map()
+    paths = [entry["path"] for entry in corpus] * repeat
+    decoded = [analysis.DecodedImage.from_path(p) for p in paths]
+
+    # Warm-up pass so lazy initialisation doesn't land in the first sample
+    analysis.analyze_image_and_categorize(decoded[0], device=device, category_map=category_map,
+                                          gate=gate, gate_max_side=gate_max_side)
+
+    stages = {
+        "decode": summarize(_time_each(paths, analysis.DecodedImage.from_path)),
+        "decode_full": summarize(_time_each(paths, lambda p: analysis.DecodedImage.from_path(p, reduce=False))),
+        "gate_hog": summarize(_time_each(decoded, lambda d: analysis.detect_faces_and_people(
+            d.bgr, gray=d.gray, max_side=gate_max_side))),
+        "gate_hog_full": summarize(_time_each(decoded, lambda d: analysis.detect_faces_and_people(
+            d.bgr, gray=d.gray, max_side=0))),
+        "yolo": summarize(_time_each(decoded, lambda d: analysis.run_yolo_detection_batch([d.bgr], device=device))),
+        "resnet": summarize(_time_each(decoded, lambda d: analysis.run_resnet_classification_batch([d], device=device))),
+        "phash": summarize(_time_each(decoded, lambda d: analysis.perceptual_hash(d.bgr, gray=d.gray))),
+    }
+    vocabulary = list(analysis.model_label_vocabulary())
+    stages["categorize"] = summarize(_time_each(vocabulary, lambda label: analysis._categorize([label], category_map)))
+
+    # Full pipeline, one image at a time (the upload path)
+    branches: Dict[str, int] = {}
+    gate_hits = {"people": [0, 0], "no_people": [0, 0]}  # [suspected, total]
+    pipeline_times = []
+    # Peak RSS of each analysis on its own: the high-water mark is reset before every image
+    peak_resettable = reset_peak_rss()
+    analysis_peaks, analysis_growth = [], []
+    for entry, path in zip(corpus * repeat, paths):
+        rss_before = current_rss_mb()
+        reset_peak_rss()
+        started = time.perf_counter()
+        result = analysis.analyze_image_and_categorize(Path(path), device=device, category_map=category_map,
+                                                       gate=gate, gate_max_side=gate_max_side)
+        pipeline_times.append(time.perf_counter() - started)
+        analysis_peaks.append(peak_rss_since_reset_mb())
+        if rss_before is not None:
+            analysis_growth.append(analysis_peaks[-1] - rss_before)
+        branch = result["route"]["branch"]
+        branches[branch] = branches.get(branch, 0) + 1
+        if entry.get("has_people") is not None:
+            bucket = gate_hits["people" if entry["has_people"] else "no_people"]
+            bucket[0] += int(result["route"]["person_suspected"])
+            bucket[1] += 1
+
+    # Batched pipeline (the worker path)
+    batch_times = []
+    for start in range(0, len(paths), batch_size):
+        chunk = [Path(p) for p in paths[start:start + batch_size]]
+        started = time.perf_counter()
+        analysis.analyze_images_batch(chunk, device=device, category_map=category_map,
+                                      gate=gate, gate_max_side=gate_max_side)
+        batch_times.append(time.perf_counter() - started)
+
+    if INFERENCE_BACKEND_ID == "torch":
+        import torch
+        torch_meta = {"torch": torch.__version__, "torch_threads": torch.get_num_threads()}
+    else:
+        torch_meta = {}
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            **torch_meta,
+            "backend": INFERENCE_BACKEND_ID,
+            "threads": dict(zip(("intra", "inter"), thread_settings())),
+            "device": device,
+            "gate": gate,
+            "gate_max_side": gate_max_side,
+            "batch_size": batch_size,
+            "images": len(paths),
+        },
+        "model_load_seconds": dict(registry.load_times),
+        "stages": stages,
+        "pipeline": summarize(pipeline_times),
+        "pipeline_batched": {
+            "batches": len(batch_times),
+            "images_per_s": len(paths) / sum(batch_times) if batch_times else None,
+            "per_batch": summarize(batch_times),
+        },
+        "branches": branches,
+        "gate_positive_rate": {
+            key: (hits / total if total else None) for key, (hits, total) in gate_hits.items()
+        },
+        "decoded_megapixels": {
+            "reduced": statistics.mean(d.bgr.shape[0] * d.bgr.shape[1] / 1e6 for d in decoded),
+            "original": statistics.mean(d.original_size[0] * d.original_size[1] / 1e6 for d in decoded),
+        },
+        "memory": {
+            "peak_rss_mb_before_models": rss_before_models,
+            "peak_rss_mb": peak_rss_mb(),
+            # Without a resettable high-water mark these are the running process peak
+            "per_analysis_peak_is_exact": peak_resettable,
+            "per_analysis_peak_rss_mb": distribution(analysis_peaks),
+            "per_analysis_rss_growth_mb": distribution(analysis_growth),
+        },
+    }
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float = 0.10) -> List[str]:
+    """Lines describing p50/p95 and throughput changes; regressions beyond `threshold` are flagged."""
+    lines = []
+
+    def row(name, old, new, higher_is_better=False):
+        if not old or not new:
+            return
+        change = (new - old) / old
+        worse = change < -threshold if higher_is_better else change > threshold
+        flag = "  <-- REGRESSION" if worse else ""
+        lines.append(f"{name:<32} {old:10.2f} -> {new:10.2f} ({change:+.1%}){flag}")
+
+    for stage in sorted(set(baseline.get("stages", {})) | set(current.get("stages", {}))):
+        old, new = baseline.get("stages", {}).get(stage, {}), current.get("stages", {}).get(stage, {})
+        row(f"{stage} p50 ms", old.get("p50_ms"), new.get("p50_ms"))
+        row(f"{stage} p95 ms", old.get("p95_ms"), new.get("p95_ms"))
+    row("pipeline p50 ms", baseline["pipeline"].get("p50_ms"), current["pipeline"].get("p50_ms"))
+    row("pipeline p99 ms", baseline["pipeline"].get("p99_ms"), current["pipeline"].get("p99_ms"))
+    row("batched images/s", baseline["pipeline_batched"].get("images_per_s"),
+        current["pipeline_batched"].get("images_per_s"), higher_is_better=True)
+    row("peak RSS MB", baseline["memory"].get("peak_rss_mb"), current["memory"].get("peak_rss_mb"))
+    row("per-analysis peak RSS p95 MB", baseline["memory"].get("per_analysis_peak_rss_mb", {}).get("p95"),
+        current["memory"].get("per_analysis_peak_rss_mb", {}).get("p95"))
+    return lines
+
+
+# --- Vector index ---
+def _synthetic_vectors(rng: np.random.Generator, count: int, dim: int, centers: np.ndarray) -> np.ndarray:
+    """Clustered, non-negative vectors (like post-ReLU pooled features): a center plus noise."""
+    labels = rng.integers(0, len(centers), size=count)
+    vectors = centers[labels] + rng.normal(0, 0.5, size=(count, dim)).astype(np.float32)
+    return np.maximum(vectors, 0)
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in Path(path).iterdir() if p.is_file())
+
+
+def run_vector_benchmark(work_dir, sizes=(100_000, 1_000_000), dim: int = 2048, dtype: str = "float16",
+                         queries: int = 50, k: int = 10, nprobes=(4, 16, 64), seed: int = 1234) -> dict:
+    """
+    Builds an EmbeddingStore of each size from synthetic vectors and reports
+    ingest and training time, disk size, query latency of exact search and of
+    IVF per nprobe, and IVF recall@k against the exact results. Needs
+    size * dim * 2 bytes of disk per size (4 GB for 1M float16 vectors).
+    """
+    from .embeddings import EmbeddingStore, normalize
+
+    rng = np.random.default_rng(seed)
+    centers = rng.gamma(1.0, 1.0, size=(256, dim)).astype(np.float32)
+    report = {"meta": {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                       "cpu_count": os.cpu_count(), "dim": dim, "dtype": dtype, "k": k, "queries": queries},
+              "sizes": {}}
+    for size in sizes:
+        store_dir = Path(work_dir) / f"vectors-{size}-{dim}-{dtype}"
+        store = EmbeddingStore(store_dir, dim=dim, dtype=dtype)
+        if len(store) < size:
+            started = time.perf_counter()
+            for start in range(len(store), size, 10_000):
+                count = min(10_000, size - start)
+                store.add(range(start, start + count), _synthetic_vectors(rng, count, dim, centers))
+            ingest_seconds = time.perf_counter() - started
+        else:
+            ingest_seconds = None  # reused from an earlier run
+
+        started = time.perf_counter()
+        meta = store.build_index()
+        train_seconds = time.perf_counter() - started
+
+        # Near-duplicates of stored rows (the "more like this" case) and fresh draws
+        view = store.view()
+        picks = rng.choice(size, size=queries // 2, replace=False)
+        near = view.decode(np.sort(picks)) + rng.normal(0, 0.02, size=(len(picks), dim)).astype(np.float32)
+        fresh = _synthetic_vectors(rng, queries - len(picks), dim, centers)
+        query_vectors = normalize(np.concatenate([near, fresh]))
+
+        exact_times, truth = [], []
+        for query in query_vectors:
+            started = time.perf_counter()
+            truth.append({row for row, _ in store._exact(view, query, k)})
+            exact_times.append(time.perf_counter() - started)
+        ivf = {}
+        for nprobe in nprobes:
+            times, recall = [], []
+            for query, expected in zip(query_vectors, truth):
+                started = time.perf_counter()
+                found = {row for row, _ in store._ivf(view, query, k, nprobe)}
+                times.append(time.perf_counter() - started)
+                recall.append(len(found & expected) / len(expected))
+            ivf[str(nprobe)] = {"latency": summarize(times), f"recall@{k}": statistics.mean(recall)}
+
+        # Incremental add after training: rows are assigned to a list as they arrive
+        started = time.perf_counter()
+        store.add(range(size, size + 100), _synthetic_vectors(rng, 100, dim, centers))
+        add_seconds = (time.perf_counter() - started) / 100
+
+        report["sizes"][str(size)] = {
+            "ingest_seconds": ingest_seconds,
+            "train_seconds": train_seconds,
+            "nlist": meta.get("nlist"),
+            "incremental_add_ms": add_seconds * 1000,
+            "disk_mb": _dir_bytes(store_dir) / 2 ** 20,
+            "exact": {"latency": summarize(exact_times)},
+            "ivf": ivf,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return report
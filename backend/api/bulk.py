@@ -0,0 +1,135 @@
+"""
+Bulk ingest: many files or a zip archive in one request.
+
+The request body is spooled to disk by Django's TemporaryFileUploadHandler,
+so a large archive is never held in memory. Each image is then saved and
+queued for the analysis worker pool (see jobs.py), and a line of NDJSON (or
+a server-sent event) is streamed back as each file is queued and as each
+analysis job finishes.
+"""
+import json
+import shutil
+import tempfile
+import time
+import zipfile
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files import File
+
+from .jobs import enqueue_analysis
+from .models import AnalysisJob
+from .serializers import ProcessedImageSerializer
+from .user_stats import image_state, record_change
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+MAX_FILES = getattr(settings, 'BULK_UPLOAD_MAX_FILES', 5000)
+MAX_MEMBER_BYTES = getattr(settings, 'BULK_UPLOAD_MAX_MEMBER_BYTES', 50 * 1024 * 1024)
+RESULT_TIMEOUT_SECONDS = getattr(settings, 'BULK_UPLOAD_RESULT_TIMEOUT_SECONDS', 600)
+POLL_INTERVAL_SECONDS = 0.5
+
+
+def iter_archive_members(archive_path):
+    """Yields (name, file object) for every image inside a zip, one at a time."""
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            path = PurePosixPath(info.filename)
+            if info.is_dir() or path.name.startswith('.') or '__MACOSX' in path.parts:
+                continue
+            if path.suffix.lower() not in IMAGE_EXTENSIONS:
+                yield path.name, None, "Not an image file."
+                continue
+            if info.file_size > MAX_MEMBER_BYTES:
+                yield path.name, None, f"File is larger than {MAX_MEMBER_BYTES} bytes."
+                continue
+            # Copy the member to a temp file in chunks instead of read()-ing it whole
+            with archive.open(info) as member, tempfile.TemporaryFile() as spool:
+                shutil.copyfileobj(member, spool, length=1024 * 1024)
+                spool.seek(0)
+                yield path.name, File(spool, name=path.name), None
+
+
+def iter_uploads(files, archive):
+    for uploaded in files:
+        yield uploaded.name, uploaded, None
+    if archive is not None:
+        try:
+            yield from iter_archive_members(archive.temporary_file_path())
+        except zipfile.BadZipFile:
+            yield archive.name, None, "Archive is not a valid zip file."
+
+
+def stream_bulk_upload(user, files, archive, event_stream=False, skipped=()):
+    """
+    Generator behind the bulk upload StreamingHttpResponse. `skipped` are
+    {'file', 'error', 'reason'} entries for parts dropped while the body
+    streamed in (see image_limits.UploadLimitsHandler); `reason` is
+    'too_large' or 'unsupported'.
+    """
+    encode = _encode_sse if event_stream else _encode_ndjson
+    pending = {}  # job id -> file name
+    accepted = rejected = 0
+    for entry in skipped:
+        rejected += 1
+        yield encode('rejected', entry)
+
+    for index, (name, file_obj, error) in enumerate(iter_uploads(files, archive)):
+        if accepted + rejected >= MAX_FILES:
+            yield encode('error', {'file': name, 'error': f"Bulk uploads are limited to {MAX_FILES} files."})
+            break
+        if error is None:
+            serializer = ProcessedImageSerializer(data={'image_file': file_obj})
+            if serializer.is_valid():
+                image = serializer.save(owner=user)
+                record_change(user.pk, None, image_state(image))
+                job = enqueue_analysis(image)
+                pending[job.pk] = name
+                accepted += 1
+                yield encode('queued', {'file': name, 'image_id': image.pk, 'job_id': job.pk})
+            else:
+                error = serializer.errors.get('image_file', serializer.errors)
+        if error is not None:
+            rejected += 1
+            yield encode('rejected', {'file': name, 'error': error})
+
+        # Report jobs that already finished while we keep ingesting
+        if index % 20 == 0:
+            yield from _finished_jobs(pending, encode)
+
+    deadline = time.monotonic() + RESULT_TIMEOUT_SECONDS
+    while pending and time.monotonic() < deadline:
+        yielded = list(_finished_jobs(pending, encode))
+        yield from yielded
+        if not yielded:
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+    for job_id, name in pending.items():
+        yield encode('timeout', {'file': name, 'job_id': job_id, 'status': 'pending'})
+    yield encode('summary', {'accepted': accepted, 'rejected': rejected, 'unfinished': len(pending)})
+
+
+def _finished_jobs(pending, encode):
+    if not pending:
+        return
+    finished = (
+        AnalysisJob.objects
+        .filter(pk__in=list(pending), status__in=[AnalysisJob.STATUS_SUCCEEDED, AnalysisJob.STATUS_FAILED])
+        .select_related('image')
+    )
+    for job in finished:
+        name = pending.pop(job.pk)
+        payload = {'file': name, 'image_id': job.image_id, 'job_id': job.pk, 'status': job.status}
+        if job.status == AnalysisJob.STATUS_SUCCEEDED:
+            payload['detailed_labels'] = job.image.detailed_labels
+            payload['general_categories'] = job.image.general_categories
+        else:
+            payload['error'] = job.last_error
+        yield encode('result', payload)
+
+
+def _encode_ndjson(event, data):
+    return json.dumps({'event': event, **data}, default=str) + "\n"
+
+
+def _encode_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,136 @@
+"""
+Label -> general category lookup.
+
+Both models have a fixed label vocabulary (80 YOLO names, 1000 ImageNet
+classes), so the WordNet hypernym walk is done once per label and the
+resulting table is persisted next to categories.json. The table is keyed by
+pipeline.pipeline_version(), which changes with categories.json or the model
+weights, so a fresh index is loaded without touching WordNet at all. Labels
+outside the vocabulary still fall back to a (memoized) WordNet lookup.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set
+
+from .pipeline import pipeline_version
+
+if TYPE_CHECKING:
+    from nltk.corpus.reader.wordnet import Synset
+
+logger = logging.getLogger(__name__)
+_wordnet = None
+
+
+def get_wordnet():
+    """Imports and loads the NLTK WordNet corpus on first use."""
+    global _wordnet
+    if _wordnet is None:
+        import nltk
+        try:
+            from nltk.corpus import wordnet
+            wordnet.ensure_loaded()
+        except LookupError:
+            logger.info("First time setup: Downloading WordNet data...")
+            nltk.download("wordnet")
+            from nltk.corpus import wordnet
+            logger.info("WordNet download complete.")
+        _wordnet = wordnet
+    return _wordnet
+
+
+# --- Helper Functions (from your script) ---
+def load_category_map_from_json(file_path: str) -> Dict[str, List["Synset"]]:
+    try:
+        with open(file_path, "r") as f:
+            json_data = json.load(f)
+    except FileNotFoundError:
+        # For a Django app, it's better to raise an error than to exit
+        raise FileNotFoundError(f"❌ Error: Category file not found at '{file_path}'. Make sure 'categories.json' exists.")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"❌ Error: Could not parse '{file_path}'. Make sure it is a valid JSON file.") from e
+
+    wordnet = get_wordnet()
+    category_map = {}
+    for category, synset_strings in json_data.items():
+        try:
+            category_map[category] = [wordnet.synset(s) for s in synset_strings]
+        except Exception as e:
+            logger.warning("Could not understand a synset for category '%s': %s", category, e)
+    logger.info("Loaded category map from %s", file_path)
+    return category_map
+
+def get_hypernym_chain(synset: "Synset") -> Set["Synset"]:
+    hypernyms = set()
+    for s in synset.hypernyms():
+        hypernyms.update(get_hypernym_chain(s))
+    return hypernyms | {synset}
+
+def get_general_category(word: str, category_map: Dict[str, List["Synset"]]) -> str | None:
+    search_word = word.replace(" ", "_")
+    try:
+        synsets = get_wordnet().synsets(search_word)
+        if not synsets:
+            return None
+        all_hypernyms = get_hypernym_chain(synsets[0])
+        for category_name, trigger_synsets in category_map.items():
+            for trigger in trigger_synsets:
+                if trigger in all_hypernyms:
+                    return category_name
+    except Exception as e:
+        logger.warning("WordNet error for word '%s': %s", search_word, e)
+    return None
+
+
+class CategoryIndex:
+    """O(1) label -> category table with a lazy WordNet fallback for unknown labels."""
+
+    def __init__(self, category_file, index: Dict[str, Optional[str]], version: str):
+        self.category_file = Path(category_file)
+        self.index = index
+        self.version = version
+        self._category_map = None
+
+    def lookup(self, label: str) -> Optional[str]:
+        try:
+            return self.index[label]
+        except KeyError:
+            pass
+        if self._category_map is None:
+            self._category_map = load_category_map_from_json(str(self.category_file))
+        category = get_general_category(label, self._category_map)
+        self.index[label] = category
+        return category
+
+
+def build_category_index(category_file, labels: Iterable[str]) -> Dict[str, Optional[str]]:
+    category_map = load_category_map_from_json(str(category_file))
+    return {label: get_general_category(label, category_map) for label in sorted(set(labels))}
+
+
+def load_category_index(category_file, index_file, labels_provider: Callable[[], Iterable[str]],
+                        rebuild: bool = False) -> CategoryIndex:
+    """
+    Loads the persisted index if it matches the current pipeline version,
+    otherwise builds it from `labels_provider()` and writes it back to disk.
+    """
+    version = pipeline_version(category_file)
+    index_file = Path(index_file)
+    if not rebuild:
+        try:
+            with open(index_file, "r") as f:
+                data = json.load(f)
+            if data.get("version") == version:
+                return CategoryIndex(category_file, data["index"], version)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    logger.info("Building category index for pipeline version %s...", version)
+    index = build_category_index(category_file, labels_provider())
+    tmp_file = index_file.with_suffix(index_file.suffix + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"version": version, "index": index}, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, index_file)  # atomic, so concurrent workers never read half a file
+    logger.info("Category index with %d labels written to %s", len(index), index_file)
+    return CategoryIndex(category_file, index, version)
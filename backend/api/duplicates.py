@@ -0,0 +1,222 @@
+"""
+Near-duplicate clusters (burst shots, re-edits, re-saves) from the 64-bit pHash.
+
+Two images of the same owner are near-duplicates when their perceptual
+hashes differ in at most DUPLICATE_MAX_DISTANCE bits; clusters are the
+connected components of that relation (single linkage), stored as
+ProcessedImage.duplicate_group = id of the cluster's oldest image, or null
+for images without a near-duplicate.
+
+Lookups use multi-index hashing: the hash is also stored as four 16-bit
+chunks in indexed columns (phash_0..phash_3). Two hashes within d bits
+have some chunk differing in at most d // 4 bits (pigeonhole), so probing
+every chunk value within that radius is an indexed IN query that finds
+all candidates without comparing against the whole library.
+
+`assign_cluster` keeps clusters current as images are analyzed;
+`cluster_library` rebuilds a library in bulk with the same chunk trick done
+as NumPy sort/searchsorted joins (`manage.py cluster_duplicates`).
+"""
+from itertools import combinations
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import ProcessedImage
+
+DUPLICATE_MAX_DISTANCE = getattr(settings, 'DUPLICATE_MAX_DISTANCE', 6)
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_FIELDS = tuple(f"phash_{i}" for i in range(HASH_CHUNKS))
+PAIR_BLOCK = 20_000  # source rows per join step in cluster_library (bounds memory)
+
+
+def hash_chunks(perceptual_hash: Optional[str]) -> List[Optional[int]]:
+    """'8f3a...' -> [0x8f3a, ...], most significant chunk first."""
+    if not perceptual_hash:
+        return [None] * HASH_CHUNKS
+    value = int(perceptual_hash, 16)
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * (HASH_CHUNKS - 1 - i))) & mask for i in range(HASH_CHUNKS)]
+
+
+def set_perceptual_hash(image: ProcessedImage, perceptual_hash: Optional[str]) -> List[str]:
+    """Sets the hash and its chunk columns; returns the field names to save."""
+    image.perceptual_hash = perceptual_hash
+    for field, chunk in zip(CHUNK_FIELDS, hash_chunks(perceptual_hash)):
+        setattr(image, field, chunk)
+    return ['perceptual_hash', *CHUNK_FIELDS]
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def _flip_masks(radius: int) -> List[int]:
+    """Every CHUNK_BITS-bit mask with at most `radius` bits set (0 included)."""
+    return [sum(1 << bit for bit in bits)
+            for r in range(radius + 1) for bits in combinations(range(CHUNK_BITS), r)]
+
+
+def probe_radius(max_distance: int = DUPLICATE_MAX_DISTANCE) -> int:
+    return max_distance // HASH_CHUNKS
+
+
+# --- Incremental ---
+def near_duplicates(image: ProcessedImage, max_distance: int = DUPLICATE_MAX_DISTANCE) -> List[Tuple[int, Optional[int]]]:
+    """[(id, duplicate_group)] of the owner's other images within `max_distance` bits."""
+    if not image.perceptual_hash:
+        return []
+    masks = _flip_masks(probe_radius(max_distance))
+    condition = Q()
+    for field, chunk in zip(CHUNK_FIELDS, hash_chunks(image.perceptual_hash)):
+        condition |= Q(**{f"{field}__in": [chunk ^ mask for mask in masks]})
+    candidates = (
+        ProcessedImage.objects.filter(condition, owner_id=image.owner_id)
+        .exclude(pk=image.pk)
+        .values_list('id', 'perceptual_hash', 'duplicate_group')
+    )
+    return [(pk, group) for pk, other, group in candidates
+            if other and hamming(image.perceptual_hash, other) <= max_distance]
+
+
+def assign_cluster(image: ProcessedImage) -> Optional[int]:
+    """Puts a newly hashed image into its cluster, merging the clusters it bridges."""
+    matches = near_duplicates(image)
+    if not matches:
+        return None
+    members = {image.pk} | {pk for pk, _ in matches}
+    groups = {group for _, group in matches if group is not None}
+    if groups:
+        members |= set(ProcessedImage.objects.filter(owner_id=image.owner_id, duplicate_group__in=groups)
+                       .values_list('id', flat=True))
+    group = min(members)
+    ProcessedImage.objects.filter(id__in=members).exclude(duplicate_group=group).update(duplicate_group=group)
+    image.duplicate_group = group
+    return group
+
+
+def detach(image: ProcessedImage, deleted: bool = False):
+    """
+    Takes an image out of its cluster before it is deleted or re-hashed. A
+    cluster left with one image is dissolved, and one that lost its oldest
+    image is relabelled. (If the image was the only link between two parts,
+    they stay one cluster until the next `cluster_duplicates` run.)
+    """
+    group = image.duplicate_group
+    if group is None:
+        return
+    if not deleted:
+        ProcessedImage.objects.filter(pk=image.pk).update(duplicate_group=None)
+        image.duplicate_group = None
+    rest = list(ProcessedImage.objects.filter(owner_id=image.owner_id, duplicate_group=group)
+                .exclude(pk=image.pk).values_list('id', flat=True))
+    if len(rest) == 1:
+        ProcessedImage.objects.filter(id__in=rest).update(duplicate_group=None)
+    elif rest and group == image.pk:
+        ProcessedImage.objects.filter(id__in=rest).update(duplicate_group=min(rest))
+
+
+# --- Bulk ---
+def near_duplicate_pairs(hashes, max_distance: int = DUPLICATE_MAX_DISTANCE):
+    """
+    (i, j) index arrays, i < j, of every pair of `hashes` (uint64 array)
+    within `max_distance` bits: per chunk, a sorted copy is joined against
+    each probe value with searchsorted, then candidates are verified.
+    """
+    import numpy as np
+
+    n = len(hashes)
+    masks = np.array(_flip_masks(probe_radius(max_distance)), dtype=np.int64)
+    left, right = [], []
+    for c in range(HASH_CHUNKS):
+        shift = np.uint64(CHUNK_BITS * (HASH_CHUNKS - 1 - c))
+        chunk = ((hashes >> shift) & np.uint64((1 << CHUNK_BITS) - 1)).astype(np.int64)
+        order = np.argsort(chunk, kind="stable")
+        sorted_chunk = chunk[order]
+        for start in range(0, n, PAIR_BLOCK):
+            sources = np.arange(start, min(n, start + PAIR_BLOCK))
+            for mask in masks:
+                keys = chunk[sources] ^ mask
+                lo = np.searchsorted(sorted_chunk, keys, side="left")
+                counts = np.searchsorted(sorted_chunk, keys, side="right") - lo
+                total = int(counts.sum())
+                if not total:
+                    continue
+                src = np.repeat(sources, counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                dst = order[np.repeat(lo, counts) + offsets]
+                keep = src < dst
+                left.append(src[keep])
+                right.append(dst[keep])
+    if not left:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    i, j = np.concatenate(left), np.concatenate(right)
+    # A pair sharing several chunks was found once per chunk
+    unique = np.unique(i * n + j)
+    i, j = unique // n, unique % n
+    xor = np.ascontiguousarray(hashes[i] ^ hashes[j])
+    distance = np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+    close = distance <= max_distance
+    return i[close], j[close]
+
+
+def connected_components(n: int, i, j):
+    """Label of every node = smallest node index of its component (min-label hooking + pointer jumping)."""
+    import numpy as np
+
+    parent = np.arange(n)
+    while True:
+        ri, rj = parent[i], parent[j]
+        low, high = np.minimum(ri, rj), np.maximum(ri, rj)
+        differ = low != high
+        if not differ.any():
+            return parent
+        np.minimum.at(parent, high[differ], low[differ])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+
+def cluster_library(owner_id: int, max_distance: int = DUPLICATE_MAX_DISTANCE) -> dict:
+    """Recomputes every cluster of one library; returns {'images', 'clusters', 'clustered'}."""
+    import numpy as np
+
+    rows = list(ProcessedImage.objects.filter(owner_id=owner_id, perceptual_hash__isnull=False)
+                .order_by('id').values_list('id', 'perceptual_hash'))
+    rows = [(pk, value) for pk, value in rows if value]
+    ids = np.array([pk for pk, _ in rows], dtype=np.int64)
+    hashes = np.array([int(value, 16) for _, value in rows], dtype=np.uint64)
+    i, j = near_duplicate_pairs(hashes, max_distance)
+    # Rows are in id order, so a component's smallest index is its oldest image
+    labels = connected_components(len(rows), i, j)
+    sizes = np.bincount(labels, minlength=len(rows))
+    groups = {}
+    for index in np.nonzero(sizes[labels] > 1)[0]:
+        groups.setdefault(int(ids[labels[index]]), []).append(int(ids[index]))
+    with transaction.atomic():
+        ProcessedImage.objects.filter(owner_id=owner_id, duplicate_group__isnull=False).update(duplicate_group=None)
+        for group, members in groups.items():
+            ProcessedImage.objects.filter(id__in=members).update(duplicate_group=group)
+    return {'images': len(rows), 'clusters': len(groups), 'clustered': sum(len(m) for m in groups.values())}
+
+
+# --- Queries ---
+def collapse_duplicates(queryset):
+    """One image per cluster (its oldest) plus every image without near-duplicates."""
+    return queryset.filter(Q(duplicate_group__isnull=True) | Q(id=F('duplicate_group')))
+
+
+def cluster_sizes(owner):
+    """(duplicate_group, size) rows of a library, largest clusters first."""
+    return (
+        ProcessedImage.objects.filter(owner=owner, duplicate_group__isnull=False)
+        .values('duplicate_group')
+        .annotate(size=Count('id'))
+        .order_by('-size', 'duplicate_group')
+    )
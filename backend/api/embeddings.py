@@ -0,0 +1,414 @@
+"""
+Image embeddings and "find similar" search.
+
+The analysis workers keep ResNet50's penultimate layer (2048 floats) for
+every image, L2-normalised so cosine similarity is a dot product, and
+append it to an `EmbeddingStore`: flat, append-only files under
+EMBEDDING_DIR that are memory-mapped for reading, so neither the workers
+nor the API hold the vectors in RAM.
+
+    vectors.float16 | vectors.int8 (+ scales.float32)  one row per add()
+    ids.int64                                          image id of each row
+    assign.int32                                       IVF list of each row (-1 = not assigned yet)
+    centroids.npy, meta.json                           the IVF coarse quantizer
+
+Re-analysing an image appends a new row; the last row of an id wins.
+
+Search is exact (chunked NumPy dot products) for up to EMBEDDING_BRUTE_FORCE_MAX
+rows or candidates, and IVF above that: k-means centroids trained on a
+sample, every new row assigned to its nearest centroid as it is added
+(incremental), and a query only scans the rows of its `nprobe` nearest
+lists plus any not yet assigned. `build_index` retrains when the store
+has grown a lot since the last training (`needs_training`).
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .pipeline import RESNET_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 2048
+EMBEDDING_DIR = Path(getattr(settings, 'EMBEDDING_DIR', settings.BASE_DIR / 'embeddings'))
+# 'float16' (4 KB per image) or 'int8' with a per-row scale (2 KB per image)
+EMBEDDING_DTYPE = getattr(settings, 'EMBEDDING_DTYPE', 'float16')
+BRUTE_FORCE_MAX = getattr(settings, 'EMBEDDING_BRUTE_FORCE_MAX', 50_000)
+IVF_NPROBE = getattr(settings, 'EMBEDDING_IVF_NPROBE', 16)
+# Retrain the centroids once the store is this many times larger than when they were trained
+RETRAIN_GROWTH = 2.0
+TRAIN_SAMPLE = 50_000
+CHUNK_ROWS = 8192  # rows decoded to float32 at a time (64 MB at 2048-d)
+DTYPES = ('float16', 'int8')
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _mtime(path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first."""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class _View:
+    """Read-only memory maps of the first `count` rows of a store."""
+
+    def __init__(self, store: "EmbeddingStore", count: int, previous: "_View" = None):
+        self.count = count
+        self.assign_mtime = _mtime(store.assign_path)
+        dim, item = store.dim, np.dtype(store.dtype)
+        if count:
+            self.vectors = np.memmap(store.vectors_path, dtype=item, mode="r", shape=(count, dim))
+            self.ids = np.memmap(store.ids_path, dtype=np.int64, mode="r", shape=(count,))
+            self.assign = np.memmap(store.assign_path, dtype=np.int32, mode="r", shape=(count,))
+            self.scales = (np.memmap(store.scales_path, dtype=np.float32, mode="r", shape=(count,))
+                           if store.dtype == "int8" else None)
+        else:
+            self.vectors = np.zeros((0, dim), dtype=item)
+            self.ids = np.zeros(0, dtype=np.int64)
+            self.assign = np.zeros(0, dtype=np.int32)
+            self.scales = np.zeros(0, dtype=np.float32) if store.dtype == "int8" else None
+        # Latest row per image id (re-analysis appends a newer one); extended, not rebuilt, on appends
+        start = previous.count if previous is not None and previous.count <= count else 0
+        self.row_of = dict(previous.row_of) if start else {}
+        self.row_of.update(zip(self.ids[start:].tolist(), range(start, count)))
+
+    def decode(self, rows) -> np.ndarray:
+        block = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            block *= np.asarray(self.scales[rows], dtype=np.float32)[:, None]
+        return block
+
+    def is_live(self, row: int) -> bool:
+        return self.row_of.get(int(self.ids[row])) == row
+
+
+class EmbeddingStore:
+    def __init__(self, directory=None, dim: int = EMBEDDING_DIM, dtype: str = EMBEDDING_DTYPE):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {DTYPES}")
+        self.directory = Path(directory or EMBEDDING_DIR / f"resnet50-{RESNET_WEIGHTS}")
+        self.dim = dim
+        self.dtype = dtype
+        self.vectors_path = self.directory / f"vectors.{dtype}"
+        self.scales_path = self.directory / "scales.float32"
+        self.ids_path = self.directory / "ids.int64"
+        self.assign_path = self.directory / "assign.int32"
+        self.centroids_path = self.directory / "centroids.npy"
+        self.meta_path = self.directory / "meta.json"
+        self._lock = threading.Lock()
+        self._view: Optional[_View] = None
+        self._centroids = None
+        self._centroids_mtime = None
+
+    # --- Writing ---
+    @contextmanager
+    def _file_lock(self):
+        """Serialises appends and index swaps across worker processes."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _encode(self, vectors: np.ndarray):
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def add(self, image_ids: Iterable[int], vectors) -> int:
+        """Appends normalised vectors for `image_ids`; returns the new row count."""
+        image_ids = np.asarray(list(image_ids), dtype=np.int64)
+        vectors = normalize(vectors)
+        if vectors.shape != (len(image_ids), self.dim):
+            raise ValueError(f"Expected {len(image_ids)} x {self.dim} vectors, got {vectors.shape}")
+        encoded, scales = self._encode(vectors)
+        with self._file_lock():
+            # Under the lock so a concurrent build_index can't swap the centroids in between
+            centroids = self.centroids()
+            assign = (np.argmax(vectors @ centroids.T, axis=1).astype(np.int32) if centroids is not None
+                      else np.full(len(image_ids), -1, dtype=np.int32))
+            self._truncate_partial_rows()
+            # ids are written last: readers size everything from them, so a torn append is invisible
+            with open(self.vectors_path, "ab") as f:
+                f.write(encoded.tobytes())
+            if scales is not None:
+                with open(self.scales_path, "ab") as f:
+                    f.write(scales.tobytes())
+            with open(self.assign_path, "ab") as f:
+                f.write(assign.tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(image_ids.tobytes())
+            return self._file_count()
+
+    def copy(self, source_id: int, target_id: int) -> bool:
+        """Gives `target_id` the embedding of `source_id` (exact duplicates share bytes)."""
+        vector = self.get(source_id)
+        if vector is None:
+            return False
+        self.add([target_id], vector[None])
+        return True
+
+    def _truncate_partial_rows(self):
+        """Drops the tail of an append that died half-way, so every file has the same row count."""
+        count = self._file_count()
+        for path, row_bytes in self._row_bytes():
+            if path.exists() and os.path.getsize(path) != count * row_bytes:
+                os.truncate(path, count * row_bytes)
+
+    # --- Reading ---
+    def _row_bytes(self):
+        files = [(self.vectors_path, self.dim * np.dtype(self.dtype).itemsize),
+                 (self.ids_path, 8), (self.assign_path, 4)]
+        if self.dtype == "int8":
+            files.append((self.scales_path, 4))
+        return files
+
+    def _file_count(self) -> int:
+        try:
+            return min(os.path.getsize(path) // row_bytes for path, row_bytes in self._row_bytes())
+        except OSError:
+            return 0
+
+    def view(self) -> _View:
+        """Current memory maps, reopened only when rows were appended or the index was rebuilt."""
+        count = self._file_count()
+        assign_mtime = _mtime(self.assign_path)
+        with self._lock:
+            current = self._view
+            if current is None or current.count != count or current.assign_mtime != assign_mtime:
+                self._view = _View(self, count, previous=current)
+            return self._view
+
+    def __len__(self):
+        return self.view().count
+
+    def get(self, image_id: int) -> Optional[np.ndarray]:
+        view = self.view()
+        row = view.row_of.get(int(image_id))
+        return None if row is None else view.decode([row])[0]
+
+    def centroids(self) -> Optional[np.ndarray]:
+        try:
+            mtime = os.path.getmtime(self.centroids_path)
+        except OSError:
+            return None
+        if mtime != self._centroids_mtime:
+            self._centroids = np.load(self.centroids_path)
+            self._centroids_mtime = mtime
+        return self._centroids
+
+    def meta(self) -> dict:
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # --- IVF index ---
+    def needs_training(self) -> bool:
+        count = len(self)
+        if count <= BRUTE_FORCE_MAX:
+            return False
+        trained = self.meta().get("trained_count", 0)
+        return not trained or count >= trained * RETRAIN_GROWTH
+
+    def build_index(self, nlist: int = None, iterations: int = 10, seed: int = 0) -> dict:
+        """
+        Trains k-means centroids on a sample and (re)assigns every row. Rows
+        appended meanwhile are assigned under the write lock before the swap.
+        """
+        view = self.view()
+        count = view.count
+        if count == 0:
+            return {}
+        nlist = nlist or max(1, min(4096, int(np.sqrt(count))))
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, size=min(count, max(TRAIN_SAMPLE, nlist * 40)), replace=False))
+        sample = view.decode(sample_rows)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable")
+            bounds = np.searchsorted(labels[order], np.arange(nlist + 1))
+            for c in range(nlist):
+                if bounds[c + 1] > bounds[c]:  # empty lists keep their previous centroid
+                    centroids[c] = sample[order[bounds[c]:bounds[c + 1]]].mean(axis=0)
+            centroids = normalize(centroids)  # spherical k-means: cosine geometry
+
+        assign = np.empty(count, dtype=np.int32)
+        for start in range(0, count, CHUNK_ROWS):
+            block = view.decode(slice(start, min(count, start + CHUNK_ROWS)))
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        with self._file_lock():
+            latest = _View(self, self._file_count(), previous=view)
+            if latest.count > count:
+                tail = latest.decode(slice(count, latest.count))
+                assign = np.concatenate([assign, np.argmax(tail @ centroids.T, axis=1).astype(np.int32)])
+            tmp = self.assign_path.with_suffix(".tmp")
+            assign.tofile(tmp)
+            os.replace(tmp, self.assign_path)
+            np.save(self.centroids_path.with_suffix(".tmp.npy"), centroids.astype(np.float32))
+            os.replace(self.centroids_path.with_suffix(".tmp.npy"), self.centroids_path)
+            meta = {"dim": self.dim, "dtype": self.dtype, "nlist": nlist, "trained_count": len(assign)}
+            with open(self.meta_path, "w") as f:
+                json.dump(meta, f)
+        with self._lock:
+            self._view = None
+        return meta
+
+    # --- Search ---
+    def _exact(self, view: _View, query: np.ndarray, k: int, rows=None) -> List[Tuple[int, float]]:
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            if not len(rows):
+                return []
+            scores = np.concatenate([view.decode(rows[i:i + CHUNK_ROWS]) @ query
+                                     for i in range(0, len(rows), CHUNK_ROWS)])
+            best = _top_k(scores, k)
+            return [(int(rows[i]), float(scores[i])) for i in best]
+        hits = []
+        for start in range(0, view.count, CHUNK_ROWS):
+            scores = view.decode(slice(start, min(view.count, start + CHUNK_ROWS))) @ query
+            hits.extend((start + int(i), float(scores[i])) for i in _top_k(scores, k))
+        hits.sort(key=lambda hit: -hit[1])
+        return hits[:k]
+
+    def _ivf(self, view: _View, query: np.ndarray, k: int, nprobe: int) -> List[Tuple[int, float]]:
+        centroids = self.centroids()
+        probes = _top_k(centroids @ query, nprobe)
+        # Rows in the probed lists, plus rows added before any centroids existed
+        rows = np.nonzero(np.isin(view.assign, np.append(probes, -1)))[0]
+        return self._exact(view, query, k, rows)
+
+    def search(self, vector, k: int = 20, candidate_ids: Optional[Iterable[int]] = None,
+               accept: Callable[[List[int]], set] = None, exclude_id: int = None,
+               nprobe: int = IVF_NPROBE) -> List[Tuple[int, float]]:
+        """
+        [(image_id, cosine similarity)] best first. Restrict to `candidate_ids`
+        when the allowed set is small enough to list; otherwise pass `accept`,
+        which receives found ids and returns those allowed (checked after the
+        ANN search, over-fetching until k are found).
+        """
+        view = self.view()
+        query = normalize(vector)[0]
+        if candidate_ids is not None:
+            rows = sorted(view.row_of[i] for i in candidate_ids if i in view.row_of and i != exclude_id)
+            hits = self._exact(view, query, k, rows)
+            return [(int(view.ids[row]), score) for row, score in hits]
+
+        centroids = self.centroids() if view.count > BRUTE_FORCE_MAX else None
+        fetch = k * 4
+        while True:
+            fetch = min(fetch, view.count)
+            if centroids is not None:
+                hits = self._ivf(view, query, fetch, nprobe)
+                exhausted = fetch >= view.count or (nprobe >= len(centroids) and len(hits) < fetch)
+            else:
+                hits = self._exact(view, query, fetch)
+                exhausted = fetch >= view.count or len(hits) < fetch
+            found, seen = [], set()
+            for row, score in hits:
+                image_id = int(view.ids[row])
+                if image_id != exclude_id and image_id not in seen and view.is_live(row):
+                    seen.add(image_id)
+                    found.append((image_id, score))
+            if accept is not None:
+                allowed = accept([image_id for image_id, _ in found])
+                found = [hit for hit in found if hit[0] in allowed]
+            if len(found) >= k or exhausted:
+                return found[:k]
+            # Not enough survivors: over-fetch more and widen the probe
+            fetch *= 4
+            nprobe *= 2
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> EmbeddingStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore()
+    return _store
+
+
+def save_embedding(image, results: dict):
+    """Stores the embedding in `results`, or copies one from an exact duplicate (cache hits have none)."""
+    store = get_store()
+    embedding = results.get("embedding")
+    if embedding is not None:
+        store.add([image.pk], np.asarray(embedding)[None])
+        return
+    if not image.content_hash:
+        return
+    from .models import ProcessedImage
+
+    view = store.view()
+    siblings = (ProcessedImage.objects.filter(content_hash=image.content_hash)
+                .exclude(pk=image.pk).values_list('pk', flat=True))
+    for sibling in siblings:
+        if sibling in view.row_of:
+            store.copy(sibling, image.pk)
+            return
+
+
+def safe_save_embedding(image, results: dict):
+    """save_embedding for the analysis path: the similarity index must not fail the job."""
+    try:
+        save_embedding(image, results)
+    except Exception:
+        logger.exception("Could not store the embedding of image %s", image.pk)
+
+
+def train_index_if_needed() -> bool:
+    """
+    (Re)trains the IVF index when the store outgrew it. Called by idle
+    workers; a non-blocking lock keeps it to one process at a time.
+    """
+    store = get_store()
+    if not store.needs_training():
+        return False
+    with open(store.directory / ".train.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            if not store.needs_training():
+                return False
+            started = time.perf_counter()
+            meta = store.build_index()
+            logger.info("Trained the embedding index: %s lists over %s vectors in %.1fs",
+                        meta.get("nlist"), meta.get("trained_count"), time.perf_counter() - started)
+            return True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,160 @@
+"""
+Response cache for the anonymous feeds (public gallery, marketplace).
+
+Entries live in the Django cache named by FEED_CACHE_ALIAS (file or Redis,
+see settings; it must be shared with the workers, which invalidate too) under one key per feed + query string + host, and
+hold {'generation', 'built_at', 'data'}. Each feed has a generation
+counter; `invalidate` bumps it whenever a change could alter the feed, so
+every cached page of that feed becomes stale at once without deleting keys.
+
+Stale-while-revalidate: a stale entry (old generation, or older than
+FEED_CACHE_SECONDS) is still served for up to FEED_CACHE_STALE_SECONDS
+while exactly one request, the one that wins a cache.add() lock, rebuilds
+it. A burst of traffic on a cold or invalidated page therefore runs the
+feed query once, not once per visitor.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_FEED = 'public'
+MARKETPLACE_FEED = 'marketplace'
+FEEDS = (PUBLIC_FEED, MARKETPLACE_FEED)
+
+CACHE_ALIAS = getattr(settings, 'FEED_CACHE_ALIAS', 'default')
+FRESH_SECONDS = getattr(settings, 'FEED_CACHE_SECONDS', 30)
+STALE_SECONDS = getattr(settings, 'FEED_CACHE_STALE_SECONDS', 300)
+LOCK_SECONDS = 10
+# How long a request without any entry waits for another request's rebuild
+COLD_WAIT_SECONDS = 2.0
+
+FEED_CACHE_LOOKUPS = registry.counter(
+    "pixsort_feed_cache_lookups_total", "Feed cache lookups by feed and result (hit, stale, miss).")
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_key(feed: str) -> str:
+    return f"feed:{feed}:generation"
+
+
+def current_generation(feed: str) -> int:
+    return _cache().get(_generation_key(feed), 0)
+
+
+def invalidate(*feeds: str):
+    """Marks every cached page of `feeds` stale."""
+    cache = _cache()
+    for feed in feeds:
+        key = _generation_key(feed)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def feed_state(image) -> dict:
+    """What the feeds show of an image; a change in any of these invalidates the feeds it is (or was) in."""
+    return {
+        'is_public': bool(image.is_public),
+        'for_sale': bool(image.for_sale),
+        'price': str(image.price) if image.price is not None else None,
+        'sold_to': image.sold_to_id,
+        'title': image.title,
+        'description': image.description,
+        'detailed_labels': list(image.detailed_labels or []),
+    }
+
+
+def _feeds_showing(state) -> set:
+    if state is None:
+        return set()
+    feeds = set()
+    if state['is_public']:
+        feeds.add(PUBLIC_FEED)
+    if state['for_sale'] and state['sold_to'] is None:
+        feeds.add(MARKETPLACE_FEED)
+    return feeds
+
+
+def record_change(before, after):
+    """Invalidates the feeds affected by an image going from state `before` to `after` (None = absent)."""
+    if before == after:
+        return
+    feeds = _feeds_showing(before) | _feeds_showing(after)
+    if feeds:
+        invalidate(*sorted(feeds))
+
+
+def page_key(feed: str, request) -> str:
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.items()))
+    raw = f"{request.scheme}://{request.get_host()}?{query}"
+    return f"feed:{feed}:page:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+def get_or_build(feed: str, key: str, build):
+    """Returns (data, result) where result is 'hit', 'stale' or 'miss'."""
+    cache = _cache()
+    generation = current_generation(feed)
+    entry = cache.get(key)
+    now = time.time()
+
+    if entry is not None and entry['generation'] == generation and now - entry['built_at'] < FRESH_SECONDS:
+        FEED_CACHE_LOOKUPS.inc(feed=feed, result='hit')
+        return entry['data'], 'hit'
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, timeout=LOCK_SECONDS):
+        # Someone else is rebuilding this page
+        if entry is not None:
+            FEED_CACHE_LOOKUPS.inc(feed=feed, result='stale')
+            return entry['data'], 'stale'
+        deadline = now + COLD_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                FEED_CACHE_LOOKUPS.inc(feed=feed, result='stale')
+                return entry['data'], 'stale'
+        # The rebuild is taking too long; build our own copy rather than fail
+
+    try:
+        data = build()
+        # Tag with the generation read *before* building: a change made meanwhile leaves it stale
+        cache.set(key, {'generation': generation, 'built_at': time.time(), 'data': data},
+                  timeout=FRESH_SECONDS + STALE_SECONDS)
+    finally:
+        cache.delete(lock_key)
+    FEED_CACHE_LOOKUPS.inc(feed=feed, result='miss')
+    return data, 'miss'
+
+
+def _plain(value):
+    # Serializer output (ReturnDict/ReturnList) keeps a reference to its serializer; cache plain data
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+class CachedFeedMixin:
+    """For the anonymous feed list views: set `feed_name` to one of FEEDS."""
+    feed_name = None
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            return _plain(super(CachedFeedMixin, self).list(request, *args, **kwargs).data)
+
+        data, result = get_or_build(self.feed_name, page_key(self.feed_name, request), build)
+        return Response(data, headers={'X-Feed-Cache': result})
@@ -0,0 +1,232 @@
+"""
+Upload size guards and resolution-aware decoding.
+
+Limits (IMAGE_MAX_UPLOAD_BYTES, IMAGE_MAX_PIXELS) are enforced three times,
+cheapest first:
+  - `UploadLimitsHandler` (the base of uploads.StreamingImageUploadHandler)
+    while the multipart body streams in: the byte count per file, and the
+    pixel count as soon as the image header has arrived, so an oversized
+    upload is dropped before it is fully received;
+  - `check_upload` in the serializer, for files that arrive another way
+    (zip members in bulk uploads);
+  - `decode_file` in the workers (pixels only), before anything is decoded.
+
+Decoding reads only the header first (PIL, lazy) and then asks OpenCV for
+the smallest JPEG DCT scale (IMREAD_REDUCED_*: 1/2, 1/4, 1/8) that still
+covers what the stages need: YOLO letterboxes to 640, the person gate looks
+at <= ANALYSIS_GATE_MAX_SIDE, ResNet resizes the short side to 256 and the
+largest thumbnail is max(THUMBNAIL_WIDTHS) wide. A 48 MP photo then decodes
+at 12 or 3 MP instead of 48. (Other formats are decoded at full size and
+shrunk by OpenCV, so only the pixel limit bounds them.)
+
+EXIF orientation is applied exactly once, here, on the reduced array;
+OpenCV's own auto-rotation is disabled so every format behaves the same.
+"""
+import struct
+from collections import namedtuple
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from PIL import Image
+
+MAX_UPLOAD_BYTES = getattr(settings, 'IMAGE_MAX_UPLOAD_BYTES', 50 * 1024 * 1024)
+MAX_PIXELS = getattr(settings, 'IMAGE_MAX_PIXELS', 100_000_000)
+REDUCED_DECODE = getattr(settings, 'ANALYSIS_REDUCED_DECODE', True)
+# Bytes of an upload kept to find the header in; EXIF can push the JPEG SOF past 64 KB
+HEADER_PROBE_BYTES = 1024 * 1024
+# Fields whose files are single images (bulk archives have their own per-member limit)
+IMAGE_FIELDS = ('image_file', 'images')
+
+# PIL's own decompression-bomb check follows the same limit
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+EXIF_ORIENTATION = 0x0112
+REDUCTION_FACTORS = (8, 4, 2)
+
+ImageHeader = namedtuple('ImageHeader', 'width height orientation format')
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def _decode_needs():
+    """(min width, min long side, min short side) the decoded array must keep."""
+    from .onnx_backend import RESNET_RESIZE, YOLO_IMGSZ
+    from .thumbnails import THUMBNAIL_WIDTHS
+
+    gate_side = getattr(settings, 'ANALYSIS_GATE_MAX_SIDE', 640)
+    if not gate_side:
+        return None  # the gate runs at full resolution
+    return max(THUMBNAIL_WIDTHS), max(YOLO_IMGSZ, gate_side), max(RESNET_RESIZE.values())
+
+
+def decode_policy() -> str:
+    """Part of the pipeline version: reduced decoding can shift labels slightly."""
+    return "reduced" if REDUCED_DECODE and _decode_needs() else "full"
+
+
+# --- Headers and limits ---
+def read_header(source) -> ImageHeader:
+    """Size as displayed (EXIF orientation applied), without decoding pixels."""
+    try:
+        opened = Image.open(BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    except Image.DecompressionBombError as e:
+        # PIL refuses headers over twice MAX_IMAGE_PIXELS outright; that is a limit hit, not a bad header
+        raise ImageTooLarge(str(e)) from e
+    try:
+        width, height = opened.size
+        try:
+            orientation = int(opened.getexif().get(EXIF_ORIENTATION, 1))
+        except Exception:
+            orientation = 1
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        return ImageHeader(width, height, orientation, opened.format)
+    finally:
+        if not hasattr(source, 'read'):
+            opened.close()
+
+
+def check_pixels(width: int, height: int):
+    if width * height > MAX_PIXELS:
+        raise ImageTooLarge(f"Image is {width}x{height} ({width * height / 1e6:.0f} MP); "
+                            f"the limit is {MAX_PIXELS / 1e6:.0f} MP.")
+
+
+def check_bytes(size: int):
+    if size > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+
+
+def check_upload(file_obj) -> ImageHeader:
+    """Both limits for an uploaded file object; leaves its position at 0."""
+    check_bytes(file_obj.size)
+    file_obj.seek(0)
+    try:
+        header = read_header(file_obj)
+    finally:
+        file_obj.seek(0)
+    check_pixels(header.width, header.height)
+    return header
+
+
+class UploadLimitsHandler(FileUploadHandler):
+    """
+    First in the upload handler chain: counts each image file's bytes and
+    parses its header from the first chunks. A file over a limit is skipped
+    (the rest of its part is discarded unread) and the reason is kept in
+    request.upload_limit_errors for the view to report.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name in IMAGE_FIELDS
+        self.received = 0
+        self.head = bytearray()
+        self.header_checked = False
+
+    def _reject(self, message, reason='too_large'):
+        """`reason` tells the views which status to answer: 'too_large' (413) or 'unsupported' (415)."""
+        errors = getattr(self.request, 'upload_limit_errors', [])
+        errors.append({'file': self.file_name, 'error': message, 'reason': reason})
+        self.request.upload_limit_errors = errors
+        raise SkipFile(message)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.received += len(raw_data)
+        try:
+            check_bytes(self.received)
+            if not self.header_checked:
+                self.head += raw_data
+                try:
+                    header = read_header(bytes(self.head))
+                except ImageTooLarge:
+                    raise
+                except (OSError, SyntaxError, ValueError, EOFError, struct.error):
+                    # Truncated or not yet identifiable; past the probe size, leave it to the serializer
+                    self.header_checked = len(self.head) >= HEADER_PROBE_BYTES
+                else:
+                    self.header_checked = True
+                    check_pixels(header.width, header.height)
+                if self.header_checked:
+                    self.head = bytearray()
+        except ImageTooLarge as e:
+            self._reject(str(e))
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None  # the next handler in the chain builds the UploadedFile
+
+
+# --- Decoding ---
+def reduction_factor(header: ImageHeader) -> int:
+    """Largest JPEG DCT scale (8, 4, 2) that keeps every stage's input, else 1."""
+    needs = _decode_needs() if REDUCED_DECODE else None
+    if needs is None or header.format != 'JPEG':
+        return 1
+    min_width, min_long, min_short = needs
+    long_side, short_side = max(header.width, header.height), min(header.width, header.height)
+    for factor in REDUCTION_FACTORS:
+        if (header.width // factor >= min(header.width, min_width)
+                and long_side // factor >= min(long_side, min_long)
+                and short_side // factor >= min(short_side, min_short)):
+            return factor
+    return 1
+
+
+def apply_orientation(bgr, orientation: int):
+    """Rotates/flips a decoded array upright, like PIL's ImageOps.exif_transpose."""
+    import cv2
+
+    if orientation == 2:
+        return cv2.flip(bgr, 1)
+    if orientation == 3:
+        return cv2.rotate(bgr, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(bgr, 0)
+    if orientation == 5:
+        return cv2.transpose(bgr)
+    if orientation == 6:
+        return cv2.rotate(bgr, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(bgr), -1)
+    if orientation == 8:
+        return cv2.rotate(bgr, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return bgr
+
+
+def decode_buffer(data, name: str = "image", reduce: bool = True):
+    """(upright BGR array, ImageHeader of the original) from encoded bytes, within the limits."""
+    import cv2
+    import numpy as np
+
+    buffer = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray)) else data
+    try:
+        header = read_header(buffer[:HEADER_PROBE_BYTES].tobytes())
+    except ImageTooLarge:
+        raise
+    except Exception:
+        header = None  # let OpenCV try; it knows a few formats PIL doesn't
+    if header is not None:
+        check_pixels(header.width, header.height)
+    factor = reduction_factor(header) if header is not None and reduce else 1
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+             4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[factor]
+    bgr = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if bgr is None:
+        raise ValueError(f"Failed to decode image: {name}")
+    if header is None:
+        height, width = bgr.shape[:2]
+        check_pixels(width, height)
+        return bgr, ImageHeader(width, height, 1, None)
+    return apply_orientation(bgr, header.orientation), header
+
+
+def decode_file(path, reduce: bool = True):
+    import numpy as np
+
+    return decode_buffer(np.fromfile(str(path), dtype=np.uint8), name=path.name, reduce=reduce)
@@ -0,0 +1,291 @@
+"""
+Durable analysis job queue.
+
+Uploads only create an `AnalysisJob` row; the heavy pipeline in `analysis.py`
+runs in the worker processes started by `manage.py run_analysis_worker`.
+Jobs are claimed with a conditional update so several workers can poll the
+same table without running a job twice.
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .analysis_cache import current_pipeline_version, get_cached_results, store_results
+from .duplicates import assign_cluster, detach, set_perceptual_hash
+from .embeddings import safe_save_embedding
+from .feed_cache import feed_state, record_change as feed_record_change
+from .label_index import sync_image_labels
+from .user_stats import image_state, record_change
+from .metrics import JOBS_FINISHED, stage_timer
+from .models import AnalysisJob, ProcessedImage
+from .storage import local_path
+from .thumbnails import generate_thumbnails, safe_generate_thumbnails
+
+logger = logging.getLogger(__name__)
+
+# How long a job may stay "running" before we assume its worker died.
+JOB_LEASE_SECONDS = getattr(settings, 'ANALYSIS_JOB_LEASE_SECONDS', 600)
+# Base delay for retries: 1st retry after RETRY_BACKOFF_SECONDS, then x2 each time.
+RETRY_BACKOFF_SECONDS = getattr(settings, 'ANALYSIS_JOB_RETRY_BACKOFF_SECONDS', 10)
+MAX_ATTEMPTS = getattr(settings, 'ANALYSIS_JOB_MAX_ATTEMPTS', 3)
+BATCH_MAX_SIZE = getattr(settings, 'ANALYSIS_BATCH_MAX_SIZE', 8)
+BATCH_MAX_WAIT_MS = getattr(settings, 'ANALYSIS_BATCH_MAX_WAIT_MS', 50)
+CATEGORY_FILE = getattr(settings, 'CATEGORY_FILE', settings.BASE_DIR / 'categories.json')
+CATEGORY_INDEX_FILE = getattr(settings, 'CATEGORY_INDEX_FILE', settings.BASE_DIR / 'category_index.json')
+COMPUTE_PERCEPTUAL_HASH = getattr(settings, 'ANALYSIS_PERCEPTUAL_HASH', True)
+COMPUTE_EMBEDDING = getattr(settings, 'ANALYSIS_EMBEDDINGS', True)
+PERSON_GATE = getattr(settings, 'ANALYSIS_PERSON_GATE', 'hog')
+GATE_MAX_SIDE = getattr(settings, 'ANALYSIS_GATE_MAX_SIDE', 640)
+# Keep per-image routing/timing details on ProcessedImage.analysis_debug
+STORE_DEBUG = getattr(settings, 'ANALYSIS_STORE_DEBUG', True)
+
+_category_map = None
+
+
+def get_category_map(rebuild: bool = False):
+    """
+    Loads the precomputed label -> category index once per worker process,
+    rebuilding it first if categories.json or the models changed.
+    """
+    global _category_map
+    if _category_map is None or rebuild:
+        from .category_index import load_category_index
+
+        def labels_provider():
+            from .analysis import model_label_vocabulary
+            return model_label_vocabulary()
+
+        _category_map = load_category_index(CATEGORY_FILE, CATEGORY_INDEX_FILE, labels_provider, rebuild=rebuild)
+    return _category_map
+
+
+def enqueue_analysis(image: ProcessedImage) -> AnalysisJob:
+    """
+    Queues analysis for an image. Exact duplicates of already analyzed bytes
+    are resolved from the cache immediately and get an already-finished job.
+    """
+    cached = get_cached_results(image.content_hash)
+    if cached is not None:
+        save_analysis_results(image, cached, cached=True)
+        # Same bytes, same derivative names: reuse them if the first copy has them already
+        try:
+            generate_thumbnails(image, allow_decode=False)
+        except OSError:
+            pass  # the backfill command or a later reanalysis fills them in
+        JOBS_FINISHED.inc(outcome="succeeded")
+        now = timezone.now()
+        return AnalysisJob.objects.create(
+            image=image, max_attempts=MAX_ATTEMPTS, status=AnalysisJob.STATUS_SUCCEEDED, finished_at=now,
+        )
+    return AnalysisJob.objects.create(image=image, max_attempts=MAX_ATTEMPTS)
+
+
+def claim_next_job():
+    """
+    Atomically moves one due pending job to "running" and returns it.
+    Returns None when nothing is due.
+    """
+    now = timezone.now()
+    candidates = (
+        AnalysisJob.objects
+        .filter(status=AnalysisJob.STATUS_PENDING, run_after__lte=now)
+        .order_by('run_after', 'id')
+        .values_list('id', 'attempts')[:10]
+    )
+    for job_id, attempts in candidates:
+        # Compare-and-set: only one worker can win the pending -> running transition
+        claimed = AnalysisJob.objects.filter(
+            pk=job_id, status=AnalysisJob.STATUS_PENDING, attempts=attempts,
+        ).update(status=AnalysisJob.STATUS_RUNNING, attempts=attempts + 1, locked_at=now, updated_at=now)
+        if claimed:
+            return AnalysisJob.objects.select_related('image').get(pk=job_id)
+    return None
+
+
+def claim_job_batch(max_size: int = BATCH_MAX_SIZE, max_wait_ms: int = BATCH_MAX_WAIT_MS) -> list:
+    """
+    Claims up to `max_size` jobs, waiting at most `max_wait_ms` after the first
+    one for more to arrive. Returns an empty list when the queue is empty.
+    """
+    first = claim_next_job()
+    if first is None:
+        return []
+    jobs = [first]
+    deadline = time.monotonic() + max_wait_ms / 1000.0
+    while len(jobs) < max_size:
+        job = claim_next_job()
+        if job is not None:
+            jobs.append(job)
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(remaining, 0.01))
+    return jobs
+
+
+def requeue_stale_jobs() -> int:
+    """Hands jobs whose worker died mid-run back to the queue (or fails them)."""
+    cutoff = timezone.now() - timedelta(seconds=JOB_LEASE_SECONDS)
+    requeued = 0
+    for job in AnalysisJob.objects.filter(status=AnalysisJob.STATUS_RUNNING, locked_at__lt=cutoff):
+        _record_failure(job, "Worker lease expired before the job finished.")
+        requeued += 1
+    return requeued
+
+
+def save_analysis_results(image: ProcessedImage, results: dict, cached: bool = False):
+    before = image_state(image)
+    feed_before = feed_state(image)
+    image.detailed_labels = results.get("detailed_labels", [])
+    image.general_categories = results.get("general_categories", [])
+    update_fields = ['detailed_labels', 'general_categories']
+    old_hash = image.perceptual_hash
+    if results.get("perceptual_hash"):
+        update_fields += set_perceptual_hash(image, results["perceptual_hash"])
+    if STORE_DEBUG:
+        image.analysis_debug = {
+            "cached": cached,
+            "pipeline_version": current_pipeline_version(),
+            "route": results.get("route"),
+            "timings_ms": results.get("timings_ms"),
+        }
+        update_fields.append('analysis_debug')
+    with stage_timer("db_save"):
+        image.save(update_fields=update_fields)
+        sync_image_labels(image)
+        record_change(image.owner_id, before, image_state(image))
+        feed_record_change(feed_before, feed_state(image))
+    if image.perceptual_hash and image.perceptual_hash != old_hash:
+        with stage_timer("duplicates"):
+            detach(image)
+            assign_cluster(image)
+    if COMPUTE_EMBEDDING:
+        safe_save_embedding(image, results)
+
+
+def run_job(job: AnalysisJob) -> AnalysisJob:
+    """Runs the analysis pipeline for a claimed job and records the outcome."""
+    from .analysis import DecodedImage, analyze_image_and_categorize
+
+    decoded = None
+    try:
+        results = get_cached_results(job.image.content_hash)
+        cached = results is not None
+        if not cached:
+            # Decoded once here so the thumbnails reuse the analysis buffer
+            decoded = DecodedImage.from_path(local_path(job.image.image_file))
+            results = analyze_image_and_categorize(
+                image_path=decoded,
+                device=getattr(settings, 'ANALYSIS_DEVICE', 'cpu'),
+                category_map=get_category_map(),
+                compute_phash=COMPUTE_PERCEPTUAL_HASH,
+                gate=PERSON_GATE,
+                gate_max_side=GATE_MAX_SIDE,
+                compute_embedding=COMPUTE_EMBEDDING,
+            )
+            store_results(job.image.content_hash, results)
+        save_analysis_results(job.image, results, cached=cached)
+    except Exception:
+        _record_failure(job, traceback.format_exc())
+        return job
+
+    safe_generate_thumbnails(job.image, decoded)
+    _record_success(job)
+    return job
+
+
+def run_job_batch(jobs: list) -> list:
+    """
+    Runs a group of claimed jobs through `analyze_images_batch` so each model
+    does one forward pass for the whole group. If the batch fails, the jobs
+    are re-run one at a time so a single bad image only fails its own job.
+    """
+    from .analysis import DecodedImage, analyze_images_batch
+
+    # Duplicates that were analyzed since they were queued need no inference
+    to_analyze = []
+    for job in jobs:
+        try:
+            cached = get_cached_results(job.image.content_hash)
+            if cached is None:
+                to_analyze.append(job)
+                continue
+            save_analysis_results(job.image, cached, cached=True)
+        except Exception:
+            _record_failure(job, traceback.format_exc())
+            continue
+        safe_generate_thumbnails(job.image)
+        _record_success(job)
+
+    if len(to_analyze) <= 1:
+        for job in to_analyze:
+            run_job(job)
+        return jobs
+
+    try:
+        decoded = [DecodedImage.from_path(local_path(job.image.image_file)) for job in to_analyze]
+        results = analyze_images_batch(
+            decoded,
+            device=getattr(settings, 'ANALYSIS_DEVICE', 'cpu'),
+            category_map=get_category_map(),
+            compute_phash=COMPUTE_PERCEPTUAL_HASH,
+            gate=PERSON_GATE,
+            gate_max_side=GATE_MAX_SIDE,
+            compute_embedding=COMPUTE_EMBEDDING,
+        )
+    except Exception:
+        logger.exception("Batch of %d jobs failed, retrying them one by one", len(to_analyze))
+        for job in to_analyze:
+            run_job(job)
+        return jobs
+
+    # Each job is saved on its own: one failing write must not strand the rest of the batch as running
+    for job, job_results, image in zip(to_analyze, results, decoded):
+        try:
+            store_results(job.image.content_hash, job_results)
+            save_analysis_results(job.image, job_results)
+        except Exception:
+            _record_failure(job, traceback.format_exc())
+            continue
+        safe_generate_thumbnails(job.image, image)
+        _record_success(job)
+    return jobs
+
+
+def retry_job(job: AnalysisJob) -> bool:
+    """Puts a failed job back in the queue with a fresh set of attempts."""
+    now = timezone.now()
+    updated = AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.STATUS_FAILED).update(
+        status=AnalysisJob.STATUS_PENDING, attempts=0, run_after=now,
+        finished_at=None, updated_at=now,
+    )
+    return bool(updated)
+
+
+def _record_success(job: AnalysisJob):
+    now = timezone.now()
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.STATUS_SUCCEEDED, last_error=None, locked_at=None,
+        finished_at=now, updated_at=now,
+    )
+    job.status = AnalysisJob.STATUS_SUCCEEDED
+    JOBS_FINISHED.inc(outcome="succeeded")
+
+
+def _record_failure(job: AnalysisJob, error: str):
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        fields = dict(status=AnalysisJob.STATUS_FAILED, finished_at=now)
+    else:
+        delay = RETRY_BACKOFF_SECONDS * (2 ** max(job.attempts - 1, 0))
+        fields = dict(status=AnalysisJob.STATUS_PENDING, run_after=now + timedelta(seconds=delay))
+    AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.STATUS_RUNNING).update(last_error=error, locked_at=None, updated_at=now, **fields)
+    job.status = fields['status']
+    job.last_error = error
+    JOBS_FINISHED.inc(outcome="failed" if job.status == AnalysisJob.STATUS_FAILED else "retry")
+    logger.warning("Job %s attempt %s/%s failed: %s", job.pk, job.attempts, job.max_attempts, error.strip().splitlines()[-1])
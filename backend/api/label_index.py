@@ -0,0 +1,145 @@
+"""
+Maintenance and queries for the ImageLabel inverted index.
+
+`sync_image_labels` must run whenever an image's detailed_labels or
+general_categories change; `filter_images` and `facet_counts` answer the
+gallery's exact / prefix / multi-label AND-OR queries from the index.
+"""
+from typing import Iterable, List
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from .models import ImageLabel, ProcessedImage
+
+MATCH_ALL = 'all'
+MATCH_ANY = 'any'
+
+
+def normalize_label(text) -> str:
+    return " ".join(str(text).split()).lower()[:100]
+
+
+def parse_terms(raw) -> List[str]:
+    """'dog, Tabby Cat' -> ['dog', 'tabby cat']"""
+    if not raw:
+        return []
+    return [term for term in (normalize_label(part) for part in raw.split(',')) if term]
+
+
+def _rows_for(image: ProcessedImage) -> List[ImageLabel]:
+    rows, seen = [], set()
+    for kind, values in ((ImageLabel.KIND_LABEL, image.detailed_labels),
+                         (ImageLabel.KIND_CATEGORY, image.general_categories)):
+        for text in values or []:
+            value = normalize_label(text)
+            if value and (kind, value) not in seen:
+                seen.add((kind, value))
+                rows.append(ImageLabel(image=image, owner_id=image.owner_id, kind=kind, value=value, text=str(text)[:100]))
+    return rows
+
+
+def sync_image_labels(image: ProcessedImage):
+    """Replaces the index rows of one image with its current labels and categories."""
+    rows = _rows_for(image)
+    # Both or neither: a failure in between would drop the image out of label search
+    with transaction.atomic():
+        ImageLabel.objects.filter(image=image).delete()
+        ImageLabel.objects.bulk_create(rows)
+
+
+def rebuild_label_index(images: Iterable[ProcessedImage], batch_size: int = 1000) -> int:
+    """Re-indexes many images in bulk; returns the number of rows written."""
+    written, rows, image_ids = 0, [], []
+
+    def flush():
+        nonlocal written
+        with transaction.atomic():
+            ImageLabel.objects.filter(image_id__in=image_ids).delete()
+            ImageLabel.objects.bulk_create(rows)
+        written += len(rows)
+
+    for image in images:
+        image_ids.append(image.pk)
+        rows.extend(_rows_for(image))
+        if len(image_ids) >= batch_size:
+            flush()
+            rows, image_ids = [], []
+    if image_ids:
+        flush()
+    return written
+
+
+def _term_filter(kind: str, terms: List[str], prefix: bool) -> Q:
+    condition = Q()
+    for term in terms:
+        condition |= Q(value__startswith=term) if prefix else Q(value=term)
+    return Q(kind=kind) & condition
+
+
+def matching_image_ids(owner, kind: str, terms: List[str], match: str = MATCH_ALL, prefix: bool = False):
+    """
+    Subquery of image ids owned by `owner` with `kind` values matching the
+    terms: every term (match='all') or at least one (match='any').
+    """
+    rows = ImageLabel.objects.filter(Q(owner=owner) & _term_filter(kind, terms, prefix))
+    if match == MATCH_ANY or len(terms) == 1:
+        return rows.values('image_id').distinct()
+    if prefix:
+        # Each term may hit several values; count how many distinct terms matched per image
+        matched = None
+        for term in terms:
+            ids = ImageLabel.objects.filter(owner=owner, kind=kind, value__startswith=term).values('image_id')
+            matched = ids if matched is None else matched.filter(image_id__in=ids)
+        return matched.distinct()
+    return (
+        rows.values('image_id')
+        .annotate(matched=Count('value', distinct=True))
+        .filter(matched=len(terms))
+        .values('image_id')
+    )
+
+
+def filter_images(queryset, owner, categories=(), labels=(), search=(), match: str = MATCH_ALL):
+    """
+    Narrows `queryset` with the label index:
+      categories: exact category names, labels: exact label names,
+      search: label prefixes (what the gallery search box sends).
+    Within each group `match` picks AND ('all') or OR ('any'); groups are ANDed.
+    """
+    if categories:
+        queryset = queryset.filter(id__in=matching_image_ids(owner, ImageLabel.KIND_CATEGORY, list(categories), match))
+    if labels:
+        queryset = queryset.filter(id__in=matching_image_ids(owner, ImageLabel.KIND_LABEL, list(labels), match))
+    if search:
+        queryset = queryset.filter(
+            id__in=matching_image_ids(owner, ImageLabel.KIND_LABEL, list(search), match, prefix=True)
+        )
+    return queryset
+
+
+def facet_counts(owner, image_ids=None, limit: int = 50) -> dict:
+    """Number of images per category and per label, optionally within a filtered set of images."""
+    rows = ImageLabel.objects.filter(owner=owner)
+    if image_ids is not None:
+        rows = rows.filter(image_id__in=image_ids)
+    facets = {}
+    for kind, key in ((ImageLabel.KIND_CATEGORY, 'categories'), (ImageLabel.KIND_LABEL, 'labels')):
+        counts = (
+            rows.filter(kind=kind)
+            .values('value')
+            .annotate(count=Count('image_id', distinct=True), text=Max('text'))
+            .order_by('-count', 'value')[:limit]
+        )
+        facets[key] = [{'value': row['text'], 'count': row['count']} for row in counts]
+    return facets
+
+
+def category_counts(owner_id: int) -> dict:
+    """{category: number of the owner's images in it}, for UserStats."""
+    rows = (
+        ImageLabel.objects.filter(owner_id=owner_id, kind=ImageLabel.KIND_CATEGORY)
+        .values('value')
+        .annotate(count=Count('image_id', distinct=True), text=Max('text'))
+    )
+    return {row['text']: row['count'] for row in rows}
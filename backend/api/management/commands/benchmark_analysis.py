@@ -0,0 +1,74 @@
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the analysis pipeline on a local image corpus (CPU, no network) and writes a JSON "
+        "report. Without --corpus a deterministic synthetic corpus is generated first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help="Folder of images (manifest.json, or people/ and no_people/ subfolders).")
+        parser.add_argument('--generate', type=int, default=60, help="Synthetic images to generate when no --corpus is given.")
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--repeat', type=int, default=1, help="Run the corpus this many times.")
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'ANALYSIS_BATCH_MAX_SIZE', 8))
+        parser.add_argument('--gate', default=getattr(settings, 'ANALYSIS_PERSON_GATE', 'hog'), choices=['hog', 'yolo'])
+        parser.add_argument('--gate-max-side', type=int, default=getattr(settings, 'ANALYSIS_GATE_MAX_SIDE', 640))
+        parser.add_argument('--threads', type=int, default=None, help="Inference threads (intra-op) for this run.")
+        parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON report.")
+        parser.add_argument('--compare', help="Earlier report to compare against.")
+        parser.add_argument('--threshold', type=float, default=0.10, help="Relative change flagged as a regression.")
+
+    def handle(self, *args, **options):
+        # The harness must run on an offline box: stop ultralytics from phoning home
+        os.environ.setdefault('YOLO_OFFLINE', 'true')
+        from api.benchmark import compare_reports, generate_corpus, load_corpus, run_benchmark
+
+        corpus_dir = options['corpus']
+        if corpus_dir is None:
+            corpus_dir = Path(settings.BASE_DIR) / 'benchmark_corpus' / f"synthetic-{options['seed']}-{options['generate']}"
+            if not (corpus_dir / 'manifest.json').exists():
+                self.stdout.write(f"Generating {options['generate']} synthetic images in {corpus_dir}...")
+                generate_corpus(corpus_dir, count=options['generate'], seed=options['seed'])
+        corpus = load_corpus(corpus_dir)
+        if not corpus:
+            raise CommandError(f"No images found in {corpus_dir}")
+
+        # The backend itself is chosen with ANALYSIS_BACKEND / ANALYSIS_ONNX_QUANTIZE in the environment
+        from api.model_registry import configure_threads
+        configure_threads(options['threads'])
+
+        report = run_benchmark(
+            corpus,
+            device=getattr(settings, 'ANALYSIS_DEVICE', 'cpu'),
+            batch_size=options['batch_size'],
+            gate=options['gate'],
+            gate_max_side=options['gate_max_side'],
+            repeat=options['repeat'],
+        )
+        report['meta']['corpus'] = str(corpus_dir)
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        pipeline = report['pipeline']
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['meta']['images']} images: p50 {pipeline['p50_ms']:.1f} ms, p95 {pipeline['p95_ms']:.1f} ms, "
+            f"p99 {pipeline['p99_ms']:.1f} ms; batched {report['pipeline_batched']['images_per_s']:.2f} images/s; "
+            f"peak RSS {report['memory']['peak_rss_mb']:.0f} MB "
+            f"(per analysis p95 {report['memory']['per_analysis_peak_rss_mb']['p95']:.0f} MB); "
+            f"branches {report['branches']}"
+        ))
+        self.stdout.write(f"Report written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"\nCompared with {options['compare']} ({baseline['meta'].get('commit')}):")
+            for line in compare_reports(baseline, report, threshold=options['threshold']):
+                self.stdout.write(line)
@@ -0,0 +1,47 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the embedding store on synthetic vectors: ingest and training time, disk size, "
+        "exact vs IVF query latency and IVF recall@k. 1M float16 vectors of 2048-d need 4 GB of disk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+        parser.add_argument('--dim', type=int, default=2048)
+        parser.add_argument('--dtype', default='float16', choices=['float16', 'int8'])
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 16, 64])
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--work-dir', default=str(Path(settings.BASE_DIR) / 'benchmark_vectors'),
+                            help="Where the synthetic stores are written (and reused by later runs).")
+        parser.add_argument('--output', default='vector_benchmark.json', help="Where to write the JSON report.")
+
+    def handle(self, *args, **options):
+        from api.benchmark import run_vector_benchmark
+
+        report = run_vector_benchmark(
+            options['work_dir'], sizes=options['sizes'], dim=options['dim'], dtype=options['dtype'],
+            queries=options['queries'], k=options['k'], nprobes=options['nprobe'], seed=options['seed'],
+        )
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        recall_key = f"recall@{options['k']}"
+        for size, result in report['sizes'].items():
+            self.stdout.write(
+                f"{int(size):>9,} vectors: {result['disk_mb']:.0f} MB, trained {result['nlist']} lists in "
+                f"{result['train_seconds']:.1f}s, exact p50 {result['exact']['latency']['p50_ms']:.1f} ms"
+            )
+            for nprobe, ivf in result['ivf'].items():
+                self.stdout.write(
+                    f"    nprobe {nprobe:>4}: p50 {ivf['latency']['p50_ms']:.1f} ms, "
+                    f"p95 {ivf['latency']['p95_ms']:.1f} ms, {recall_key} {ivf[recall_key]:.3f}"
+                )
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Precomputes the label -> category index from categories.json and the model label sets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the index on disk is current.")
+
+    def handle(self, *args, **options):
+        from api.jobs import get_category_map
+
+        index = get_category_map(rebuild=options['force'])
+        categorized = sum(1 for category in index.index.values() if category)
+        self.stdout.write(self.style.SUCCESS(
+            f"Category index {index.version}: {len(index.index)} labels, {categorized} mapped to a category."
+        ))
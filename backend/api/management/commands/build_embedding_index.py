@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes missing image embeddings (--backfill) and (re)trains the IVF index used by "
+        "the similar-images endpoint. Safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help="Run ResNet over images that have no embedding yet.")
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'ANALYSIS_BATCH_MAX_SIZE', 8))
+        parser.add_argument('--nlist', type=int, default=None, help="IVF lists (default: sqrt of the row count).")
+        parser.add_argument('--force', action='store_true',
+                            help="Train even if the store is below EMBEDDING_BRUTE_FORCE_MAX or hasn't grown.")
+
+    def handle(self, *args, **options):
+        from api.embeddings import get_store
+
+        store = get_store()
+        if options['backfill']:
+            self.backfill(store, options['batch_size'])
+        if options['force'] or store.needs_training():
+            meta = store.build_index(nlist=options['nlist'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Trained {meta.get('nlist', 0)} lists over {meta.get('trained_count', 0)} vectors in {store.directory}."
+            ))
+        else:
+            self.stdout.write(f"{len(store)} vectors in {store.directory}; the index is current.")
+
+    def backfill(self, store, batch_size):
+        from api.analysis import DecodedImage, run_resnet_batch
+        from api.models import ProcessedImage
+        from api.storage import local_path
+
+        known = set(store.view().row_of)
+        missing = [pk for pk in ProcessedImage.objects.order_by('id').values_list('id', flat=True) if pk not in known]
+        done = failed = 0
+        for start in range(0, len(missing), batch_size):
+            images, decoded = [], []
+            for image in ProcessedImage.objects.filter(id__in=missing[start:start + batch_size]):
+                try:
+                    decoded.append(DecodedImage.from_path(local_path(image.image_file)))
+                    images.append(image)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Image {image.pk} ({image.image_file.name}): {e}")
+            if not images:
+                continue
+            _, embeddings = run_resnet_batch(decoded, device=getattr(settings, 'ANALYSIS_DEVICE', 'cpu'), embed=True)
+            if embeddings is None:
+                self.stderr.write("The loaded ResNet has no embedding output; re-export the ONNX models.")
+                return
+            store.add([image.pk for image in images], embeddings)
+            done += len(images)
+        self.stdout.write(f"Embedded {done} images, {failed} failed.")
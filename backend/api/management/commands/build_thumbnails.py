@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Generates missing thumbnail derivatives for existing images. Safe to re-run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Re-encode derivatives that already exist.")
+        parser.add_argument('--user', help="Only process this username's images.")
+
+    def handle(self, *args, **options):
+        from api.models import ProcessedImage
+        from api.thumbnails import generate_thumbnails, is_current
+
+        images = ProcessedImage.objects.order_by('id')
+        if options['user']:
+            images = images.filter(owner__username=options['user'])
+        done = skipped = failed = 0
+        for image in images.iterator():
+            if is_current(image) and not options['force']:
+                skipped += 1
+                continue
+            try:
+                generate_thumbnails(image, force=options['force'])
+                done += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Image {image.pk} ({image.image_file.name}): {e}")
+        # Object stores upload derivatives in the background
+        getattr(ProcessedImage._meta.get_field('image_file').storage, 'flush', lambda: None)()
+        self.stdout.write(self.style.SUCCESS(
+            f"Thumbnails generated for {done} images, {skipped} already current, {failed} failed."
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes near-duplicate clusters from the perceptual hashes, one library at a time. "
+        "New uploads are clustered as they are analyzed; run this after changing "
+        "DUPLICATE_MAX_DISTANCE or to split clusters whose linking image was deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only this username's library.")
+        parser.add_argument('--max-distance', type=int, default=None,
+                            help="Hamming distance in bits (default: DUPLICATE_MAX_DISTANCE).")
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+
+        from api.duplicates import DUPLICATE_MAX_DISTANCE, cluster_library
+
+        max_distance = DUPLICATE_MAX_DISTANCE if options['max_distance'] is None else options['max_distance']
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+        for user in users.iterator():
+            started = time.perf_counter()
+            result = cluster_library(user.pk, max_distance=max_distance)
+            if result['images']:
+                self.stdout.write(
+                    f"{user.username}: {result['clustered']} of {result['images']} images in "
+                    f"{result['clusters']} clusters ({time.perf_counter() - started:.2f}s)"
+                )
+        self.stdout.write(self.style.SUCCESS("Near-duplicate clusters rebuilt."))
@@ -0,0 +1,67 @@
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the person gates (full-size HOG, bounded HOG, YOLO 'person') over a folder of images "
+        "and reports latency, positive rate and agreement. If the folder has 'people/' and "
+        "'no_people/' subfolders, accuracy against those labels is reported too."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help="Folder of images.")
+        parser.add_argument('--max-side', type=int, default=None, help="Working size of the bounded HOG gate.")
+
+    def handle(self, *args, **options):
+        from api.analysis import GATE_MAX_SIDE, DecodedImage, detect_faces_and_people, run_yolo_detection_batch
+
+        corpus = Path(options['corpus'])
+        paths = sorted(p for p in corpus.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+        if not paths:
+            raise CommandError(f"No images found under {corpus}")
+        max_side = options['max_side'] or GATE_MAX_SIDE
+
+        gates = {
+            'hog_full': lambda image: detect_faces_and_people(image.bgr, gray=image.gray, max_side=0),
+            f'hog_{max_side}': lambda image: detect_faces_and_people(image.bgr, gray=image.gray, max_side=max_side),
+            'yolo_person': lambda image: 'person' in run_yolo_detection_batch([image.bgr])[0],
+        }
+        verdicts = {name: [] for name in gates}
+        timings = {name: [] for name in gates}
+        truth = [self._expected(path, corpus) for path in paths]
+
+        for path in paths:
+            image = DecodedImage.from_path(path)
+            for name, gate in gates.items():
+                started = time.perf_counter()
+                verdicts[name].append(bool(gate(image)))
+                timings[name].append((time.perf_counter() - started) * 1000)
+
+        reference = verdicts['hog_full']
+        self.stdout.write(f"{len(paths)} images")
+        for name in gates:
+            ms = sorted(timings[name])
+            line = (
+                f"{name:>12}: mean {statistics.mean(ms):7.1f} ms, p95 {ms[int(0.95 * (len(ms) - 1))]:7.1f} ms, "
+                f"positive {sum(verdicts[name]) / len(paths):5.1%}, "
+                f"agrees with hog_full {sum(a == b for a, b in zip(verdicts[name], reference)) / len(paths):5.1%}"
+            )
+            labelled = [(v, t) for v, t in zip(verdicts[name], truth) if t is not None]
+            if labelled:
+                line += f", accuracy {sum(v == t for v, t in labelled) / len(labelled):5.1%} on {len(labelled)} labelled"
+            self.stdout.write(line)
+
+    @staticmethod
+    def _expected(path: Path, corpus: Path):
+        parts = path.relative_to(corpus).parts
+        if parts and parts[0] == 'people':
+            return True
+        if parts and parts[0] == 'no_people':
+            return False
+        return None
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Exports YOLO and ResNet50 to ONNX for ANALYSIS_BACKEND='onnx', optionally with int8 copies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantize', action='store_true',
+                            help="Also write int8 dynamically quantized models (ANALYSIS_ONNX_QUANTIZE=True).")
+        parser.add_argument('--force', action='store_true', help="Re-export even if the files exist.")
+
+    def handle(self, *args, **options):
+        from api.onnx_backend import export_models
+
+        paths = export_models(quantize=options['quantize'], force=options['force'])
+        for name, path in paths.items():
+            size = path.stat().st_size / 1024 / 1024
+            self.stdout.write(f"{name:<13} {path} ({size:.1f} MB)")
+        self.stdout.write(self.style.SUCCESS("Models exported."))
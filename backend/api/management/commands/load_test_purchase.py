@@ -0,0 +1,91 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires many concurrent buyers at one marketplace listing through the purchase view and checks "
+        "that exactly one sale and one ledger row result. Creates (and removes) its own test users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=300)
+        parser.add_argument('--rounds', type=int, default=5, help="Listings to sell, one after the other.")
+        parser.add_argument('--retries', type=int, default=1,
+                            help="Requests per buyer, all with the same Idempotency-Key.")
+        parser.add_argument('--keep', action='store_true', help="Don't delete the test users and images.")
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+        from django.core.files.base import ContentFile
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        from api.models import ProcessedImage, Purchase
+        from api.views import PurchaseImageView
+
+        run = uuid.uuid4().hex[:8]
+        seller = User.objects.create_user(f"loadtest-seller-{run}", password=None)
+        buyers = [User(username=f"loadtest-buyer-{run}-{i}") for i in range(options['buyers'])]
+        User.objects.bulk_create(buyers)
+        buyers = list(User.objects.filter(username__startswith=f"loadtest-buyer-{run}-"))
+        view = PurchaseImageView.as_view()
+        factory = APIRequestFactory()
+        failures = []
+
+        try:
+            for round_no in range(options['rounds']):
+                image = ProcessedImage(owner=seller, for_sale=True, price='9.99', title=f"Load test {run}/{round_no}")
+                image.image_file.save(f"loadtest-{run}-{round_no}.jpg", ContentFile(uuid.uuid4().bytes), save=False)
+                image.save()
+
+                latencies, statuses = [], {}
+                lock = threading.Lock()
+                start = threading.Barrier(len(buyers))
+
+                def buy(buyer):
+                    key = uuid.uuid4().hex
+                    start.wait()
+                    try:
+                        for _ in range(options['retries']):
+                            request = factory.post(f"/api/images/{image.pk}/purchase/", HTTP_IDEMPOTENCY_KEY=key)
+                            force_authenticate(request, user=buyer)
+                            began = time.perf_counter()
+                            response = view(request, pk=image.pk)
+                            elapsed = time.perf_counter() - began
+                            with lock:
+                                latencies.append(elapsed)
+                                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    finally:
+                        connection.close()
+
+                threads = [threading.Thread(target=buy, args=(buyer,)) for buyer in buyers]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                image.refresh_from_db()
+                ledger = Purchase.objects.filter(image=image).count()
+                ms = sorted(latency * 1000 for latency in latencies)
+                p = lambda q: ms[min(len(ms) - 1, int(q * (len(ms) - 1)))]
+                ok = ledger == 1 and image.sold_to_id is not None and not image.for_sale
+                if not ok:
+                    failures.append(round_no)
+                self.stdout.write(
+                    f"round {round_no}: statuses={dict(sorted(statuses.items()))} ledger_rows={ledger} "
+                    f"p50={p(0.5):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms "
+                    f"mean={statistics.mean(ms):.1f}ms {'OK' if ok else 'DOUBLE SALE / NO SALE'}"
+                )
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=f"loadtest-buyer-{run}-").delete()
+                seller.delete()
+
+        if failures:
+            raise CommandError(f"Rounds {failures} did not end with exactly one sale.")
+        self.stdout.write(self.style.SUCCESS("Every listing was sold exactly once."))
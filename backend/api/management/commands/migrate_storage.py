@@ -0,0 +1,130 @@
+import os
+import posixpath
+import re
+
+from django.core.management.base import BaseCommand
+
+BLOB = re.compile(r'^(?P<hash>[0-9a-f]{64})(?P<suffix>(?:_w\d+)?\.[A-Za-z0-9]+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves image blobs and their thumbnails into the configured STORAGE_BACKEND and sharded layout "
+        "without downtime: each blob is copied and verified, then its rows are repointed one by one "
+        "(old names keep working meanwhile). Safe to re-run. Run with --delete-source once cached feeds "
+        "and signed URLs (MEDIA_URL_TTL_SECONDS) handed out before the move have expired. When moving "
+        "off 'local', serve with STORAGE_FALLBACK_LOCAL=1 until the copy pass has finished."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='local', choices=('local', 's3', 'emulated'),
+                            help="Backend the blobs are in now (default: local).")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--delete-source', action='store_true',
+                            help="Delete source blobs that are in the target and no longer referenced.")
+
+    def handle(self, *args, **options):
+        from api.storage import BACKEND, build_storage
+
+        source = build_storage(options['source'], fallback=False)
+        # Never count a fallback copy as migrated
+        target = build_storage(BACKEND, fallback=False)
+        same = options['source'] == BACKEND
+        if options['delete_source']:
+            self.delete_source(source, target, same)
+        else:
+            self.copy_all(source, target, same, options['batch_size'])
+        getattr(target, 'flush', lambda: None)()
+
+    def target_name(self, source, name, content_hash):
+        """(sharded name, content hash) for a stored name; legacy non-hash names are hashed from the bytes."""
+        from api.storage import hash_file, shard_name
+
+        match = BLOB.match(posixpath.basename(name))
+        if match:
+            return shard_name(match.group('hash'), match.group('suffix')), match.group('hash')
+        if not content_hash:
+            with source.open(name) as f:
+                content_hash = hash_file(f)
+        return shard_name(content_hash, os.path.splitext(name)[1].lower() or '.jpg'), content_hash
+
+    def copy(self, source, target, old, new, same) -> bool:
+        """Copies one blob unless the target has it already; True if bytes were copied."""
+        from api.storage import ContentAddressedStorage
+
+        if target.exists(new):
+            return False  # content-addressed: same name, same bytes
+        if same and isinstance(source, ContentAddressedStorage):
+            path = target.path(new)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(source.path(old), path)
+                return True
+            except OSError:
+                pass  # no hard links here: copy
+        with source.open(old) as f:
+            target.save(new, f)
+        copied, expected = target.size(new), source.size(old)
+        if copied != expected:
+            target.delete(new)
+            raise ValueError(f"{new} has {copied} bytes after copying, {expected} expected")
+        return True
+
+    def copy_all(self, source, target, same, batch_size):
+        from api.models import ProcessedImage
+        from api.thumbnails import thumbnail_name
+
+        ids = list(ProcessedImage.objects.order_by('id').values_list('id', flat=True))
+        copied = repointed = current = failed = 0
+        for start in range(0, len(ids), batch_size):
+            images = ProcessedImage.objects.filter(id__in=ids[start:start + batch_size]).only(
+                'id', 'image_file', 'content_hash', 'thumbnails')
+            for image in images:
+                old = image.image_file.name
+                try:
+                    new, content_hash = self.target_name(source, old, image.content_hash)
+                    if same and new == old:
+                        current += 1
+                        continue
+                    copied += self.copy(source, target, old, new, same)
+                    info = image.thumbnails or {}
+                    for width, _ in info.get('sizes') or []:
+                        for fmt in (info.get('spec') or {}).get('formats') or []:
+                            derivative = thumbnail_name(old, width, fmt)
+                            if source.exists(derivative):
+                                copied += self.copy(source, target, derivative, thumbnail_name(new, width, fmt), same)
+                    if new != old or content_hash != image.content_hash:
+                        # Only if nothing re-pointed the row meanwhile
+                        repointed += ProcessedImage.objects.filter(pk=image.pk, image_file=old).update(
+                            image_file=new, content_hash=content_hash)
+                    else:
+                        current += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Image {image.pk} ({old}): {e}")
+            self.stdout.write(f"{min(start + batch_size, len(ids))}/{len(ids)} images")
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {copied} blobs, repointed {repointed} images, {current} already in place, {failed} failed."
+        ))
+
+    def delete_source(self, source, target, same):
+        from api.models import ProcessedImage
+        from api.storage import shard_name
+
+        deleted = kept = 0
+        for name in source.iter_names('images/'):
+            match = BLOB.match(posixpath.basename(name))
+            if match is None:
+                kept += 1
+                continue
+            moved_to = shard_name(match.group('hash'), match.group('suffix'))
+            if same and moved_to == name:
+                continue  # already in place
+            original = posixpath.join(posixpath.dirname(name), match.group('hash')) + '.'
+            referenced = moved_to != name and ProcessedImage.objects.filter(image_file__startswith=original).exists()
+            if referenced or not target.exists(moved_to):
+                kept += 1
+                continue
+            source.delete(name)
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} source blobs, kept {kept}."))
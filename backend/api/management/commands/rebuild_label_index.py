@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the ImageLabel search index from every image's detailed_labels and general_categories."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--user', help="Only re-index this username's images.")
+
+    def handle(self, *args, **options):
+        from api.label_index import rebuild_label_index
+        from api.models import ProcessedImage
+
+        images = ProcessedImage.objects.only('id', 'owner_id', 'detailed_labels', 'general_categories').order_by('id')
+        if options['user']:
+            images = images.filter(owner__username=options['user'])
+        written = rebuild_label_index(images.iterator(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} label index rows."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Recomputes the precomputed per-user library stats from their images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild this username's stats.")
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+
+        from api.user_stats import rebuild_user_stats
+
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+        rebuilt = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            rebuild_user_stats(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {rebuilt} users."))
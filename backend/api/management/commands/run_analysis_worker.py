@@ -0,0 +1,86 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_loop(poll_interval: float, once: bool, warm_up: bool, threads: int = None):
+    # Imported here so each forked process sets up its own DB connection lazily
+    from django.conf import settings
+
+    from api import metrics
+    from api.embeddings import train_index_if_needed
+    from api.jobs import claim_job_batch, get_category_map, requeue_stale_jobs, run_job_batch
+    from api.model_registry import configure_threads, registry
+    from api.process_info import report_startup
+
+    metrics_dir = getattr(settings, 'METRICS_DIR', None)
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl+C
+    # Before any model loads: thread pools are sized on first use
+    configure_threads(threads, getattr(settings, 'ANALYSIS_INTER_OP_THREADS', None) or 1)
+    if warm_up:
+        # Load models in each worker up front so the first job isn't slow
+        registry.warm_up()
+        get_category_map()
+        load_times = ", ".join(f"{name} {secs:.2f}s" for name, secs in registry.load_times.items())
+        report_startup("warmed up", role="worker", models=f"[{load_times}]")
+        metrics.flush(metrics_dir)
+    while True:
+        requeue_stale_jobs()
+        jobs = claim_job_batch()
+        if not jobs:
+            if once:
+                return
+            # Idle: a good moment to retrain the similarity index if the library outgrew it
+            train_index_if_needed()
+            time.sleep(poll_interval)
+            continue
+        for job in run_job_batch(jobs):
+            logger.info("Job %s for image %s: %s", job.pk, job.image_id, job.status)
+        metrics.flush(metrics_dir)
+
+
+class Command(BaseCommand):
+    help = "Runs a pool of local worker processes that execute pending image analysis jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Number of worker processes.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is drained.")
+        parser.add_argument('--no-warm-up', action='store_true', help="Load models on the first job instead of at start.")
+        parser.add_argument('--threads', type=int, default=None,
+                            help="Inference threads per worker (default: ANALYSIS_INTRA_OP_THREADS, "
+                                 "else CPU count / processes).")
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        threads = options['threads'] or getattr(settings, 'ANALYSIS_INTRA_OP_THREADS', None) \
+            or max(1, (os.cpu_count() or 1) // processes)
+        # Children must not share the parent's DB socket
+        connections.close_all()
+
+        workers = [
+            multiprocessing.Process(target=_worker_loop, args=(options['poll_interval'], options['once'], not options['no_warm_up'], threads), daemon=True)
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {processes} analysis worker process(es), {threads} inference thread(s) each.")
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping analysis workers...")
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,79 @@
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Analyzes a local corpus once image by image and once in worker-sized batches, and checks that "
+        "both give the same labels, categories, route and perceptual hash (and embeddings within tolerance)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help="Folder of images; a synthetic corpus is generated when omitted.")
+        parser.add_argument('--generate', type=int, default=24)
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Images per batch (default: ANALYSIS_BATCH_MAX_SIZE).")
+        parser.add_argument('--embedding-atol', type=float, default=1e-3,
+                            help="Max |difference| between batched and single-image embeddings.")
+
+    def handle(self, *args, **options):
+        from api.analysis import DecodedImage, analyze_image_and_categorize, analyze_images_batch
+        from api.benchmark import generate_corpus, load_corpus
+        from api.jobs import (
+            BATCH_MAX_SIZE, COMPUTE_EMBEDDING, COMPUTE_PERCEPTUAL_HASH, GATE_MAX_SIDE, PERSON_GATE, get_category_map,
+        )
+
+        corpus_dir = options['corpus']
+        if corpus_dir is None:
+            corpus_dir = Path(settings.BASE_DIR) / 'benchmark_corpus' / f"synthetic-1234-{options['generate']}"
+            if not (corpus_dir / 'manifest.json').exists():
+                generate_corpus(corpus_dir, count=options['generate'], seed=1234)
+        images = [DecodedImage.from_path(entry["path"]) for entry in load_corpus(corpus_dir)]
+        if not images:
+            raise CommandError(f"No images in {corpus_dir}")
+        batch_size = options['batch_size'] or BATCH_MAX_SIZE
+
+        # Same settings as the worker, so this checks the path jobs actually take
+        kwargs = dict(
+            device=getattr(settings, 'ANALYSIS_DEVICE', 'cpu'), category_map=get_category_map(),
+            compute_phash=COMPUTE_PERCEPTUAL_HASH, gate=PERSON_GATE, gate_max_side=GATE_MAX_SIDE,
+            compute_embedding=COMPUTE_EMBEDDING,
+        )
+        analyze_image_and_categorize(images[0], **kwargs)  # warm-up: model loading is not timed
+
+        started = time.perf_counter()
+        single = [analyze_image_and_categorize(image, **kwargs) for image in images]
+        single_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        batched = []
+        for start in range(0, len(images), batch_size):
+            batched += analyze_images_batch(images[start:start + batch_size], **kwargs)
+        batched_seconds = time.perf_counter() - started
+
+        failures = []
+        for image, one, many in zip(images, single, batched):
+            for key in ('detailed_labels', 'general_categories', 'route', 'perceptual_hash'):
+                if one.get(key) != many.get(key):
+                    failures.append(f"{image.name}: {key} {one.get(key)!r} alone, {many.get(key)!r} batched")
+            if one.get('embedding') is not None or many.get('embedding') is not None:
+                if one.get('embedding') is None or many.get('embedding') is None:
+                    failures.append(f"{image.name}: embedding missing on one side")
+                    continue
+                diff = float(np.abs(np.asarray(one['embedding'], dtype=np.float32)
+                                    - np.asarray(many['embedding'], dtype=np.float32)).max())
+                if diff > options['embedding_atol']:
+                    failures.append(f"{image.name}: embeddings differ by {diff:.4g}")
+
+        self.stdout.write(
+            f"{len(images)} images: {len(images) / single_seconds:.1f} img/s one by one, "
+            f"{len(images) / batched_seconds:.1f} img/s in batches of {batch_size}."
+        )
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f"{len(failures)} differences between batched and single-image analysis.")
+        self.stdout.write(self.style.SUCCESS("Batched analysis matches single-image analysis."))
@@ -0,0 +1,139 @@
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the ONNX Runtime models next to the PyTorch ones on a local corpus and checks that their "
+        "outputs agree within tolerance. Also reports per-image latency and memory of both backends."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help="Folder of images; a synthetic corpus is generated when omitted.")
+        parser.add_argument('--generate', type=int, default=24)
+        parser.add_argument('--quantized', action='store_true', help="Check the int8 models instead of fp32.")
+        parser.add_argument('--threads', type=int, default=None, help="intra-op threads for both backends.")
+        parser.add_argument('--logit-atol', type=float, default=None,
+                            help="Max |logit difference| for ResNet (default 1e-3 fp32, 1.0 int8).")
+        parser.add_argument('--min-top1', type=float, default=None,
+                            help="Required ResNet top-1 agreement (default 1.0 fp32, 0.9 int8).")
+        parser.add_argument('--min-label-agreement', type=float, default=None,
+                            help="Required mean Jaccard of YOLO label sets (default 0.95 fp32, 0.8 int8).")
+        parser.add_argument('--output', help="Write the report as JSON here.")
+
+    def handle(self, *args, **options):
+        from api.benchmark import generate_corpus, load_corpus, peak_rss_mb, summarize
+        from api.model_registry import configure_threads
+        from api.onnx_backend import RESNET_RESIZE, load_resnet, load_yolo, model_paths
+
+        quantized = options['quantized']
+        logit_atol = options['logit_atol'] if options['logit_atol'] is not None else (1.0 if quantized else 1e-3)
+        min_top1 = options['min_top1'] if options['min_top1'] is not None else (0.9 if quantized else 1.0)
+        min_jaccard = options['min_label_agreement'] if options['min_label_agreement'] is not None else (0.8 if quantized else 0.95)
+
+        if not model_paths(quantized)["resnet"].exists():
+            raise CommandError("ONNX models not found; run `manage.py export_inference_models` first.")
+        configure_threads(options['threads'])
+
+        corpus_dir = options['corpus']
+        if corpus_dir is None:
+            corpus_dir = Path(settings.BASE_DIR) / 'benchmark_corpus' / f"synthetic-1234-{options['generate']}"
+            if not (corpus_dir / 'manifest.json').exists():
+                generate_corpus(corpus_dir, count=options['generate'], seed=1234)
+        from api.analysis import DecodedImage
+        images = [DecodedImage.from_path(entry["path"]) for entry in load_corpus(corpus_dir)]
+        if not images:
+            raise CommandError(f"No images in {corpus_dir}")
+
+        # ONNX first: its RSS is measured before torch is ever imported
+        rss_start = peak_rss_mb()
+        onnx_yolo, onnx_resnet = load_yolo(quantized), load_resnet(quantized)
+        rss_onnx = peak_rss_mb()
+        onnx_inputs = [onnx_resnet.preprocess(image.to_pil()) for image in images]
+        onnx_logits, onnx_resnet_times = self._timed(lambda x: onnx_resnet.logits(x[None])[0], onnx_inputs)
+        onnx_scores, onnx_yolo_times = self._timed(lambda image: onnx_yolo.class_scores([image.bgr])[0], images)
+
+        import torch
+        from torchvision import models
+        from torchvision.models import ResNet50_Weights
+        from ultralytics import YOLO
+
+        from api.pipeline import RESNET_WEIGHTS, YOLO_WEIGHTS
+
+        weights = ResNet50_Weights[RESNET_WEIGHTS]
+        torch_resnet = models.resnet50(weights=weights).eval()
+        torch_yolo = YOLO(YOLO_WEIGHTS)
+        rss_torch = peak_rss_mb()
+
+        # Same input tensors for both, so the comparison isolates the model numerics
+        with torch.inference_mode():
+            torch_logits, torch_resnet_times = self._timed(
+                lambda x: torch_resnet(torch.from_numpy(x[None]))[0].numpy(), onnx_inputs)
+        torch_labels, torch_yolo_times = self._timed(
+            lambda image: {torch_yolo.names[int(box.cls[0])] for box in torch_yolo.predict(image.bgr, verbose=False)[0].boxes},
+            images)
+        # The runtime path uses torchvision's own transform; check the numpy port matches it
+        transform = weights.transforms()
+        preprocess_diff = max(
+            float(np.abs(transform(image.to_pil()).numpy() - x).max()) for image, x in zip(images, onnx_inputs))
+
+        logit_diff = max(float(np.abs(a - b).max()) for a, b in zip(onnx_logits, torch_logits))
+        top1 = float(np.mean([int(np.argmax(a) == np.argmax(b)) for a, b in zip(onnx_logits, torch_logits)]))
+        top5 = float(np.mean([
+            len(set(np.argsort(-a)[:5]) & set(np.argsort(-b)[:5])) / 5 for a, b in zip(onnx_logits, torch_logits)]))
+        onnx_labels = [{onnx_yolo.names[int(c)] for c in np.nonzero(row >= 0.25)[0]} for row in onnx_scores]
+        jaccard = float(np.mean([
+            1.0 if not (a | b) else len(a & b) / len(a | b) for a, b in zip(onnx_labels, torch_labels)]))
+
+        report = {
+            "images": len(images),
+            "quantized": quantized,
+            "resnet_resize": RESNET_RESIZE.get(RESNET_WEIGHTS),
+            "accuracy": {
+                "preprocess_max_abs_diff": preprocess_diff,
+                "resnet_logit_max_abs_diff": logit_diff,
+                "resnet_top1_agreement": top1,
+                "resnet_top5_overlap": top5,
+                "yolo_label_jaccard": jaccard,
+            },
+            "latency": {
+                "onnx_resnet": summarize(onnx_resnet_times),
+                "torch_resnet": summarize(torch_resnet_times),
+                "onnx_yolo": summarize(onnx_yolo_times),
+                "torch_yolo": summarize(torch_yolo_times),
+            },
+            "memory_mb": {
+                "models_onnx": rss_onnx - rss_start,
+                "models_torch_incl_import": rss_torch - rss_onnx,
+            },
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        failures = []
+        if logit_diff > logit_atol:
+            failures.append(f"ResNet logits differ by {logit_diff:.4g} > {logit_atol}")
+        if top1 < min_top1:
+            failures.append(f"ResNet top-1 agreement {top1:.3f} < {min_top1}")
+        if jaccard < min_jaccard:
+            failures.append(f"YOLO label agreement {jaccard:.3f} < {min_jaccard}")
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("ONNX backend matches PyTorch within tolerance."))
+
+    @staticmethod
+    def _timed(fn, items):
+        outputs, seconds = [], []
+        fn(items[0])  # warm-up
+        for item in items:
+            started = time.perf_counter()
+            outputs.append(fn(item))
+            seconds.append(time.perf_counter() - started)
+        return outputs, seconds
@@ -0,0 +1,257 @@
+"""
+Serving uploaded media with access control and HTTP caching.
+
+Replaces django.conf.urls.static for MEDIA_URL. Every request is checked
+against the image(s) the file belongs to:
+  - public images and active marketplace listings are readable by anyone;
+  - anything else needs a signed URL (`?exp=..&sig=..`), which the API
+    serializers only hand out to users who may see the image (owner, buyer).
+    Signatures are stable for MEDIA_URL_TTL_SECONDS so browsers can cache.
+
+Responses carry a content-hash ETag and far-future immutable Cache-Control
+for content-addressed thumbnails. Originals can change visibility (made
+private, taken off sale), so shared caches must revalidate them every time
+(max-age=0, cheap with the ETag) and browsers keep private ones an hour.
+Responses answer If-None-Match/If-Modified-Since with
+304 and single byte ranges with 206. With MEDIA_SENDFILE set to
+'x-accel-redirect' or 'x-sendfile' the bytes are handed to nginx/Apache
+after the checks instead of being streamed by Django.
+
+With an object-store backend (see storage.py) the checks are the same; the
+client is then redirected to a short-lived presigned bucket URL, or, when
+the store can't presign (the emulated one), served from the read cache.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse,
+)
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .models import ProcessedImage
+from .storage import S3_URL_TTL_SECONDS, ObjectStorage
+
+URL_TTL_SECONDS = getattr(settings, 'MEDIA_URL_TTL_SECONDS', 24 * 3600)
+# None (Django streams the file), 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd)
+SENDFILE = getattr(settings, 'MEDIA_SENDFILE', None)
+# nginx `internal` location that aliases MEDIA_ROOT, used with x-accel-redirect
+ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MUTABLE_MAX_AGE = 3600
+CHUNK_SIZE = 64 * 1024
+
+_DERIVATIVE = re.compile(r'^(?P<base>.+?)(?P<variant>_w\d+)?\.(?P<ext>[A-Za-z0-9]+)$')
+_CONTENT_ADDRESSED = re.compile(r'^images/(?:[0-9a-f]{2}/)+(?P<hash>[0-9a-f]{64})$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+# --- Signed URLs ---
+def _signature(name: str, expires: int) -> str:
+    return salted_hmac('pixsort.media', f"{name}:{expires}").hexdigest()[:32]
+
+
+def is_publicly_visible(image: ProcessedImage) -> bool:
+    return bool(image.is_public) or (bool(image.for_sale) and image.sold_to_id is None)
+
+
+def media_url(image: ProcessedImage, name: str) -> str:
+    """URL of `name` (the original or a derivative of `image`), signed unless anyone may read it."""
+    url = image.image_file.storage.url(name)
+    if is_publicly_visible(image):
+        return url
+    # Expiry rounded up to a TTL boundary so the URL (and browser cache entry) is stable for a while
+    expires = (int(time.time()) // URL_TTL_SECONDS + 2) * URL_TTL_SECONDS
+    return f"{url}?{urlencode({'exp': expires, 'sig': _signature(name, expires)})}"
+
+
+def _valid_signature(name: str, params) -> bool:
+    try:
+        expires = int(params.get('exp', ''))
+    except ValueError:
+        return False
+    return expires > time.time() and constant_time_compare(params.get('sig', ''), _signature(name, expires))
+
+
+# --- Access ---
+def _owning_images(name: str):
+    """Images whose original is `name` or whose derivative `name` is."""
+    match = _DERIVATIVE.match(name)
+    if match is None:
+        raise Http404
+    if match.group('variant'):
+        return ProcessedImage.objects.filter(image_file__startswith=f"{match.group('base')}.")
+    return ProcessedImage.objects.filter(image_file=name)
+
+
+def _access(request, name: str):
+    """(allowed, public): public files may also be stored by shared caches."""
+    images = _owning_images(name)
+    if images.filter(Q(is_public__in=[True]) | Q(for_sale__in=[True], sold_to__isnull=True)).exists():
+        return True, True
+    if _valid_signature(name, request.GET):
+        return True, False
+    user = request.user
+    allowed = user.is_authenticated and images.filter(Q(owner=user) | Q(sold_to=user)).exists()
+    return allowed, False
+
+
+# --- Caching headers ---
+def _etag(name: str, stat) -> str:
+    match = _DERIVATIVE.match(name)
+    content = _CONTENT_ADDRESSED.match(match.group('base')) if match else None
+    if content:
+        return f'"{content.group("hash")[:32]}{match.group("variant") or ""}"'
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def _is_immutable(name: str) -> bool:
+    match = _DERIVATIVE.match(name)
+    return bool(match and match.group('variant') and _CONTENT_ADDRESSED.match(match.group('base')))
+
+
+def _cache_control(name: str, public: bool) -> str:
+    if _is_immutable(name):
+        return f"{'public' if public else 'private'}, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    if public:
+        # A CDN must come back to us, so an image made private stops being served at once
+        return "public, max-age=0, must-revalidate"
+    return f"private, max-age={MUTABLE_MAX_AGE}"
+
+
+def _not_modified(request, etag: str, mtime: float) -> bool:
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(mtime) <= since
+
+
+def _byte_range(request, etag: str, size: int):
+    """(start, end) inclusive for a satisfiable single range, None for a full response, 'invalid' for 416."""
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range.strip() != etag:
+        return None  # the client's copy is stale: send the whole thing
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None  # multiple or malformed ranges: a full 200 is always allowed
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return 'invalid'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def _iter_range(path: str, start: int, length: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _serve_object(request, storage, name):
+    allowed, public = _access(request, name)
+    if not allowed:
+        raise Http404
+    url = storage.presigned_url(name)
+    if url:
+        # The bucket does the bytes; the redirect may be reused only while its URL is valid
+        response = HttpResponseRedirect(url)
+        response['Cache-Control'] = f"private, max-age={min(MUTABLE_MAX_AGE, S3_URL_TTL_SECONDS // 2)}"
+        return response
+    try:
+        full_path = storage.local_path(name)
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    # The cache isn't under MEDIA_ROOT, so only X-Sendfile (a full path) can hand it over
+    return _serve_file(request, name, full_path, stat, public, SENDFILE if SENDFILE == 'x-sendfile' else None)
+
+
+def _serve_file(request, name, full_path, stat, public, sendfile):
+    etag = _etag(name, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': _cache_control(name, public),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if sendfile:
+        # The front server does the bytes (and Range) work after our checks
+        response = HttpResponse(content_type=content_type)
+        if sendfile == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = ACCEL_PREFIX.rstrip('/') + '/' + name
+        else:
+            response['X-Sendfile'] = full_path
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    byte_range = _byte_range(request, etag, stat.st_size)
+    if byte_range == 'invalid':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{stat.st_size}"
+        return response
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(stat.st_size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_iter_range(full_path, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+        response['Content-Length'] = str(length)
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    name = posixpath.normpath(path).lstrip('/')
+    if name.startswith('..') or name != path.lstrip('/'):
+        raise Http404
+    storage = ProcessedImage._meta.get_field('image_file').storage
+    if isinstance(storage, ObjectStorage):
+        return _serve_object(request, storage, name)
+    full_path = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    allowed, public = _access(request, name)
+    if not allowed:
+        raise Http404  # don't reveal that a private file exists
+    return _serve_file(request, name, full_path, stat, public, SENDFILE)
@@ -0,0 +1,195 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Analysis runs in several worker processes, so each process periodically
+writes a JSON snapshot of its counters and histograms to METRICS_DIR
+(`flush()`); the /api/metrics/ endpoint merges every snapshot with its own
+live values, the same idea as prometheus_client's multiprocess mode.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+# Seconds; spans a cached lookup up to a slow full-resolution analysis
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Dict[str, str] = None) -> str:
+    pairs = list(key) + sorted((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(map(list, key)), value] for key, value in self.values.items()]
+
+    @staticmethod
+    def merge(into: dict, snapshot):
+        for key, value in snapshot:
+            key = tuple(map(tuple, key))
+            into[key] = into.get(key, 0.0) + value
+
+    def render(self, values: dict) -> Iterable[str]:
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., sum, count]
+        self.values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(map(list, key)), list(state)] for key, state in self.values.items()]
+
+    @staticmethod
+    def merge(into: dict, snapshot):
+        for key, state in snapshot:
+            key = tuple(map(tuple, key))
+            if key in into:
+                into[key] = [a + b for a, b in zip(into[key], state)]
+            else:
+                into[key] = list(state)
+
+    def render(self, values: dict) -> Iterable[str]:
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{_format_labels(key, {'le': str(bound)})} {count}"
+            yield f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(key)} {state[-2]}"
+            yield f"{self.name}_count{_format_labels(key)} {state[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name, help_text):
+        return self.metrics.setdefault(name, Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def render(self, snapshots: Iterable[dict] = (), gauges: Dict[str, Tuple[str, Dict[LabelKey, float]]] = None) -> str:
+        """Prometheus text format of this process merged with other processes' snapshots."""
+        lines = []
+        for name, metric in self.metrics.items():
+            merged = {}
+            metric.merge(merged, metric.snapshot())
+            for snapshot in snapshots:
+                metric.merge(merged, snapshot.get(name, []))
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged))
+        for name, (help_text, values) in (gauges or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "pixsort_analysis_stage_seconds", "Time spent per analysis stage (per image for batched stages).")
+IMAGES_ANALYZED = registry.counter(
+    "pixsort_analysis_images_total", "Images that went through the analysis pipeline.")
+BRANCH_TAKEN = registry.counter(
+    "pixsort_analysis_branch_total", "Which branch produced an image's labels (yolo, resnet, yolo->resnet).")
+GATE_DECISIONS = registry.counter(
+    "pixsort_analysis_gate_total", "Person gate verdicts per gate strategy.")
+CACHE_LOOKUPS = registry.counter(
+    "pixsort_analysis_cache_lookups_total", "Analysis cache lookups by result (hit, miss).")
+JOBS_FINISHED = registry.counter(
+    "pixsort_analysis_jobs_total", "Analysis job attempts by outcome (succeeded, retry, failed).")
+BATCH_SIZE = registry.histogram(
+    "pixsort_analysis_batch_size", "Number of images per analysis batch.", buckets=(1, 2, 4, 8, 16, 32, 64))
+MODEL_LOAD_SECONDS = registry.histogram(
+    "pixsort_model_load_seconds", "Time to load a model into a process.", buckets=(0.5, 1, 2, 5, 10, 30, 60))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Times a block into pixsort_analysis_stage_seconds{stage=...}; yields a dict with 'seconds'."""
+    timing = {}
+    started = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing["seconds"] = time.perf_counter() - started
+        STAGE_SECONDS.observe(timing["seconds"], stage=stage)
+
+
+def flush(metrics_dir, role: str = "worker"):
+    """Writes this process' snapshot so the metrics endpoint of another process can merge it."""
+    if not metrics_dir:
+        return
+    metrics_dir = Path(metrics_dir)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    target = metrics_dir / f"{role}-{os.getpid()}.json"
+    tmp = target.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, target)
+
+
+def load_snapshots(metrics_dir, exclude_pid: int = None) -> list:
+    if not metrics_dir or not Path(metrics_dir).is_dir():
+        return []
+    snapshots = []
+    for path in Path(metrics_dir).glob("*.json"):
+        if exclude_pid is not None and path.stem.endswith(f"-{exclude_pid}"):
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # being rewritten or removed; skip this scrape
+    return snapshots
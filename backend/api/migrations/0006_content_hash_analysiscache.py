@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:00
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedimage',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='processedimage',
+            name='image_file',
+            field=models.ImageField(storage=api.storage.ContentAddressedStorage(), upload_to=api.storage.content_addressed_upload_to),
+        ),
+        migrations.CreateModel(
+            name='AnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('pipeline_version', models.CharField(max_length=32)),
+                ('detailed_labels', models.JSONField(default=list)),
+                ('general_categories', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'pipeline_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_content_hash_analysiscache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedimage',
+            name='analysis_debug',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_processedimage_analysis_debug'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['is_public', '-uploaded_at', '-id'], name='api_img_public_feed'),
+        ),
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['for_sale', 'sold_to', '-uploaded_at', '-id'], name='api_img_market_feed'),
+        ),
+    ]
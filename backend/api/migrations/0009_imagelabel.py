@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_label_index(apps, schema_editor):
+    ProcessedImage = apps.get_model('api', 'ProcessedImage')
+    ImageLabel = apps.get_model('api', 'ImageLabel')
+    rows = []
+    for image in ProcessedImage.objects.all().iterator():
+        seen = set()
+        for kind, values in (('label', image.detailed_labels), ('category', image.general_categories)):
+            for text in values or []:
+                value = " ".join(str(text).split()).lower()[:100]
+                if value and (kind, value) not in seen:
+                    seen.add((kind, value))
+                    rows.append(ImageLabel(image_id=image.pk, owner_id=image.owner_id, kind=kind, value=value, text=str(text)[:100]))
+        if len(rows) >= 1000:
+            ImageLabel.objects.bulk_create(rows)
+            rows = []
+    ImageLabel.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0008_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageLabel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('label', 'Label'), ('category', 'Category')], max_length=8)),
+                ('value', models.CharField(max_length=100)),
+                ('text', models.CharField(max_length=100)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='label_index', to='api.processedimage')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('image', 'kind', 'value')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='imagelabel',
+            index=models.Index(fields=['owner', 'kind', 'value'], name='api_label_owner_kind_value'),
+        ),
+        migrations.RunPython(build_label_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_user_stats(apps, schema_editor):
+    ProcessedImage = apps.get_model('api', 'ProcessedImage')
+    UserStats = apps.get_model('api', 'UserStats')
+    totals = {}
+    for image in ProcessedImage.objects.all().iterator():
+        stats = totals.setdefault(image.owner_id, {
+            'image_count': 0, 'for_sale_count': 0, 'sold_count': 0, 'category_counts': {},
+        })
+        sold = image.sold_to_id is not None
+        stats['image_count'] += 1
+        stats['for_sale_count'] += int(bool(image.for_sale) and not sold)
+        stats['sold_count'] += int(sold)
+        for category in set(image.general_categories or []):
+            stats['category_counts'][category] = stats['category_counts'].get(category, 0) + 1
+    UserStats.objects.bulk_create([UserStats(user_id=user_id, **stats) for user_id, stats in totals.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0009_imagelabel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='library_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('image_count', models.PositiveIntegerField(default=0)),
+                ('for_sale_count', models.PositiveIntegerField(default=0)),
+                ('sold_count', models.PositiveIntegerField(default=0)),
+                ('category_counts', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_userstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedimage',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+def fill_hash_chunks(apps, schema_editor):
+    ProcessedImage = apps.get_model('api', 'ProcessedImage')
+    batch = []
+    for image in ProcessedImage.objects.filter(perceptual_hash__isnull=False).iterator():
+        if not image.perceptual_hash:
+            continue
+        value = int(image.perceptual_hash, 16)
+        for i in range(4):
+            setattr(image, f'phash_{i}', (value >> (16 * (3 - i))) & 0xFFFF)
+        batch.append(image)
+        if len(batch) >= 1000:
+            ProcessedImage.objects.bulk_update(batch, ['phash_0', 'phash_1', 'phash_2', 'phash_3'])
+            batch = []
+    ProcessedImage.objects.bulk_update(batch, ['phash_0', 'phash_1', 'phash_2', 'phash_3'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_purchase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedimage',
+            name='phash_0',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedimage',
+            name='phash_1',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedimage',
+            name='phash_2',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedimage',
+            name='phash_3',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedimage',
+            name='duplicate_group',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['owner', 'phash_0'], name='api_img_owner_phash0'),
+        ),
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['owner', 'phash_1'], name='api_img_owner_phash1'),
+        ),
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['owner', 'phash_2'], name='api_img_owner_phash2'),
+        ),
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['owner', 'phash_3'], name='api_img_owner_phash3'),
+        ),
+        migrations.AddIndex(
+            model_name='processedimage',
+            index=models.Index(fields=['owner', 'duplicate_group'], name='api_img_owner_dup_group'),
+        ),
+        # Clusters themselves are built by `manage.py cluster_duplicates` (needs NumPy)
+        migrations.RunPython(fill_hash_chunks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:00
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_duplicate_clusters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processedimage',
+            name='image_file',
+            field=models.ImageField(storage=api.storage.image_storage, upload_to=api.storage.content_addressed_upload_to),
+        ),
+    ]
@@ -0,0 +1,142 @@
+"""
+Lazily loaded inference models.
+
+Nothing heavy is imported until a model is first requested, so API-only
+processes (lists, marketplace, auth, management commands) never import
+torch or ultralytics. Inference workers call `warm_up()` once at start so
+the first job doesn't pay the load time.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from .metrics import MODEL_LOAD_SECONDS
+from .pipeline import RESNET_WEIGHTS, YOLO_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+BACKEND_TORCH = 'torch'
+BACKEND_ONNX = 'onnx'
+# 'torch' (eager PyTorch / ultralytics) or 'onnx' (ONNX Runtime, see onnx_backend.py)
+INFERENCE_BACKEND = getattr(settings, 'ANALYSIS_BACKEND', BACKEND_TORCH)
+ONNX_QUANTIZE = getattr(settings, 'ANALYSIS_ONNX_QUANTIZE', False)
+# Part of the analysis cache key: int8 models may label a few images differently
+INFERENCE_BACKEND_ID = (
+    f"{INFERENCE_BACKEND}-int8" if INFERENCE_BACKEND == BACKEND_ONNX and ONNX_QUANTIZE else INFERENCE_BACKEND
+)
+
+_threads = {
+    'intra': getattr(settings, 'ANALYSIS_INTRA_OP_THREADS', None),
+    'inter': getattr(settings, 'ANALYSIS_INTER_OP_THREADS', None),
+}
+
+
+def thread_settings() -> Tuple[Optional[int], Optional[int]]:
+    return _threads['intra'], _threads['inter']
+
+
+def configure_threads(intra: Optional[int] = None, inter: Optional[int] = None):
+    """
+    Caps the threads this process uses for inference. Several workers on one
+    box each using every core only thrash; call this before loading models.
+    Applies to OpenCV, to ONNX Runtime sessions created afterwards and, for
+    the torch backend, to torch's intra/inter-op pools.
+    """
+    _threads['intra'] = intra or _threads['intra']
+    _threads['inter'] = inter or _threads['inter']
+    intra, inter = thread_settings()
+    if intra:
+        import cv2
+        cv2.setNumThreads(intra)
+    if INFERENCE_BACKEND == BACKEND_TORCH:
+        import torch
+        if intra:
+            torch.set_num_threads(intra)
+        if inter:
+            try:
+                torch.set_num_interop_threads(inter)
+            except RuntimeError:
+                logger.warning("torch inter-op threads already fixed for this process; keeping them")
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._loaders: Dict[str, Callable] = {}
+        self._models: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        # Seconds spent loading each model in this process
+        self.load_times: Dict[str, float] = {}
+
+    def register(self, name: str, loader: Callable):
+        self._loaders[name] = loader
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._models:
+                logger.info("Loading model %s...", name)
+                started = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self.load_times[name] = time.perf_counter() - started
+                MODEL_LOAD_SECONDS.observe(self.load_times[name], model=name)
+                logger.info("Model %s loaded in %.2fs", name, self.load_times[name])
+        return self._models[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def warm_up(self, names=None):
+        for name in names or list(self._loaders):
+            self.get(name)
+
+
+class ResNetBundle:
+    """torch backend: the module, its input transform and class names (OnnxResNet mirrors these)."""
+
+    def __init__(self, model, preprocess, categories):
+        self.model = model
+        self.preprocess = preprocess
+        self.categories = categories
+
+
+def _load_yolo():
+    if INFERENCE_BACKEND == BACKEND_ONNX:
+        from .onnx_backend import load_yolo
+        return load_yolo(ONNX_QUANTIZE)
+    from ultralytics import YOLO
+    return YOLO(YOLO_WEIGHTS)
+
+
+def _load_resnet():
+    if INFERENCE_BACKEND == BACKEND_ONNX:
+        from .onnx_backend import load_resnet
+        return load_resnet(ONNX_QUANTIZE)
+    from torchvision import models
+    from torchvision.models import ResNet50_Weights
+
+    weights = ResNet50_Weights[RESNET_WEIGHTS]
+    model = models.resnet50(weights=weights)
+    model.eval()
+    return ResNetBundle(model, weights.transforms(), weights.meta["categories"])
+
+
+registry = ModelRegistry()
+registry.register("yolo", _load_yolo)
+registry.register("resnet", _load_resnet)
+
+
+def get_yolo():
+    return registry.get("yolo")
+
+
+def get_resnet() -> ResNetBundle:
+    return registry.get("resnet")
+
+
+def warm_up():
+    registry.warm_up()
@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .storage import content_addressed_upload_to, image_storage
 # Create your models here.
 class UserProfile(models.Model):
     # Links this profile to a specific Django User in a one-to-one relationship
@@ -14,7 +17,22 @@ class UserProfile(models.Model):
 class ProcessedImage(models.Model):
     is_public = models.BooleanField(default=False)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
-    image_file = models.ImageField(upload_to='images/')
+    image_file = models.ImageField(upload_to=content_addressed_upload_to, storage=image_storage)
+    # SHA-256 of the original bytes; identical uploads share one file and one analysis
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # Optional 64-bit DCT perceptual hash (hex) for spotting near-duplicates
+    perceptual_hash = models.CharField(max_length=16, null=True, blank=True)
+    # 16-bit slices of perceptual_hash for multi-index near-duplicate lookups, see duplicates.py
+    phash_0 = models.IntegerField(null=True, blank=True)
+    phash_1 = models.IntegerField(null=True, blank=True)
+    phash_2 = models.IntegerField(null=True, blank=True)
+    phash_3 = models.IntegerField(null=True, blank=True)
+    # Near-duplicate cluster: id of its oldest image; null when the image has no near-duplicate
+    duplicate_group = models.IntegerField(null=True, blank=True)
+    # Optional routing decision and per-stage timings from the analysis run
+    analysis_debug = models.JSONField(null=True, blank=True)
+    # Generated derivative sizes, see thumbnails.py
+    thumbnails = models.JSONField(default=dict, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     general_categories = models.JSONField(default=list)
     detailed_labels = models.JSONField(default=list)
@@ -25,5 +43,145 @@ class ProcessedImage(models.Model):
     description = models.TextField(null=True, blank=True)
     sold_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='purchased_images')
 
+    class Meta:
+        indexes = [
+            # Public feed and marketplace: filter, then walk uploaded_at/id (keyset pagination)
+            models.Index(fields=['is_public', '-uploaded_at', '-id'], name='api_img_public_feed'),
+            models.Index(fields=['for_sale', 'sold_to', '-uploaded_at', '-id'], name='api_img_market_feed'),
+            # Near-duplicate probes and cluster listings, always within one library
+            models.Index(fields=['owner', 'phash_0'], name='api_img_owner_phash0'),
+            models.Index(fields=['owner', 'phash_1'], name='api_img_owner_phash1'),
+            models.Index(fields=['owner', 'phash_2'], name='api_img_owner_phash2'),
+            models.Index(fields=['owner', 'phash_3'], name='api_img_owner_phash3'),
+            models.Index(fields=['owner', 'duplicate_group'], name='api_img_owner_dup_group'),
+        ]
+
+    def __str__(self):
+        return self.image_file.name
+
+
+class ImageLabel(models.Model):
+    """
+    Inverted index over an image's labels and categories: one row per
+    (image, kind, value). Gallery search and facet counts query this table
+    instead of scanning the JSON columns.
+    """
+    KIND_LABEL = 'label'
+    KIND_CATEGORY = 'category'
+    KIND_CHOICES = [(KIND_LABEL, 'Label'), (KIND_CATEGORY, 'Category')]
+
+    image = models.ForeignKey(ProcessedImage, on_delete=models.CASCADE, related_name='label_index')
+    # Copied from the image so per-user lookups never need a join
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    # Normalized (lowercase, single spaces) for exact and prefix matching
+    value = models.CharField(max_length=100)
+    # As produced by the model / categories.json, for display
+    text = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = [('image', 'kind', 'value')]
+        indexes = [
+            models.Index(fields=['owner', 'kind', 'value'], name='api_label_owner_kind_value'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.value}"
+
+
+class UserStats(models.Model):
+    """
+    Per-user library totals, kept current by user_stats.py as images are
+    uploaded, analyzed, edited, sold and deleted so the stats endpoint is a
+    single-row read. `manage.py rebuild_user_stats` recomputes them.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='library_stats')
+    image_count = models.PositiveIntegerField(default=0)
+    # Listed in the marketplace and not yet bought
+    for_sale_count = models.PositiveIntegerField(default=0)
+    sold_count = models.PositiveIntegerField(default=0)
+    # category name -> number of the user's images in it
+    category_counts = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+
+class Purchase(models.Model):
+    """
+    Append-only ledger of marketplace sales, written right after the
+    compare-and-set that marks the image sold (see purchases.py). Rows are
+    never updated; references survive deleted users and images.
+    """
+    image = models.ForeignKey(ProcessedImage, on_delete=models.SET_NULL, null=True, related_name='purchases')
+    buyer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    seller = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    # Client-supplied Idempotency-Key header; a retried request replays the original outcome
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Not unique: keys are optional and a unique index would treat every null as equal on
+        # MongoDB; purchases.purchase_image keeps the earliest row holding a key
+        indexes = [models.Index(fields=['buyer', 'idempotency_key'], name='api_purchase_buyer_key')]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None and not self._state.adding:
+            raise ValueError("Purchase ledger rows are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Purchase {self.pk} of image {self.image_id}"
+
+
+class AnalysisCache(models.Model):
+    """Analysis results keyed by image bytes and the pipeline that produced them."""
+    content_hash = models.CharField(max_length=64)
+    # See pipeline.pipeline_version(); a model or category change gives a new key
+    pipeline_version = models.CharField(max_length=32)
+    detailed_labels = models.JSONField(default=list)
+    general_categories = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('content_hash', 'pipeline_version')]
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} @ {self.pipeline_version}"
+
+
+class AnalysisJob(models.Model):
+    """Durable queue entry for running the analysis pipeline on an uploaded image."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    image = models.ForeignKey(ProcessedImage, on_delete=models.CASCADE, related_name='analysis_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(null=True, blank=True)
+    # A failed attempt is retried no earlier than this (simple exponential backoff)
+    run_after = models.DateTimeField(default=timezone.now)
+    # Set when a worker claims the job; used to requeue jobs of crashed workers
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='api_job_status_run_after'),
+        ]
+
     def __str__(self):
-        return self.image_file.name
\ No newline at end of file
+        return f"AnalysisJob {self.pk} ({self.status})"
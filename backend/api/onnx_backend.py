@@ -0,0 +1,233 @@
+"""
+ONNX Runtime inference backend (ANALYSIS_BACKEND = 'onnx').
+
+`export_models()` converts YOLO and ResNet50 to ONNX once (and, with
+quantize=True, to int8 with dynamic quantization), writing them plus their
+class names to ONNX_MODEL_DIR. At inference time only onnxruntime, numpy
+and OpenCV/PIL are used: torch and ultralytics are never imported, which
+saves most of a worker's memory and start-up time.
+
+Pre/post-processing mirrors what the PyTorch path does:
+  - YOLO: letterbox to 640x640, RGB, /255. We only need the *set* of
+    detected classes, which is every class with some anchor scoring >= conf
+    (NMS only drops lower-scoring boxes of a class that already has a box).
+  - ResNet: PIL bilinear resize of the short side, center crop 224,
+    ImageNet mean/std: the same steps as the torchvision weights' transforms.
+    The graph has a second output, "embedding": the pooled 2048-d features
+    feeding the classifier (see api/embeddings.py).
+
+`manage.py verify_inference_backend` checks both models against PyTorch.
+"""
+import json
+import logging
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .pipeline import RESNET_WEIGHTS, YOLO_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = Path(getattr(settings, 'ONNX_MODEL_DIR', settings.BASE_DIR / 'onnx_models'))
+QUANTIZE = getattr(settings, 'ANALYSIS_ONNX_QUANTIZE', False)
+OPSET = 17
+
+YOLO_IMGSZ = 640
+YOLO_PAD_VALUE = 114
+# Short-side resize used by each torchvision ResNet50 weight set before the 224 crop
+RESNET_RESIZE = {"IMAGENET1K_V1": 256, "IMAGENET1K_V2": 232}
+RESNET_CROP = 224
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+
+# --- Files ---
+def model_paths(quantized: bool = QUANTIZE) -> Dict[str, Path]:
+    suffix = "-int8" if quantized else ""
+    yolo_stem = Path(YOLO_WEIGHTS).stem
+    resnet_stem = f"resnet50-{RESNET_WEIGHTS}"
+    return {
+        "yolo": ONNX_MODEL_DIR / f"{yolo_stem}{suffix}.onnx",
+        "resnet": ONNX_MODEL_DIR / f"{resnet_stem}{suffix}.onnx",
+        "yolo_names": ONNX_MODEL_DIR / f"{yolo_stem}.names.json",
+        "resnet_names": ONNX_MODEL_DIR / f"{resnet_stem}.names.json",
+    }
+
+
+def _write_names(path: Path, names):
+    with open(path, "w") as f:
+        json.dump(names, f)
+
+
+def _read_names(path: Path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# --- Export (needs torch / ultralytics / onnx, run once) ---
+def export_resnet(path: Path, names_path: Path):
+    import torch
+    from torchvision import models
+    from torchvision.models import ResNet50_Weights
+
+    from .analysis import resnet_forward
+
+    class WithEmbedding(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, images):
+            return resnet_forward(self.model, images)
+
+    weights = ResNet50_Weights[RESNET_WEIGHTS]
+    model = WithEmbedding(models.resnet50(weights=weights)).eval()
+    dummy = torch.zeros(1, 3, RESNET_CROP, RESNET_CROP)
+    torch.onnx.export(
+        model, dummy, str(path), opset_version=OPSET, input_names=["images"],
+        output_names=["logits", "embedding"],
+        dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}, "embedding": {0: "batch"}},
+    )
+    _write_names(names_path, list(weights.meta["categories"]))
+
+
+def export_yolo(path: Path, names_path: Path):
+    from ultralytics import YOLO
+
+    model = YOLO(YOLO_WEIGHTS)
+    exported = model.export(format="onnx", dynamic=True, imgsz=YOLO_IMGSZ, opset=OPSET, simplify=False)
+    shutil.move(str(exported), str(path))
+    _write_names(names_path, {str(k): v for k, v in model.names.items()})
+
+
+def quantize_model(source: Path, target: Path):
+    """int8 weights, activations quantized on the fly (no calibration data needed)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+
+
+def export_models(quantize: bool = QUANTIZE, force: bool = False) -> Dict[str, Path]:
+    """Writes the fp32 models (and int8 copies if `quantize`); existing files are kept unless `force`."""
+    ONNX_MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    fp32 = model_paths(quantized=False)
+    if force or not (fp32["resnet"].exists() and fp32["resnet_names"].exists()):
+        logger.info("Exporting ResNet50 (%s) to %s", RESNET_WEIGHTS, fp32["resnet"])
+        export_resnet(fp32["resnet"], fp32["resnet_names"])
+    if force or not (fp32["yolo"].exists() and fp32["yolo_names"].exists()):
+        logger.info("Exporting %s to %s", YOLO_WEIGHTS, fp32["yolo"])
+        export_yolo(fp32["yolo"], fp32["yolo_names"])
+    if not quantize:
+        return fp32
+    int8 = model_paths(quantized=True)
+    for name in ("resnet", "yolo"):
+        if force or not int8[name].exists():
+            logger.info("Quantizing %s to %s", fp32[name], int8[name])
+            quantize_model(fp32[name], int8[name])
+    return int8
+
+
+# --- Runtime ---
+def create_session(path: Path):
+    import onnxruntime as ort
+
+    from .model_registry import thread_settings
+
+    if not Path(path).exists():
+        raise FileNotFoundError(f"{path} not found; run `manage.py export_inference_models` first.")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    intra, inter = thread_settings()
+    if intra:
+        options.intra_op_num_threads = intra
+    if inter:
+        options.inter_op_num_threads = inter
+    return ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def letterbox(image_bgr: np.ndarray, size: int = YOLO_IMGSZ) -> np.ndarray:
+    """Resize keeping aspect ratio and pad to size x size, as ultralytics' LetterBox(auto=False)."""
+    import cv2
+
+    height, width = image_bgr.shape[:2]
+    scale = min(size / height, size / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    if (new_w, new_h) != (width, height):
+        image_bgr = cv2.resize(image_bgr, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top = int(round((size - new_h) / 2 - 0.1))
+    left = int(round((size - new_w) / 2 - 0.1))
+    return cv2.copyMakeBorder(image_bgr, top, size - new_h - top, left, size - new_w - left,
+                              cv2.BORDER_CONSTANT, value=(YOLO_PAD_VALUE,) * 3)
+
+
+class OnnxYolo:
+    def __init__(self, model_path: Path, names_path: Path):
+        self.session = create_session(model_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = {int(k): v for k, v in _read_names(names_path).items()}
+
+    def class_scores(self, images_bgr: List[np.ndarray]) -> np.ndarray:
+        """(N, num_classes) best score of each class over all anchors."""
+        batch = np.stack([letterbox(image)[:, :, ::-1].transpose(2, 0, 1) for image in images_bgr])
+        batch = np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+        output = self.session.run(None, {self.input_name: batch})[0]  # (N, 4 + classes, anchors)
+        return output[:, 4:, :].max(axis=2)
+
+    def detect_labels(self, images_bgr: List[np.ndarray], conf: float = 0.25) -> List[List[str]]:
+        if not images_bgr:
+            return []
+        scores = self.class_scores(images_bgr)
+        return [[self.names[int(c)] for c in np.nonzero(row >= conf)[0]] for row in scores]
+
+
+class OnnxResNet:
+    def __init__(self, model_path: Path, names_path: Path):
+        self.session = create_session(model_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.categories = _read_names(names_path)
+        self.resize = RESNET_RESIZE.get(RESNET_WEIGHTS, 256)
+        self.has_embedding = "embedding" in {output.name for output in self.session.get_outputs()}
+        if not self.has_embedding:
+            logger.warning("%s has no embedding output (exported before embeddings existed); "
+                           "re-run `manage.py export_inference_models --force`", model_path)
+
+    def preprocess(self, pil_image) -> np.ndarray:
+        from PIL import Image
+
+        # Short side to self.resize, long side truncated, exactly like torchvision's resize
+        width, height = pil_image.size
+        if width <= height:
+            size = (self.resize, int(self.resize * height / width))
+        else:
+            size = (int(self.resize * width / height), self.resize)
+        resized = pil_image.resize(size, Image.BILINEAR)
+        left = int(round((resized.width - RESNET_CROP) / 2.0))
+        top = int(round((resized.height - RESNET_CROP) / 2.0))
+        crop = resized.crop((left, top, left + RESNET_CROP, top + RESNET_CROP))
+        array = np.asarray(crop, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return (array - IMAGENET_MEAN) / IMAGENET_STD
+
+    def logits(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(["logits"], {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+    def forward(self, batch: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """(logits, embeddings); embeddings is None for models exported without that output."""
+        if not self.has_embedding:
+            return self.logits(batch), None
+        logits, embedding = self.session.run(
+            ["logits", "embedding"], {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})
+        return logits, embedding
+
+
+def load_yolo(quantized: bool = QUANTIZE) -> OnnxYolo:
+    paths = model_paths(quantized)
+    return OnnxYolo(paths["yolo"], paths["yolo_names"])
+
+
+def load_resnet(quantized: bool = QUANTIZE) -> OnnxResNet:
+    paths = model_paths(quantized)
+    return OnnxResNet(paths["resnet"], paths["resnet_names"])
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination on (uploaded_at, id).
+
+Each page is one indexed range query ("older than the last row of the previous
+page") instead of an OFFSET scan, so latency and memory stay flat however
+large the catalog grows. The cursor is an opaque base64 token of the last
+row's (uploaded_at, id); ties on uploaded_at are broken by id.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(uploaded_at: datetime, pk: int) -> str:
+    raw = f"{uploaded_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        uploaded_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(uploaded_at), int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+class KeysetPagination(BasePagination):
+    page_size = 30
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            uploaded_at, pk = decode_cursor(token)
+            queryset = queryset.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk))
+
+        # Fetch one extra row to learn whether there is a next page
+        rows = list(queryset.order_by('-uploaded_at', '-id')[:page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = encode_cursor(rows[-1].uploaded_at, rows[-1].pk)
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        }
+        if self.count is not None:
+            body['count'] = self.count
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'count': {'type': 'integer', 'description': 'Only with ?count=true.'},
+                'results': schema,
+            },
+        }
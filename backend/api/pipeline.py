@@ -0,0 +1,42 @@
+"""
+Identifiers of everything that influences analysis output.
+
+Kept free of torch/ultralytics imports so the API process can compute the
+pipeline version (used as the analysis cache key) without loading models.
+"""
+import hashlib
+from pathlib import Path
+
+# Bump when the decision logic in analysis.py changes in a way that alters labels.
+PIPELINE_REVISION = 1
+YOLO_WEIGHTS = "yolov8n.pt"
+RESNET_WEIGHTS = "IMAGENET1K_V2"  # torchvision ResNet50_Weights member
+
+_versions = {}
+
+
+def file_digest(path, algorithm: str = "sha256") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pipeline_version(category_file, backend: str = "torch", decode: str = "full") -> str:
+    """
+    Short stable key; changes whenever the models, categories or logic change.
+    `backend` is the inference backend id (see model_registry.INFERENCE_BACKEND_ID)
+    and `decode` the decode policy (see image_limits.decode_policy); the
+    defaults leave the key as it always was.
+    """
+    category_file = Path(category_file)
+    cache_key = (str(category_file), category_file.stat().st_mtime_ns, backend, decode)
+    if cache_key not in _versions:
+        parts = [str(PIPELINE_REVISION), YOLO_WEIGHTS, RESNET_WEIGHTS, file_digest(category_file)]
+        if backend != "torch":
+            parts.append(backend)
+        if decode != "full":
+            parts.append(f"decode-{decode}")
+        _versions[cache_key] = hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+    return _versions[cache_key]
@@ -0,0 +1,64 @@
+"""Startup time / memory reporting, tagged with the role of the current process."""
+import logging
+import os
+import resource
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:  # psutil is optional; fall back to the stdlib
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+_IMPORT_TIME = time.time()
+
+
+def process_role() -> str:
+    """'api', 'worker' or 'manage:<command>'; PIXSORT_ROLE overrides the guess."""
+    role = os.environ.get('PIXSORT_ROLE')
+    if role:
+        return role
+    if len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py':
+        command = sys.argv[1]
+        if command == 'runserver':
+            return 'api'
+        if command == 'run_analysis_worker':
+            return 'worker'
+        return f'manage:{command}'
+    return 'api'
+
+
+def current_rss_mb():
+    """Resident set size now, or None where neither psutil nor /proc is available."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seconds_since_start() -> float:
+    if psutil is not None:
+        return time.time() - psutil.Process().create_time()
+    return time.time() - _IMPORT_TIME
+
+
+def report_startup(stage: str, role: str = None, **extra):
+    role = role or process_role()
+    details = "".join(f", {key}={value}" for key, value in extra.items())
+    rss = current_rss_mb()
+    memory = f"RSS {rss:.0f} MB" if rss is not None else f"peak RSS {peak_rss_mb():.0f} MB"
+    logger.info(
+        "role=%s %s after %.2fs, %s, torch imported=%s%s",
+        role, stage, seconds_since_start(), memory, 'torch' in sys.modules, details,
+    )
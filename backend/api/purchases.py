@@ -0,0 +1,97 @@
+"""
+Contention-safe marketplace purchases.
+
+The sale is one conditional UPDATE (for_sale=True, sold_to=NULL, not the
+buyer's own image -> sold_to=buyer, for_sale=False): of any number of
+concurrent buyers exactly one matches a row, the rest see 0 rows updated.
+The winner then appends a Purchase ledger row. An Idempotency-Key lets a
+client retry safely: the same key from the same buyer replays the original
+purchase instead of failing as "sold".
+
+Nothing here relies on a transaction: MongoDB (djongo) has none, and no
+partial unique index either (a unique (buyer, key) index would count every
+keyless purchase as the same null key). Two requests with one key for two
+different images can both get past the replay check, so after writing its
+ledger row each checks which row holds the key: the earliest one wins, and
+a later one removes its row and puts its image back on sale with another
+conditional UPDATE before answering 422.
+"""
+from decimal import Decimal
+
+from . import feed_cache
+from .models import ProcessedImage, Purchase
+from .user_stats import record_change
+
+
+class PurchaseError(Exception):
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _replay(buyer, image_id: int, idempotency_key: str):
+    if not idempotency_key:
+        return None
+    previous = Purchase.objects.filter(buyer=buyer, idempotency_key=idempotency_key).first()
+    if previous is not None and previous.image_id != image_id:
+        raise PurchaseError('Idempotency-Key was already used for a different purchase.', status_code=422)
+    return previous
+
+
+def _price(value):
+    # Stored prices may come back as strings or Mongo Decimal128
+    return Decimal(str(value)) if value is not None else None
+
+
+def _holds_key(purchase: Purchase) -> bool:
+    """True if `purchase` is the earliest ledger row with its buyer's key."""
+    first = (
+        Purchase.objects.filter(buyer_id=purchase.buyer_id, idempotency_key=purchase.idempotency_key)
+        .order_by('pk').values_list('pk', flat=True).first()
+    )
+    return first == purchase.pk
+
+
+def purchase_image(image_id: int, buyer, idempotency_key: str = None):
+    """Returns (purchase, replayed). Raises PurchaseError if the image can't be bought."""
+    previous = _replay(buyer, image_id, idempotency_key)
+    if previous is not None:
+        return previous, True
+
+    sold = (
+        ProcessedImage.objects
+        .filter(pk=image_id, for_sale__in=[True], sold_to__isnull=True)
+        .exclude(owner=buyer)
+        .update(sold_to=buyer, for_sale=False)
+    )
+    if not sold:
+        previous = _replay(buyer, image_id, idempotency_key)
+        if previous is not None:
+            return previous, True
+        owner_id = ProcessedImage.objects.filter(pk=image_id).values_list('owner_id', flat=True).first()
+        if owner_id is None:
+            raise PurchaseError('Image not found.', status_code=404)
+        if owner_id == buyer.pk:
+            raise PurchaseError('You cannot purchase your own image.')
+        raise PurchaseError('Image is not available for purchase.', status_code=409)
+
+    image = ProcessedImage.objects.only('owner_id', 'price').get(pk=image_id)
+    purchase = Purchase.objects.create(
+        image_id=image_id, buyer=buyer, seller_id=image.owner_id,
+        price=_price(image.price), idempotency_key=idempotency_key or None,
+    )
+    if idempotency_key and not _holds_key(purchase):
+        # A concurrent request recorded a purchase with this key first: undo this sale
+        purchase.delete()
+        ProcessedImage.objects.filter(pk=image_id, sold_to=buyer, for_sale=False).update(sold_to=None, for_sale=True)
+        previous = _replay(buyer, image_id, idempotency_key)
+        if previous is not None:
+            return previous, True
+        raise PurchaseError('Idempotency-Key was already used for a different purchase.', status_code=422)
+
+    feed_cache.invalidate(feed_cache.MARKETPLACE_FEED)
+    # Categories don't change on a sale, so they cancel out of the stats delta
+    record_change(purchase.seller_id, {'categories': [], 'for_sale': True, 'sold': False},
+                  {'categories': [], 'for_sale': False, 'sold': True})
+    return purchase, False
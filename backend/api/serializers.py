@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from .models import ProcessedImage, UserProfile
+from .models import AnalysisJob, ProcessedImage, UserProfile
+from .image_limits import ImageTooLarge, check_upload
+from .media import media_url
+from .sparse import SparseFieldsMixin
+from .thumbnails import thumbnail_urls
 from django.contrib.auth.models import User
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -8,24 +12,71 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ['user', 'payment_details']
         read_only_fields = ['user']
 
-class ProcessedImageSerializer(serializers.ModelSerializer):
+class ThumbnailFieldsMixin(serializers.Serializer):
+    """
+    `thumbnail` (a small derivative URL) and `srcset` ({format: srcset string}) for <img>/<picture>.
+    Every media URL, image_file included, goes through media.media_url so private files get signed URLs.
+    """
+    thumbnail = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+
+    def _media_url(self, obj, name):
+        url = media_url(obj, name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def _thumbnail_urls(self, obj):
+        return thumbnail_urls(obj, lambda name: self._media_url(obj, name))
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data.get('image_file') and instance.image_file:
+            data['image_file'] = self._media_url(instance, instance.image_file.name)
+        return data
+
+    def get_thumbnail(self, obj):
+        return self._thumbnail_urls(obj)['thumbnail']
+
+    def get_srcset(self, obj):
+        return self._thumbnail_urls(obj)['srcset']
+
+class ProcessedImageSerializer(SparseFieldsMixin, ThumbnailFieldsMixin, serializers.ModelSerializer):
     owner_username = serializers.ReadOnlyField(source='owner.username')
     sold_to_username = serializers.ReadOnlyField(source='sold_to.username') 
+    # Near-duplicate cluster (id of its oldest image) or null, maintained by duplicates.py
+    duplicate_group = serializers.ReadOnlyField()
 
     class Meta:
         model = ProcessedImage
         fields = [
-            'id', 'image_file', 'owner_username', 'uploaded_at', 
+            'id', 'image_file', 'thumbnail', 'srcset', 'owner_username', 'uploaded_at',
             'general_categories', 'detailed_labels', 'is_public',
-            'for_sale', 'price', 'title', 'description', 'sold_to_username'
+            'for_sale', 'price', 'title', 'description', 'sold_to_username', 'duplicate_group'
         ]
 
-class PublicImageSerializer(serializers.ModelSerializer):
+    def validate_image_file(self, value):
+        try:
+            check_upload(value)
+        except ImageTooLarge as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+class PublicImageSerializer(SparseFieldsMixin, ThumbnailFieldsMixin, serializers.ModelSerializer):
     owner_username = serializers.ReadOnlyField(source='owner.username')
 
     class Meta:
         model = ProcessedImage
-        fields = ['id', 'image_file', 'owner_username', 'detailed_labels', 'title', 'description', 'price']
+        fields = ['id', 'image_file', 'thumbnail', 'srcset', 'owner_username', 'detailed_labels', 'title', 'description', 'price']
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    image = ProcessedImageSerializer(read_only=True)
+
+    class Meta:
+        model = AnalysisJob
+        fields = [
+            'id', 'status', 'attempts', 'max_attempts', 'last_error',
+            'created_at', 'updated_at', 'finished_at', 'image'
+        ]
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,64 @@
+"""
+Sparse fieldsets: `?fields=id,thumbnail,title` on list endpoints.
+
+`SparseFieldsMixin` drops unrequested fields from a serializer (so their
+SerializerMethodFields never run), and `SparseListMixin` narrows the
+queryset with .only() to the columns those fields read, so long text like
+`description` is neither fetched nor sent.
+"""
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+
+# Serializer field -> model fields it reads (default: the field's own name)
+FIELD_SOURCES = {
+    'owner_username': ('owner', 'owner__username'),
+    'sold_to_username': ('sold_to', 'sold_to__username'),
+    # media.media_url decides between a plain and a signed URL from the visibility columns
+    'image_file': ('image_file', 'is_public', 'for_sale', 'sold_to'),
+    'thumbnail': ('image_file', 'thumbnails', 'is_public', 'for_sale', 'sold_to'),
+    'srcset': ('image_file', 'thumbnails', 'is_public', 'for_sale', 'sold_to'),
+}
+# Keyset pagination orders and builds cursors on these
+ALWAYS_LOADED = ('id', 'uploaded_at')
+
+
+def requested_fields(request):
+    """The set of names in ?fields=, or None when the client wants everything."""
+    if request is None:
+        return None
+    raw = request.query_params.get(FIELDS_PARAM) if hasattr(request, 'query_params') else None
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """For ModelSerializers: keeps only the fields named in the request's ?fields=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if not fields:
+            return
+        unknown = fields - set(self.fields)
+        if unknown:
+            raise ValidationError({FIELDS_PARAM: f"Unknown fields: {', '.join(sorted(unknown))}. "
+                                                 f"Available: {', '.join(self.fields)}."})
+        for name in set(self.fields) - fields:
+            self.fields.pop(name)
+
+
+class SparseListMixin:
+    """For list views whose serializer uses SparseFieldsMixin: loads only the needed columns."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = requested_fields(self.request)
+        if not fields:
+            return queryset
+        columns = set(ALWAYS_LOADED)
+        for name in fields:
+            columns.update(FIELD_SOURCES.get(name, (name,)))
+        relations = [relation for relation in ('owner', 'sold_to') if f"{relation}__username" in columns]
+        return queryset.select_related(None).select_related(*relations).only(*columns)
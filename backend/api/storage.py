@@ -0,0 +1,476 @@
+"""
+Content-addressed, pluggable storage for uploaded images.
+
+Files are named after the SHA-256 of their bytes, sharded STORAGE_SHARD_DEPTH
+directory levels deep (images/ab/cd/<hash>.jpg), so any number of
+ProcessedImage rows holding the same photo share one blob and no directory
+grows past a few thousand entries. Saving a blob that already exists is a
+no-op. (Rows written before sharding keep their images/ab/<hash>.jpg names
+until `manage.py migrate_storage` moves them.)
+
+Where the bytes live is STORAGE_BACKEND:
+  - 'local': ContentAddressedStorage, a FileSystemStorage under MEDIA_ROOT;
+  - 's3': ObjectStorage over an S3-compatible bucket (AWS, MinIO, ...), see
+    STORAGE_S3_*; needs boto3;
+  - 'emulated': ObjectStorage over LocalObjectClient, a bucket emulated in a
+    directory (atomic puts, 404s as FileNotFoundError, no presigned URLs), so
+    the object-store code paths run in development and tests without MinIO.
+
+ObjectStorage uploads originals in STORAGE_MULTIPART_SIZE parts, several in
+parallel, before the row is saved; derivatives (thumbnails, which can be
+regenerated) are uploaded from a background pool. Code that needs a real
+file (the decoders) calls `local_path`, which for an object store reads a
+size-bounded cache (STORAGE_CACHE_DIR): everything written through this
+process is put there as it is uploaded, anything else is downloaded once.
+Names are content hashes, so a cached copy never goes stale.
+
+While a library is being moved to an object store, STORAGE_FALLBACK_LOCAL
+makes reads of blobs not copied yet fall back to MEDIA_ROOT.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils.encoding import filepath_to_uri
+
+logger = logging.getLogger(__name__)
+
+BACKEND = getattr(settings, 'STORAGE_BACKEND', 'local')
+SHARD_DEPTH = getattr(settings, 'STORAGE_SHARD_DEPTH', 2)
+FALLBACK_LOCAL = getattr(settings, 'STORAGE_FALLBACK_LOCAL', False)
+CACHE_DIR = Path(getattr(settings, 'STORAGE_CACHE_DIR', Path(settings.BASE_DIR) / 'storage_cache'))
+CACHE_MAX_BYTES = getattr(settings, 'STORAGE_CACHE_MAX_BYTES', 10 * 1024 ** 3)
+EMULATED_DIR = Path(getattr(settings, 'STORAGE_EMULATED_DIR', Path(settings.BASE_DIR) / 'object_store'))
+MULTIPART_SIZE = getattr(settings, 'STORAGE_MULTIPART_SIZE', 8 * 1024 * 1024)
+UPLOAD_CONCURRENCY = getattr(settings, 'STORAGE_UPLOAD_CONCURRENCY', 4)
+S3_BUCKET = getattr(settings, 'STORAGE_S3_BUCKET', None)
+S3_ENDPOINT_URL = getattr(settings, 'STORAGE_S3_ENDPOINT_URL', None)
+S3_REGION = getattr(settings, 'STORAGE_S3_REGION', None)
+S3_ACCESS_KEY = getattr(settings, 'STORAGE_S3_ACCESS_KEY', None)
+S3_SECRET_KEY = getattr(settings, 'STORAGE_S3_SECRET_KEY', None)
+# Lifetime of the presigned URLs serve_media redirects to
+S3_URL_TTL_SECONDS = getattr(settings, 'STORAGE_S3_URL_TTL_SECONDS', 3600)
+
+# Cached files read this recently are never evicted (a reader may be about to open them)
+CACHE_GRACE_SECONDS = 60
+
+
+def hash_file(file_obj) -> str:
+    """SHA-256 of a Django File, read in chunks; leaves the file rewound."""
+    digest = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def shard_name(content_hash: str, suffix: str, depth: int = SHARD_DEPTH) -> str:
+    """images/ab/cd/<hash><suffix> for depth 2."""
+    shards = [content_hash[2 * i:2 * i + 2] for i in range(depth)]
+    return posixpath.join('images', *shards, f"{content_hash}{suffix}")
+
+
+def content_addressed_upload_to(instance, filename):
+    upload = instance.image_file.file
+    if not instance.content_hash:
+        # Streamed uploads were hashed on the way in (uploads.py); anything else is read once here
+        instance.content_hash = getattr(upload, 'content_hash', None) or hash_file(upload)
+    ext = getattr(upload, 'extension', None) or os.path.splitext(filename)[1].lower() or '.jpg'
+    return shard_name(instance.content_hash, ext)
+
+
+def local_path(field_file) -> str:
+    """A filesystem path holding the bytes of an ImageField value, whatever the backend."""
+    return field_file.storage.local_path(field_file.name)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Same name means same bytes: reuse it instead of adding a random suffix
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        # FileSystemStorage._save retries a FileExistsError with get_available_name(), which
+        # returns the same name here, so it would spin forever; an upload of the same bytes
+        # that won the race since exists() has simply stored this blob already.
+        try:
+            if hasattr(content, 'temporary_file_path'):
+                # A spooled upload (uploads.IncomingUploadedFile) is renamed into place, not copied
+                file_move_safe(content.temporary_file_path(), full_path)
+            else:
+                # Written aside and linked in, so a crash never leaves a partial blob under the final name
+                with tempfile.NamedTemporaryFile(dir=directory, suffix='.part', delete=False) as tmp:
+                    for chunk in content.chunks():
+                        tmp.write(chunk)
+                try:
+                    os.link(tmp.name, full_path)
+                finally:
+                    os.unlink(tmp.name)
+        except FileExistsError:
+            return name
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def save_derivative(self, name, content):
+        return self.save(name, content)
+
+    def local_path(self, name) -> str:
+        return self.path(name)
+
+    def iter_names(self, prefix='images/'):
+        root = self.path(prefix)
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                yield Path(os.path.relpath(os.path.join(directory, filename), self.location)).as_posix()
+
+
+# --- Object store clients ---
+class LocalObjectClient:
+    """
+    A bucket emulated in a directory, with the object-store behaviour the
+    storage relies on: objects appear whole or not at all, missing keys
+    raise FileNotFoundError, listing is by key prefix.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def head(self, key: str):
+        try:
+            stat = self._path(key).stat()
+        except FileNotFoundError:
+            return None
+        return {'size': stat.st_size, 'modified': stat.st_mtime}
+
+    def put(self, key: str, fileobj, content_type=None):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.part', delete=False) as tmp:
+            try:
+                while True:
+                    chunk = fileobj.read(MULTIPART_SIZE)
+                    if not chunk:
+                        break
+                    tmp.write(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+
+    def get(self, key: str, fileobj):
+        with open(self._path(key), 'rb') as f:
+            while True:
+                chunk = f.read(MULTIPART_SIZE)
+                if not chunk:
+                    break
+                fileobj.write(chunk)
+
+    def delete(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def keys(self, prefix: str):
+        for directory, _, files in os.walk(self._path(prefix)):
+            for filename in files:
+                if not filename.endswith('.part'):
+                    yield Path(os.path.relpath(os.path.join(directory, filename), self.root)).as_posix()
+
+    def presigned_url(self, key: str, expires: int):
+        return None  # no bucket URL to hand out: serve_media streams from the read cache
+
+
+class S3Client:
+    """boto3 against an S3-compatible endpoint; transfers above MULTIPART_SIZE go in parallel parts."""
+
+    def __init__(self):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError as e:
+            raise ImproperlyConfigured("STORAGE_BACKEND = 's3' needs boto3 (pip install boto3).") from e
+        if not S3_BUCKET:
+            raise ImproperlyConfigured("STORAGE_BACKEND = 's3' needs STORAGE_S3_BUCKET.")
+        self.bucket = S3_BUCKET
+        self.client = boto3.client(
+            's3',
+            endpoint_url=S3_ENDPOINT_URL or None,
+            region_name=S3_REGION or None,
+            aws_access_key_id=S3_ACCESS_KEY or None,
+            aws_secret_access_key=S3_SECRET_KEY or None,
+            # MinIO and most self-hosted endpoints only do path-style addressing
+            config=Config(max_pool_connections=max(10, 2 * UPLOAD_CONCURRENCY),
+                          s3={'addressing_style': 'path' if S3_ENDPOINT_URL else 'auto'}),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=MULTIPART_SIZE,
+            multipart_chunksize=MULTIPART_SIZE,
+            max_concurrency=UPLOAD_CONCURRENCY,
+            use_threads=UPLOAD_CONCURRENCY > 1,
+        )
+
+    @staticmethod
+    def _missing(error) -> bool:
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def head(self, key: str):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        return {'size': response['ContentLength'], 'modified': response['LastModified'].timestamp()}
+
+    def put(self, key: str, fileobj, content_type=None):
+        extra = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=extra, Config=self.transfer)
+
+    def get(self, key: str, fileobj):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.download_fileobj(self.bucket, key, fileobj, Config=self.transfer)
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def keys(self, prefix: str):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for entry in page.get('Contents', ()):
+                yield entry['Key']
+
+    def presigned_url(self, key: str, expires: int) -> str:
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires,
+        )
+
+
+# --- Read cache ---
+class ReadCache:
+    """Downloaded blobs under `directory`, least recently read evicted past `max_bytes`."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # Bytes added since the last sweep; the directory is only walked every max_bytes / 10
+        self.added = 0
+
+    def get(self, name: str, fetch) -> str:
+        """Path of the cached copy of `name`; `fetch(fileobj)` fills it on a miss."""
+        path = self.directory / name
+        try:
+            os.utime(path)  # mtime is the LRU clock
+            return str(path)
+        except FileNotFoundError:
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.part', delete=False) as tmp:
+            try:
+                fetch(tmp)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+        self._added(path.stat().st_size)
+        return str(path)
+
+    def seed(self, name: str, data: bytes):
+        self.get(name, lambda fileobj: fileobj.write(data))
+
+    def discard(self, name: str):
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _added(self, size: int):
+        self.added += size
+        if self.added >= self.max_bytes // 10:
+            self.added = 0
+            self.sweep()
+
+    def sweep(self):
+        entries, total = [], 0
+        for directory, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        recent = time.time() - CACHE_GRACE_SECONDS
+        # Down to 90% so the next few downloads don't trigger another sweep
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            if mtime > recent:
+                continue
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+
+# --- Object storage ---
+class ObjectStorage(Storage):
+    """Django Storage over an object store client (S3Client or LocalObjectClient)."""
+
+    def __init__(self, client, cache: ReadCache, fallback: FileSystemStorage = None):
+        self.client = client
+        self.cache = cache
+        self.fallback = fallback
+        self._pool = None
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix='storage-upload')
+        return self._pool
+
+    def _in_fallback(self, name) -> bool:
+        return self.fallback is not None and self.fallback.exists(name)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def exists(self, name) -> bool:
+        return self.client.head(name) is not None or self._in_fallback(name)
+
+    def size(self, name) -> int:
+        head = self.client.head(name)
+        if head is None:
+            if self._in_fallback(name):
+                return self.fallback.size(name)
+            raise FileNotFoundError(name)
+        return head['size']
+
+    def url(self, name) -> str:
+        # Still served by api.media.serve_media, which checks access before redirecting to the bucket
+        return urljoin(settings.MEDIA_URL, filepath_to_uri(name))
+
+    def local_path(self, name) -> str:
+        try:
+            return self.cache.get(name, lambda fileobj: self.client.get(name, fileobj))
+        except FileNotFoundError:
+            if self._in_fallback(name):
+                return self.fallback.path(name)
+            raise
+
+    def presigned_url(self, name):
+        """A direct, expiring bucket URL for `name`, or None when the client can't sign or lacks the blob."""
+        url = self.client.presigned_url(name, S3_URL_TTL_SECONDS)
+        if url is None or self.client.head(name) is None:
+            return None
+        return url
+
+    def _open(self, name, mode='rb'):
+        return File(open(self.local_path(name), mode))
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        content.seek(0)
+        self.client.put(name, content, getattr(content, 'content_type', None))
+        self._seed_cache(name, content)
+        return name
+
+    def _seed_cache(self, name, content):
+        """Keeps the uploaded bytes (usually a spooled upload) so local readers skip the download."""
+        try:
+            content.seek(0)
+            self.cache.get(name, lambda fileobj: shutil.copyfileobj(content, fileobj, MULTIPART_SIZE))
+        except OSError:
+            logger.warning("Could not add %s to the read cache", name, exc_info=True)
+
+    def save_derivative(self, name, content):
+        """Returns at once: the bytes go into the read cache and are uploaded in the background."""
+        data = content.read()
+        self.cache.seed(name, data)
+        self.pool.submit(self._put_bytes, name, data)
+        return name
+
+    def _put_bytes(self, name, data):
+        from io import BytesIO
+
+        try:
+            self.client.put(name, BytesIO(data))
+        except Exception:
+            # Not fatal: the derivative is regenerated when build_thumbnails finds it missing
+            logger.exception("Could not upload %s", name)
+
+    def delete(self, name):
+        self.client.delete(name)
+        self.cache.discard(name)
+
+    def iter_names(self, prefix='images/'):
+        return self.client.keys(prefix)
+
+    def flush(self):
+        """Waits for background uploads (management commands call this before exiting)."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def build_storage(backend: str = BACKEND, fallback: bool = FALLBACK_LOCAL):
+    if backend == 'local':
+        return ContentAddressedStorage()
+    if backend == 'emulated':
+        client = LocalObjectClient(EMULATED_DIR)
+    elif backend == 's3':
+        client = S3Client()
+    else:
+        raise ImproperlyConfigured(f"Unknown STORAGE_BACKEND {backend!r}; use 'local', 's3' or 'emulated'.")
+    return ObjectStorage(client, ReadCache(CACHE_DIR, CACHE_MAX_BYTES),
+                         fallback=ContentAddressedStorage() if fallback else None)
+
+
+_storage = None
+
+
+def image_storage():
+    """The configured storage; ProcessedImage.image_file calls it once at startup."""
+    global _storage
+    if _storage is None:
+        _storage = build_storage()
+    return _storage
@@ -1,3 +1,659 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import SkipFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from .image_limits import ImageTooLarge, UploadLimitsHandler, read_header
+from .label_index import MATCH_ANY, filter_images, sync_image_labels
+from .media import media_url
+from . import feed_cache, jobs, purchases, storage, uploads
+from .models import AnalysisJob, ImageLabel, ProcessedImage, Purchase
+from .storage import ContentAddressedStorage, LocalObjectClient, ObjectStorage, ReadCache, shard_name
+from .user_stats import get_user_stats, image_state, rebuild_user_stats, record_change
+
+
+class ListQueryCountTests(APITestCase):
+    """
+    Query-count regression harness: every list endpoint must run the same
+    number of queries for a small and a large page. A difference means some
+    per-row lookup (an N+1) crept into a serializer or queryset.
+
+    Run with a relational backend: PIXSORT_DB=sqlite python manage.py test api
+    """
+
+    SMALL, LARGE = 2, 12
+
+    def setUp(self):
+        caches['feeds'].clear()  # feed pages would otherwise be served without any query
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        self.client.force_authenticate(self.owner)
+
+    def make_images(self, count, **fields):
+        start = ProcessedImage.objects.count()
+        for i in range(start, start + count):
+            image = ProcessedImage.objects.create(
+                image_file=f"images/{i % 100:02d}/{i:064d}.jpg",
+                general_categories=['Animals'], detailed_labels=['dog'],
+                **{'owner': self.owner, **fields},
+            )
+            sync_image_labels(image)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertConstantQueries(self, url, paged=False, **fields):
+        """Query count for SMALL rows vs LARGE rows (or page sizes, for keyset-paged feeds)."""
+        if paged:
+            self.make_images(self.LARGE, **fields)
+            separator = '&' if '?' in url else '?'
+            small = self.count_queries(f"{url}{separator}page_size={self.SMALL}")
+            large = self.count_queries(f"{url}{separator}page_size={self.LARGE}")
+        else:
+            self.make_images(self.SMALL, **fields)
+            small = self.count_queries(url)
+            self.make_images(self.LARGE - self.SMALL, **fields)
+            large = self.count_queries(url)
+        self.assertEqual(small, large, f"{url}: {small} queries for {self.SMALL} rows, {large} for {self.LARGE}")
+
+    def test_gallery(self):
+        self.assertConstantQueries('/api/images/', paged=True, sold_to=self.buyer)
+
+    def test_gallery_search(self):
+        self.assertConstantQueries('/api/images/?category=Animals', paged=True)
+
+    def test_gallery_sparse_fields(self):
+        self.assertConstantQueries('/api/images/?fields=id,thumbnail,title', paged=True)
+        response = self.client.get('/api/images/?fields=id,thumbnail,title')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'thumbnail', 'title'})
+
+    def test_gallery_collapsed_duplicates(self):
+        self.assertConstantQueries('/api/images/?collapse=duplicates', paged=True)
+
+    def test_my_purchases(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertConstantQueries('/api/my-purchases/', paged=True, sold_to=self.buyer)
+
+    def test_public_feed(self):
+        self.assertConstantQueries('/api/public-images/', paged=True, is_public=True)
+
+    def test_marketplace(self):
+        self.assertConstantQueries('/api/marketplace/', paged=True, for_sale=True, price='5.00')
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = ContentAddressedStorage(location=self.root)
+        self.name = shard_name('ab' * 32, '.jpg')
+
+    def test_same_bytes_share_one_blob(self):
+        self.assertEqual(self.storage.save(self.name, ContentFile(b'photo')), self.name)
+        self.assertEqual(self.storage.save(self.name, ContentFile(b'photo')), self.name)
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(self.name))), [os.path.basename(self.name)])
+
+    def test_concurrent_save_of_same_bytes(self):
+        self.storage.save(self.name, ContentFile(b'photo'))
+        # The second upload checked exists() before the first one finished writing
+        with mock.patch.object(ContentAddressedStorage, 'exists', return_value=False):
+            self.assertEqual(self.storage.save(self.name, ContentFile(b'photo')), self.name)
+        with self.storage.open(self.name) as f:
+            self.assertEqual(f.read(), b'photo')
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def png_header(width, height):
+    """
+    A well-formed PNG of the given size whose IDAT holds only the first scanline:
+    PIL opens it and reads the dimensions, and it stays tiny at any size.
+    """
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    first_row = zlib.compress(b'\x00' * (1 + 3 * width))
+    return (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', ihdr) + png_chunk(b'IDAT', first_row)
+            + png_chunk(b'IEND', b''))
+
+
+class UploadLimitTests(SimpleTestCase):
+    def handler(self, field='image_file'):
+        request = RequestFactory().post('/api/upload/')
+        handler = UploadLimitsHandler(request)
+        handler.new_file(field, 'upload.png', 'image/png', None)
+        return request, handler
+
+    def assertRejected(self, data):
+        request, handler = self.handler()
+        with self.assertRaises(SkipFile):
+            handler.receive_data_chunk(data, 0)
+        self.assertEqual([e['file'] for e in request.upload_limit_errors], ['upload.png'])
+
+    def test_decompression_bomb_header(self):
+        # Over twice the pixel limit, where PIL itself refuses to open the image
+        with self.assertRaises(ImageTooLarge):
+            read_header(png_header(20000, 20000))
+        self.assertRejected(png_header(20000, 20000))
+
+    def test_oversized_header(self):
+        self.assertRejected(png_header(12000, 12000))
+
+    def test_partial_header_waits_for_more_bytes(self):
+        request, handler = self.handler()
+        handler.receive_data_chunk(png_header(800, 600)[:12], 0)
+        self.assertFalse(handler.header_checked)
+        self.assertFalse(hasattr(request, 'upload_limit_errors'))
+
+    def test_small_image_passes(self):
+        request, handler = self.handler()
+        handler.receive_data_chunk(png_header(800, 600), 0)
+        self.assertTrue(handler.header_checked)
+        self.assertFalse(hasattr(request, 'upload_limit_errors'))
+
+    def test_other_fields_are_not_checked(self):
+        request, handler = self.handler(field='archive')
+        handler.receive_data_chunk(png_header(20000, 20000), 0)
+        self.assertFalse(hasattr(request, 'upload_limit_errors'))
+
+
+class PurchaseTests(APITestCase):
+    def setUp(self):
+        caches['feeds'].clear()
+        self.seller = User.objects.create_user('seller', password='pw')
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.client.force_authenticate(self.buyer)
+
+    def listing(self, n=0):
+        return ProcessedImage.objects.create(
+            image_file=f"images/00/{n:064d}.jpg", owner=self.seller, for_sale=True, price='5.00')
+
+    def buy(self, image, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post(f'/api/images/{image.pk}/purchase/', **headers)
+
+    def test_only_one_buyer_wins(self):
+        image = self.listing()
+        first, _ = purchases.purchase_image(image.pk, self.buyer)
+        with self.assertRaises(purchases.PurchaseError) as raised:
+            purchases.purchase_image(image.pk, self.other)
+        self.assertEqual(raised.exception.status_code, 409)
+        image.refresh_from_db()
+        self.assertEqual((image.sold_to_id, image.for_sale), (self.buyer.pk, False))
+        self.assertEqual(list(Purchase.objects.values_list('id', flat=True)), [first.pk])
+
+    def test_rebuy_is_a_conflict(self):
+        image = self.listing()
+        self.assertEqual(self.buy(image).status_code, 200)
+        self.assertEqual(self.buy(image).status_code, 409)
+
+    def test_several_purchases_without_a_key(self):
+        for n in range(3):
+            self.assertEqual(self.buy(self.listing(n)).status_code, 200)
+        self.assertEqual(Purchase.objects.filter(buyer=self.buyer, idempotency_key__isnull=True).count(), 3)
+
+    def test_key_replays_the_purchase(self):
+        image = self.listing()
+        first = self.buy(image, key='k1')
+        again = self.buy(image, key='k1')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(Purchase.objects.count(), 1)
+
+    def test_key_reused_for_another_image(self):
+        self.buy(self.listing(0), key='k1')
+        self.assertEqual(self.buy(self.listing(1), key='k1').status_code, 422)
+
+    def test_concurrent_request_with_the_same_key(self):
+        first = self.listing(0)
+        self.buy(first, key='k1')
+        second = self.listing(1)
+        # The other request committed after this one looked for a replay
+        with mock.patch.object(purchases, '_replay', side_effect=[None, None]):
+            with self.assertRaises(purchases.PurchaseError) as raised:
+                purchases.purchase_image(second.pk, self.buyer, 'k1')
+        self.assertEqual(raised.exception.status_code, 422)
+        second.refresh_from_db()
+        self.assertEqual((second.for_sale, second.sold_to_id), (True, None))  # the sale was undone
+        self.assertEqual(list(Purchase.objects.values_list('image_id', flat=True)), [first.pk])
+
+
+class StreamingUploadTests(APITestCase):
+    def setUp(self):
+        self.incoming = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.incoming)
+        patcher = mock.patch.object(uploads, 'INCOMING_DIR', uploads.Path(self.incoming))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_authenticate(User.objects.create_user('owner', password='pw'))
+
+    def upload(self, name, data):
+        return self.client.post('/api/upload/', {'image_file': SimpleUploadedFile(name, data)}, format='multipart')
+
+    def test_upload_is_sniffed_and_hashed(self):
+        data = png_header(800, 600)
+        handler = uploads.StreamingImageUploadHandler(RequestFactory().post('/api/upload/'))
+        handler.new_file('image_file', 'photo.bin', 'application/octet-stream', None)
+        self.assertIsNone(handler.receive_data_chunk(data, 0))
+        upload = handler.file_complete(len(data))
+        self.addCleanup(upload.close)
+        self.assertEqual((upload.content_hash, upload.extension), (hashlib.sha256(data).hexdigest(), '.png'))
+        self.assertEqual(upload.read(), data)
+
+    def test_non_image_is_unsupported(self):
+        response = self.upload('notes.txt', b'just some text, definitely not an image')
+        self.assertEqual(response.status_code, 415, response.content)
+
+    def test_oversized_image_is_too_large(self):
+        response = self.upload('huge.png', png_header(12000, 12000))
+        self.assertEqual(response.status_code, 413, response.content)
+        self.assertIn('144 MP', response.data['image_file'][0])
+        # Dropped while streaming: nothing spooled, nothing stored
+        self.assertEqual(os.listdir(self.incoming), [])
+        self.assertFalse(ProcessedImage.objects.exists())
+
+    def test_bulk_upload_reports_skipped_parts(self):
+        response = self.client.post('/api/upload/bulk/', {'images': [
+            SimpleUploadedFile('notes.txt', b'just some text, definitely not an image'),
+            SimpleUploadedFile('huge.png', png_header(12000, 12000)),
+        ]}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            [(line['event'], line.get('file'), line.get('reason')) for line in lines[:-1]],
+            [('rejected', 'notes.txt', 'unsupported'), ('rejected', 'huge.png', 'too_large')],
+        )
+        self.assertEqual(lines[-1], {'event': 'summary', 'accepted': 0, 'rejected': 2, 'unfinished': 0})
+        self.assertIn('144 MP', lines[1]['error'])
+        self.assertEqual(os.listdir(self.incoming), [])
+
+
+class ObjectStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.client = LocalObjectClient(os.path.join(self.root, 'bucket'))
+        self.cache = ReadCache(os.path.join(self.root, 'cache'), 1024 * 1024)
+        self.storage = ObjectStorage(self.client, self.cache)
+        self.name = shard_name('cd' * 32, '.jpg')
+
+    def test_saved_original_is_read_from_the_cache(self):
+        self.storage.save(self.name, ContentFile(b'photo'))
+        self.assertEqual(self.client.head(self.name)['size'], 5)
+        with mock.patch.object(self.client, 'get') as download:
+            with open(self.storage.local_path(self.name), 'rb') as f:
+                self.assertEqual(f.read(), b'photo')
+        download.assert_not_called()
+
+    def test_missing_blob_is_downloaded_once(self):
+        self.client.put(self.name, ContentFile(b'photo'))
+        with mock.patch.object(self.client, 'get', wraps=self.client.get) as download:
+            self.storage.local_path(self.name)
+            self.storage.local_path(self.name)
+        self.assertEqual(download.call_count, 1)
+
+    def test_emulated_bucket_has_no_presigned_urls(self):
+        self.storage.save(self.name, ContentFile(b'photo'))
+        self.assertIsNone(self.storage.presigned_url(self.name))
+
+
+class MediaTests(APITestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        override = override_settings(MEDIA_ROOT=root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.name = shard_name('ef' * 32, '.jpg')
+        self.thumbnail = shard_name('ef' * 32, '_w320.webp')
+        for name, data in ((self.name, b'0123456789'), (self.thumbnail, b'thumb')):
+            os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(data)
+        self.image = ProcessedImage.objects.create(image_file=self.name, owner=self.owner)
+
+    def get(self, name, **headers):
+        return self.client.get(f'/media/{name}', **headers)
+
+    def test_private_media_needs_a_signature_or_the_owner(self):
+        self.assertEqual(self.get(self.name).status_code, 404)
+        self.assertEqual(self.client.get(media_url(self.image, self.name)).status_code, 200)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.get(self.name).status_code, 200)
+
+    def test_public_original_is_revalidated(self):
+        self.image.is_public = True
+        self.image.save()
+        response = self.get(self.name)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+        self.assertIn('immutable', self.get(self.thumbnail)['Cache-Control'])
+        self.image.is_public = False
+        self.image.save()
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+    def test_not_modified(self):
+        self.client.force_login(self.owner)
+        etag = self.get(self.name)['ETag']
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_byte_ranges(self):
+        self.client.force_login(self.owner)
+        partial = self.get(self.name, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(b''.join(partial.streaming_content), b'234')
+        self.assertEqual(partial['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(self.get(self.name, HTTP_RANGE='bytes=-3').streaming_content), b'789')
+        unsatisfiable = self.get(self.name, HTTP_RANGE='bytes=20-')
+        self.assertEqual(unsatisfiable.status_code, 416)
+        self.assertEqual(unsatisfiable['Content-Range'], 'bytes */10')
+
+
+class MetricsAccessTests(APITestCase):
+    def test_requires_the_token(self):
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            # Behind the front server every request comes from localhost; that must not be enough
+            self.assertEqual(self.client.get('/api/metrics/', REMOTE_ADDR='127.0.0.1').status_code, 403)
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class LabelIndexTests(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.dog = self.image(['dog', 'Golden Retriever'], ['Animals'])
+        self.cat = self.image(['cat', 'dogwood'], ['Animals', 'Plants'])
+        self.car = self.image(['sports car'], ['Vehicles'])
+        self.image(['dog'], ['Animals'], owner=self.other)
+
+    def image(self, labels, categories, owner=None):
+        n = ProcessedImage.objects.count()
+        image = ProcessedImage.objects.create(image_file=f"images/00/{n:064d}.jpg", owner=owner or self.owner,
+                                              detailed_labels=labels, general_categories=categories)
+        sync_image_labels(image)
+        return image
+
+    def ids(self, **filters):
+        images = filter_images(ProcessedImage.objects.filter(owner=self.owner), self.owner, **filters)
+        return set(images.values_list('id', flat=True))
+
+    def test_exact_and_prefix(self):
+        self.assertEqual(self.ids(labels=['dog']), {self.dog.pk})
+        self.assertEqual(self.ids(search=['dog']), {self.dog.pk, self.cat.pk})
+        self.assertEqual(self.ids(labels=['golden retriever']), {self.dog.pk})
+
+    def test_and_or(self):
+        self.assertEqual(self.ids(categories=['animals', 'plants']), {self.cat.pk})
+        self.assertEqual(self.ids(categories=['plants', 'vehicles'], match=MATCH_ANY), {self.cat.pk, self.car.pk})
+        self.assertEqual(self.ids(search=['dog', 'ca']), {self.cat.pk})
+        self.assertEqual(self.ids(categories=['animals'], search=['golden']), {self.dog.pk})
+
+    def test_resync_replaces_rows(self):
+        self.dog.detailed_labels = ['wolf']
+        self.dog.save()
+        sync_image_labels(self.dog)
+        self.assertEqual(self.ids(labels=['dog']), set())
+        self.assertEqual(self.ids(labels=['wolf']), {self.dog.pk})
+
+    def test_failed_sync_keeps_the_old_rows(self):
+        self.dog.detailed_labels = ['wolf']
+        with mock.patch.object(ImageLabel.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                sync_image_labels(self.dog)
+        self.assertEqual(self.ids(labels=['dog']), {self.dog.pk})
+
+
+class FeedCacheTests(APITestCase):
+    def setUp(self):
+        caches['feeds'].clear()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.image = ProcessedImage.objects.create(image_file=f"images/00/{0:064d}.jpg", owner=self.owner)
+        # self.client stays anonymous; logging it in and out would add session queries to the counts
+        self.owner_client = APIClient()
+        self.owner_client.force_authenticate(self.owner)
+
+    def public_ids(self):
+        response = self.client.get('/api/public-images/')
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_publishing_invalidates_the_cached_feed(self):
+        self.assertEqual(self.public_ids(), [])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.public_ids(), [])
+        self.assertEqual(len(queries), 0)  # served from the cache
+        response = self.owner_client.patch(f'/api/images/{self.image.pk}/', {'is_public': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.public_ids(), [self.image.pk])
+
+    def test_change_made_elsewhere_invalidates(self):
+        # What an analysis worker does: no request in this process, only the shared generation bump
+        self.assertEqual(self.public_ids(), [])
+        ProcessedImage.objects.filter(pk=self.image.pk).update(is_public=True)
+        feed_cache.invalidate(feed_cache.PUBLIC_FEED)
+        self.assertEqual(self.public_ids(), [self.image.pk])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        image = ProcessedImage.objects.create(image_file=f"images/00/{0:064d}.jpg", owner=owner)
+        self.job = AnalysisJob.objects.create(image=image, max_attempts=2)
+
+    def status(self):
+        self.job.refresh_from_db()
+        return self.job.status, self.job.attempts
+
+    def test_a_job_is_claimed_once(self):
+        self.assertEqual(jobs.claim_next_job().pk, self.job.pk)
+        self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(self.status(), (AnalysisJob.STATUS_RUNNING, 1))
+
+    def test_losing_the_claim_race(self):
+        update = QuerySet.update
+
+        def other_worker_first(queryset, **kwargs):
+            # Another worker flips the job to running between our read and our conditional update
+            QuerySet.update = update
+            AnalysisJob.objects.filter(pk=self.job.pk).update(status=AnalysisJob.STATUS_RUNNING, attempts=1)
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', other_worker_first):
+            self.assertIsNone(jobs.claim_next_job())
+        self.assertEqual(self.status(), (AnalysisJob.STATUS_RUNNING, 1))
+
+    def test_failures_back_off_then_fail(self):
+        jobs._record_failure(jobs.claim_next_job(), "boom")
+        self.assertEqual(self.status(), (AnalysisJob.STATUS_PENDING, 1))
+        self.assertGreater(self.job.run_after, timezone.now())
+        self.assertIsNone(jobs.claim_next_job())  # not due yet
+
+        AnalysisJob.objects.filter(pk=self.job.pk).update(run_after=timezone.now())
+        jobs._record_failure(jobs.claim_next_job(), "boom again")
+        self.assertEqual(self.status(), (AnalysisJob.STATUS_FAILED, 2))
+        self.assertEqual(self.job.last_error, "boom again")
+
+        self.assertTrue(jobs.retry_job(self.job))
+        self.assertFalse(jobs.retry_job(self.job))  # only failed jobs are retried
+        self.assertEqual(self.status(), (AnalysisJob.STATUS_PENDING, 0))
+        self.assertEqual(jobs.claim_next_job().pk, self.job.pk)
+
+    def test_expired_lease_is_requeued(self):
+        jobs.claim_next_job()
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+        expired = timezone.now() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)
+        AnalysisJob.objects.filter(pk=self.job.pk).update(locked_at=expired)
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(self.status(), (AnalysisJob.STATUS_PENDING, 1))
+        self.assertIsNone(self.job.locked_at)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pw')
+        self.client.force_authenticate(owner)
+        for i in range(7):
+            ProcessedImage.objects.create(image_file=f"images/00/{i:064d}.jpg", owner=owner)
+
+    def walk(self, page_size):
+        ids, cursor = [], None
+        while True:
+            url = f'/api/images/?page_size={page_size}' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            ids += [row['id'] for row in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_pages_with_tied_timestamps(self):
+        # Bulk uploads often share uploaded_at: the id tie-break must neither skip nor repeat rows
+        ProcessedImage.objects.update(uploaded_at=timezone.now())
+        expected = sorted(ProcessedImage.objects.values_list('id', flat=True), reverse=True)
+        for page_size in (1, 3, 7):
+            self.assertEqual(self.walk(page_size), expected)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/images/?cursor=not-a-cursor').status_code, 400)
+
+
+class UserStatsTests(APITestCase):
+    def setUp(self):
+        caches['feeds'].clear()
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        self.images = []
+        for i, categories in enumerate([['Animals'], ['Animals', 'Plants'], ['Vehicles']]):
+            # What an upload followed by its analysis does
+            image = ProcessedImage.objects.create(image_file=f"images/00/{i:064d}.jpg", owner=self.owner)
+            record_change(self.owner.pk, None, image_state(image))
+            before = image_state(image)
+            image.general_categories = categories
+            image.save()
+            sync_image_labels(image)
+            record_change(self.owner.pk, before, image_state(image))
+            self.images.append(image)
+
+    def totals(self, stats):
+        return stats.image_count, stats.for_sale_count, stats.sold_count, stats.category_counts
+
+    def assertMatchesRecompute(self):
+        self.assertEqual(self.totals(get_user_stats(self.owner.pk)), self.totals(rebuild_user_stats(self.owner.pk)))
+
+    def test_incremental_totals_match_a_recompute(self):
+        self.assertEqual(self.totals(get_user_stats(self.owner.pk)),
+                         (3, 0, 0, {'Animals': 2, 'Plants': 1, 'Vehicles': 1}))
+
+        self.client.force_authenticate(self.owner)
+        dog, plant, car = self.images
+        response = self.client.patch(f'/api/images/{plant.pk}/', {'general_categories': ['Plants']}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.client.patch(f'/api/images/{car.pk}/', {'for_sale': True, 'price': '5.00'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertMatchesRecompute()
+
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.post(f'/api/images/{car.pk}/purchase/').status_code, 200)
+        self.assertMatchesRecompute()
+
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.delete(f'/api/images/{dog.pk}/').status_code, 204)
+        self.assertMatchesRecompute()
+        response = self.client.get('/api/stats/')
+        self.assertEqual(
+            {key: response.data[key] for key in ('image_count', 'for_sale_count', 'sold_count', 'category_counts')},
+            {'image_count': 2, 'for_sale_count': 0, 'sold_count': 1, 'category_counts': {'Plants': 1, 'Vehicles': 1}},
+        )
+
+    def test_drifted_counter_does_not_go_negative(self):
+        # An image listed behind record_change's back, then deleted through it
+        record_change(self.owner.pk, {'categories': [], 'for_sale': True, 'sold': False}, None)
+        self.assertEqual(self.totals(get_user_stats(self.owner.pk))[:3], (2, 0, 0))
+
+
+class MigrateStorageTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(MEDIA_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(storage, 'BACKEND', 'local')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        owner = User.objects.create_user('owner', password='pw')
+        self.hash = hashlib.sha256(b'photo').hexdigest()
+        # One-level layout from before sharding, with a WebP thumbnail next to it
+        self.old = f"images/{self.hash[:2]}/{self.hash}.jpg"
+        self.write(self.old, b'photo')
+        self.write(f"images/{self.hash[:2]}/{self.hash}_w320.webp", b'thumb')
+        self.image = ProcessedImage.objects.create(
+            image_file=self.old, owner=owner,
+            thumbnails={'spec': {'formats': ['webp']}, 'sizes': [[320, 240]]},
+        )
+        # Legacy upload stored under its client file name
+        self.write('images/holiday.JPG', b'beach')
+        self.legacy = ProcessedImage.objects.create(image_file='images/holiday.JPG', owner=owner)
+
+    def write(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    def migrate(self, *args):
+        out = io.StringIO()
+        call_command('migrate_storage', *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_reshard_then_delete_source(self):
+        self.assertIn("Copied 3 blobs, repointed 2 images, 0 already in place, 0 failed.", self.migrate())
+        new = shard_name(self.hash, '.jpg')
+        self.image.refresh_from_db()
+        self.assertEqual((self.image.image_file.name, self.image.content_hash), (new, self.hash))
+        self.assertEqual(self.read(new), b'photo')
+        self.assertEqual(self.read(shard_name(self.hash, '_w320.webp')), b'thumb')
+        beach = hashlib.sha256(b'beach').hexdigest()
+        self.legacy.refresh_from_db()
+        self.assertEqual((self.legacy.image_file.name, self.legacy.content_hash), (shard_name(beach, '.jpg'), beach))
+        self.assertTrue(os.path.exists(os.path.join(self.root, self.old)))  # old URLs keep working
+
+        self.assertIn("Copied 0 blobs, repointed 0 images, 2 already in place", self.migrate())
+
+        self.migrate('--delete-source')
+        self.assertFalse(os.path.exists(os.path.join(self.root, self.old)))
+        self.assertEqual(self.read(new), b'photo')
+        # Not named by its hash, so never deleted automatically
+        self.assertEqual(self.read('images/holiday.JPG'), b'beach')
@@ -0,0 +1,149 @@
+"""
+Resized derivatives of uploaded images for the galleries.
+
+For every width in THUMBNAIL_WIDTHS narrower than the original, one file
+per format in THUMBNAIL_FORMATS is written next to the original blob:
+images/ab/cd/<hash>.jpg -> images/ab/cd/<hash>_w320.webp, ..._w320.jpg. Names
+depend only on the content hash, so duplicates share derivatives and
+re-running generation is a no-op. What was generated is recorded on
+ProcessedImage.thumbnails, which the serializers turn into srcset URLs
+without touching the filesystem.
+
+Generation needs OpenCV and runs in the analysis workers, reusing the
+buffer decoded for analysis; `thumbnail_urls` is safe to call anywhere.
+"""
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .storage import local_path
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = tuple(sorted(getattr(settings, 'THUMBNAIL_WIDTHS', (160, 320, 640, 1280))))
+THUMBNAIL_FORMATS = tuple(getattr(settings, 'THUMBNAIL_FORMATS', ('webp', 'jpg')))
+THUMBNAIL_QUALITY = getattr(settings, 'THUMBNAIL_QUALITY', 80)
+# Width used for the plain `thumbnail` URL (tiles in browsers that ignore srcset)
+DEFAULT_THUMBNAIL_WIDTH = getattr(settings, 'THUMBNAIL_DEFAULT_WIDTH', 320)
+
+MIME_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+
+
+def thumbnail_name(original_name: str, width: int, fmt: str) -> str:
+    base, _ = posixpath.splitext(original_name)
+    return f"{base}_w{width}.{fmt}"
+
+
+def _spec() -> dict:
+    return {'widths': list(THUMBNAIL_WIDTHS), 'formats': list(THUMBNAIL_FORMATS), 'quality': THUMBNAIL_QUALITY}
+
+
+def is_current(image) -> bool:
+    """True if the image already has derivatives for the configured widths/formats."""
+    return bool(image.thumbnails) and image.thumbnails.get('spec') == _spec()
+
+
+def _encode(bgr, fmt: str) -> bytes:
+    import cv2
+
+    if fmt == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, THUMBNAIL_QUALITY]
+    elif fmt == 'jpg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY, cv2.IMWRITE_JPEG_PROGRESSIVE, 1,
+                  cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    else:
+        raise ValueError(f"Unsupported thumbnail format '{fmt}'")
+    ok, buffer = cv2.imencode(f".{fmt}", bgr, params)
+    if not ok:
+        raise ValueError(f"Failed to encode {fmt} thumbnail")
+    return buffer.tobytes()
+
+
+def generate_thumbnails(image, decoded=None, force: bool = False, allow_decode: bool = True):
+    """
+    Writes the missing derivatives of `image` and records them on
+    image.thumbnails. `decoded` is the DecodedImage the analysis already
+    holds; without it the original is decoded once here. With
+    allow_decode=False (API processes) only derivatives that already exist
+    for the same bytes are adopted, and None is returned if any are missing.
+    """
+    if is_current(image) and not force:
+        return image.thumbnails
+
+    storage = image.image_file.storage
+    original = image.image_file.name
+    if decoded is not None:
+        # The buffer may be a reduced decode; it is still at least as wide as the largest size
+        width, height = decoded.original_size
+    else:
+        from .image_limits import read_header
+
+        with storage.open(original) as f:
+            width, height = read_header(f)[:2]  # header only, upright
+    # Never upscale: the original itself covers widths it doesn't exceed
+    sizes = [[w, max(1, round(height * w / width))] for w in THUMBNAIL_WIDTHS if w < width]
+    names = {(w, fmt): thumbnail_name(original, w, fmt) for w, _ in sizes for fmt in THUMBNAIL_FORMATS}
+    missing = force or not all(storage.exists(name) for name in names.values())
+
+    if missing:
+        if decoded is None:
+            if not allow_decode:
+                return None
+            from .analysis import decode_image
+            decoded = decode_image(local_path(image.image_file))
+        import cv2
+
+        source = decoded.bgr
+        # Largest first, each smaller size resized from the previous one (cheaper, same quality with INTER_AREA)
+        for target, target_height in reversed(sizes):
+            source = cv2.resize(source, (target, target_height), interpolation=cv2.INTER_AREA)
+            for fmt in THUMBNAIL_FORMATS:
+                name = names[(target, fmt)]
+                if storage.exists(name):
+                    if not force:
+                        continue
+                    storage.delete(name)
+                storage.save_derivative(name, ContentFile(_encode(source, fmt)))
+
+    image.thumbnails = {'spec': _spec(), 'width': width, 'height': height, 'sizes': sorted(sizes)}
+    image.save(update_fields=['thumbnails'])
+    return image.thumbnails
+
+
+def safe_generate_thumbnails(image, decoded=None):
+    """generate_thumbnails for the analysis path: a thumbnail problem must not fail the job."""
+    try:
+        generate_thumbnails(image, decoded=decoded)
+    except Exception:
+        logger.exception("Could not generate thumbnails for image %s", image.pk)
+
+
+def thumbnail_urls(image, url_for=None) -> dict:
+    """
+    {'thumbnail': url, 'srcset': {'webp': '... 160w, ... 320w', 'jpg': ...}}
+    for the serializers; falls back to the original when nothing is generated yet.
+    `url_for(name)` turns a storage name into the URL to hand out.
+    """
+    if not image.image_file:
+        return {'thumbnail': None, 'srcset': {}}
+    url_for = url_for or image.image_file.storage.url
+    original = image.image_file.name
+    original_url = url_for(original)
+    info = image.thumbnails or {}
+    sizes = info.get('sizes') or []
+    formats = (info.get('spec') or {}).get('formats') or []
+    if not sizes:
+        return {'thumbnail': original_url, 'srcset': {}}
+
+    srcset = {}
+    for fmt in formats:
+        entries = [f"{url_for(thumbnail_name(original, w, fmt))} {w}w" for w, _ in sizes]
+        if info.get('width'):
+            entries.append(f"{original_url} {info['width']}w")
+        srcset[fmt] = ", ".join(entries)
+
+    fallback_fmt = 'jpg' if 'jpg' in formats else formats[0]
+    default_width = min((w for w, _ in sizes if w >= DEFAULT_THUMBNAIL_WIDTH), default=sizes[-1][0])
+    return {'thumbnail': url_for(thumbnail_name(original, default_width, fallback_fmt)), 'srcset': srcset}
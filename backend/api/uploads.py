@@ -0,0 +1,132 @@
+"""
+Streaming upload handling for image files.
+
+`StreamingImageUploadHandler` takes over the image parts of a multipart
+body (`image_file`, `images`) from Django's default handlers and, chunk by
+chunk as they arrive:
+  - sniffs the magic bytes of the first chunk and skips anything that
+    is not a JPEG/PNG/GIF/WebP/BMP/TIFF without reading the rest;
+  - enforces the byte and pixel limits (see image_limits.py);
+  - feeds SHA-256;
+  - writes to UPLOAD_INCOMING_DIR, which sits inside MEDIA_ROOT so with
+    the local storage backend the final save is a rename, not a copy.
+
+The resulting `IncomingUploadedFile` carries `content_hash` and the sniffed
+`extension`, so storage.content_addressed_upload_to names the blob without
+reading the file again, and an upload of bytes already stored is dropped
+instead of moved.
+"""
+import hashlib
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+from .image_limits import UploadLimitsHandler
+
+INCOMING_DIR = Path(getattr(settings, 'UPLOAD_INCOMING_DIR', Path(settings.MEDIA_ROOT) / '.incoming'))
+SNIFF_BYTES = 12
+
+# (format, extension, predicate over the first SNIFF_BYTES bytes)
+MAGIC = (
+    ('jpeg', '.jpg', lambda head: head.startswith(b'\xff\xd8\xff')),
+    ('png', '.png', lambda head: head.startswith(b'\x89PNG\r\n\x1a\n')),
+    ('gif', '.gif', lambda head: head[:6] in (b'GIF87a', b'GIF89a')),
+    ('webp', '.webp', lambda head: head[:4] == b'RIFF' and head[8:12] == b'WEBP'),
+    ('bmp', '.bmp', lambda head: head.startswith(b'BM')),
+    ('tiff', '.tif', lambda head: head[:4] in (b'II*\x00', b'MM\x00*')),
+)
+
+
+def sniff(head: bytes):
+    """(format, extension) from the leading bytes, or None if not a supported image."""
+    for image_format, extension, matches in MAGIC:
+        if matches(head):
+            return image_format, extension
+    return None
+
+
+class IncomingUploadedFile(UploadedFile):
+    """An image upload already hashed and sniffed, spooled next to its final location."""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        INCOMING_DIR.mkdir(parents=True, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=INCOMING_DIR)
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.content_hash = None
+        self.image_format = None
+        self.extension = None
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            pass  # renamed into place by the storage
+
+
+class StreamingImageUploadHandler(UploadLimitsHandler):
+    """First in the chain: image parts end here, every other part passes through."""
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.upload = None
+        if not self.active:
+            return
+        self.digest = hashlib.sha256()
+        self.sniffed = None
+        self.lead = b''
+        self.upload = IncomingUploadedFile(file_name, content_type, 0, charset, content_type_extra)
+
+    def _reject(self, message, reason='too_large'):
+        self._discard()
+        super()._reject(message, reason)
+
+    def _discard(self):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.sniffed is None:
+            self.lead += raw_data[:SNIFF_BYTES]
+            if len(self.lead) >= SNIFF_BYTES or len(raw_data) < self.chunk_size:
+                self.sniffed = sniff(self.lead)
+                if self.sniffed is None:
+                    self._reject("Not a supported image (JPEG, PNG, GIF, WebP, BMP or TIFF).", reason='unsupported')
+        super().receive_data_chunk(raw_data, start)  # byte and pixel limits; raises SkipFile
+        self.digest.update(raw_data)
+        self.upload.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active or self.upload is None:
+            return None
+        if self.sniffed is None:
+            # Empty part: nothing was received, the serializer reports it
+            self._discard()
+            return None
+        upload, self.upload = self.upload, None
+        upload.file.flush()
+        upload.seek(0)
+        upload.size = file_size
+        upload.content_hash = self.digest.hexdigest()
+        upload.image_format, upload.extension = self.sniffed
+        return upload
+
+    def upload_interrupted(self):
+        self._discard()
+
+
+def upload_handlers(request, handlers=None):
+    """The streaming image handler in front of `handlers` (default: the request's configured ones)."""
+    handlers = request.upload_handlers if handlers is None else handlers
+    return [StreamingImageUploadHandler(request)] + [
+        handler for handler in handlers if not isinstance(handler, UploadLimitsHandler)
+    ]
+
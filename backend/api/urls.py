@@ -5,8 +5,14 @@ from . import views
 urlpatterns = [
     path('signup/', views.SignupView.as_view(), name='signup'),
     path('upload/', views.ImageUploadView.as_view(), name='image-upload'),
+    path('upload/bulk/', views.BulkImageUploadView.as_view(), name='image-bulk-upload'),
+    path('jobs/<int:pk>/', views.AnalysisJobDetailView.as_view(), name='analysis-job-detail'),
+    path('jobs/<int:pk>/retry/', views.AnalysisJobRetryView.as_view(), name='analysis-job-retry'),
     path('images/', views.ImageListView.as_view(), name='image-list'), # Add this line
+    path('images/facets/', views.ImageFacetsView.as_view(), name='image-facets'),
+    path('images/clusters/', views.ImageClustersView.as_view(), name='image-clusters'),
     path('images/<int:pk>/', views.ImageDetailView.as_view(), name='image-detail'),
+    path('images/<int:pk>/similar/', views.ImageSimilarView.as_view(), name='image-similar'),
     path('user/delete/', views.UserDeleteView.as_view(), name='user-delete'),
     path('profile/', views.UserProfileView.as_view(), name='user-profile'),
     path('stats/', views.UserStatsView.as_view(), name='user-stats'),
@@ -14,4 +20,5 @@ urlpatterns = [
     path('marketplace/', views.MarketplaceListView.as_view(), name='marketplace-list'),
     path('my-purchases/', views.MyPurchasesListView.as_view(), name='my-purchases-list'),
     path('images/<int:pk>/purchase/', views.PurchaseImageView.as_view(), name='purchase-image'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Incremental maintenance of UserStats.
+
+Every code path that changes what the stats count takes an `image_state`
+snapshot before the change and calls `record_change` afterwards. Creation
+and deletion pass `None` for the missing side. The counters move by the
+difference in conditional UPDATEs with F() expressions, so concurrent changes
+for one owner never lose an increment (djongo honours neither row locks nor
+transactions). Category counts are recounted from the label index, which
+callers sync before recording the change.
+"""
+from typing import Optional
+
+from django.db.models import F
+
+from .label_index import category_counts
+from .models import ProcessedImage, UserStats
+
+
+def image_state(image: ProcessedImage) -> dict:
+    """The parts of an image UserStats counts."""
+    sold = image.sold_to_id is not None
+    return {
+        'categories': sorted(set(image.general_categories or [])),
+        'for_sale': bool(image.for_sale) and not sold,
+        'sold': sold,
+    }
+
+
+def _delta(before: Optional[dict], after: Optional[dict]):
+    images = (after is not None) - (before is not None)
+    for_sale = int(bool(after and after['for_sale'])) - int(bool(before and before['for_sale']))
+    sold = int(bool(after and after['sold'])) - int(bool(before and before['sold']))
+    categories = {}
+    for category in (before or {}).get('categories', []):
+        categories[category] = categories.get(category, 0) - 1
+    for category in (after or {}).get('categories', []):
+        categories[category] = categories.get(category, 0) + 1
+    return images, for_sale, sold, {k: v for k, v in categories.items() if v}
+
+
+def record_change(owner_id: int, before: Optional[dict], after: Optional[dict]):
+    """Applies the difference between two image_state snapshots to the owner's stats."""
+    images, for_sale, sold, categories = _delta(before, after)
+    if not (images or for_sale or sold or categories):
+        return
+    stats = UserStats.objects.filter(user_id=owner_id)
+    if not stats.exists():
+        # First change for this user since the table was introduced: start from the truth
+        rebuild_user_stats(owner_id)
+        return
+    for field, change in (('image_count', images), ('for_sale_count', for_sale), ('sold_count', sold)):
+        if change > 0:
+            stats.update(**{field: F(field) + change})
+        elif change < 0:
+            # A counter that drifted low stays put instead of going negative; rebuild_user_stats repairs it
+            stats.filter(**{f'{field}__gte': -change}).update(**{field: F(field) + change})
+    if categories:
+        stats.update(category_counts=category_counts(owner_id))
+
+
+def rebuild_user_stats(user_id: int) -> UserStats:
+    """Recomputes one user's stats from their images (repairs, first use)."""
+    totals = {'image_count': 0, 'for_sale_count': 0, 'sold_count': 0, 'category_counts': {}}
+    images = ProcessedImage.objects.filter(owner_id=user_id).only('general_categories', 'for_sale', 'sold_to')
+    for image in images.iterator():
+        state = image_state(image)
+        totals['image_count'] += 1
+        totals['for_sale_count'] += state['for_sale']
+        totals['sold_count'] += state['sold']
+        for category in state['categories']:
+            totals['category_counts'][category] = totals['category_counts'].get(category, 0) + 1
+    stats, _ = UserStats.objects.update_or_create(user_id=user_id, defaults=totals)
+    return stats
+
+
+def get_user_stats(user_id: int) -> UserStats:
+    stats = UserStats.objects.filter(user_id=user_id).first()
+    return stats if stats is not None else rebuild_user_stats(user_id)
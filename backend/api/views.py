@@ -1,17 +1,32 @@
-from pathlib import Path
 from django.contrib.auth.models import User
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.conf import settings
+from django.db.models import Count, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from rest_framework import status, generics
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from decimal import Decimal
-from .models import ProcessedImage, UserProfile
+from .models import AnalysisJob, ProcessedImage, UserProfile
 from bson.decimal128 import Decimal128
-from .analysis import analyze_image_and_categorize, load_category_map_from_json
+from . import metrics
+from .bulk import stream_bulk_upload
+from .duplicates import cluster_sizes, collapse_duplicates, detach
+from .embeddings import BRUTE_FORCE_MAX, get_store
+from .uploads import upload_handlers
+from .jobs import enqueue_analysis, retry_job
+from .label_index import MATCH_ALL, MATCH_ANY, facet_counts, filter_images, parse_terms, sync_image_labels
+from . import feed_cache
+from .feed_cache import CachedFeedMixin
+from .pagination import KeysetPagination
+from .sparse import SparseListMixin
+from .purchases import PurchaseError, purchase_image
+from .user_stats import get_user_stats, image_state, record_change
 # from .models import ProcessedImage
-from .serializers import ProcessedImageSerializer, UserSerializer,PublicImageSerializer,UserProfileSerializer
-CATEGORY_MAP = load_category_map_from_json("categories.json")
+from .serializers import AnalysisJobSerializer, ProcessedImageSerializer, UserSerializer,PublicImageSerializer,UserProfileSerializer
 
 
 class ImageUploadView(APIView):
@@ -19,46 +34,181 @@ class ImageUploadView(APIView):
     permission_classes = [IsAuthenticated]  # <-- FIXED: Require user to be logged in
 
     def post(self, request, *args, **kwargs):
-        serializer = ProcessedImageSerializer(data=request.data)
+        # Hashed, sniffed and size-checked while the body streams in (see uploads.py)
+        request._request.upload_handlers = upload_handlers(request._request)
+        data = request.data
+        limit_errors = getattr(request._request, 'upload_limit_errors', None)
+        if limit_errors:
+            error = limit_errors[0]
+            code = (status.HTTP_415_UNSUPPORTED_MEDIA_TYPE if error['reason'] == 'unsupported'
+                    else status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            return Response({'image_file': [error['error']]}, status=code)
+        serializer = ProcessedImageSerializer(data=data)
         if serializer.is_valid():
             # FIXED: Save the image with the logged-in user as the owner
             instance = serializer.save(owner=self.request.user)
+            record_change(instance.owner_id, None, image_state(instance))
 
-            image_path = Path(instance.image_file.path)
-            results = analyze_image_and_categorize(
-                image_path=image_path, 
-                device="cpu",
-                category_map=CATEGORY_MAP
+            # Analysis runs in the worker pool (manage.py run_analysis_worker);
+            # the client polls the job's status URL for the labels.
+            job = enqueue_analysis(instance)
+            job_serializer = AnalysisJobSerializer(job)
+            status_url = reverse('analysis-job-detail', kwargs={'pk': job.pk})
+            return Response(
+                {**job_serializer.data, 'status_url': status_url},
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': status_url},
             )
-            
-            instance.detailed_labels = results.get("detailed_labels", [])
-            instance.general_categories = results.get("general_categories", [])
-            instance.save()
-            
-            final_serializer = ProcessedImageSerializer(instance)
-            return Response(final_serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ImageListView(generics.ListAPIView):
+class BulkImageUploadView(APIView):
+    """
+    Accepts many `images` files and/or one zip `archive` and streams back one
+    NDJSON line per file as it is queued and as its analysis finishes.
+    Send `Accept: text/event-stream` to get server-sent events instead.
+    """
+    parser_classes = (MultiPartParser, FormParser)
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        # Spool every part straight to disk; archives can be gigabytes. Oversized
+        # images are dropped while streaming and reported as rejected lines.
+        request._request.upload_handlers = upload_handlers(
+            request._request, [TemporaryFileUploadHandler(request._request)])
+
+        files = request.FILES.getlist('images')
+        limit_errors = getattr(request._request, 'upload_limit_errors', [])
+        archive = request.FILES.get('archive')
+        if not files and archive is None and not limit_errors:
+            return Response({'error': 'Send one or more "images" files or an "archive" zip.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        event_stream = 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
+        response = StreamingHttpResponse(
+            stream_bulk_upload(request.user, files, archive, event_stream=event_stream, skipped=limit_errors),
+            content_type='text/event-stream' if event_stream else 'application/x-ndjson',
+            status=status.HTTP_200_OK,
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # let nginx pass lines through as they come
+        return response
+
+
+class AnalysisJobDetailView(generics.RetrieveAPIView):
+    """Status/poll endpoint for an upload's analysis job."""
+    serializer_class = AnalysisJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return AnalysisJob.objects.filter(image__owner=self.request.user).select_related('image__owner', 'image__sold_to')
+
+
+class AnalysisJobRetryView(APIView):
+    """Re-queues a job that has exhausted its automatic retries."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk, *args, **kwargs):
+        try:
+            job = AnalysisJob.objects.get(pk=pk, image__owner=request.user)
+        except AnalysisJob.DoesNotExist:
+            return Response({'error': 'Job not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        if not retry_job(job):
+            return Response({'error': 'Only failed jobs can be retried.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        job.refresh_from_db()
+        return Response(AnalysisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ImageListView(SparseListMixin, generics.ListAPIView):
+    """
+    The user's gallery, one keyset page at a time (?cursor=, ?page_size=,
+    ?count=true, ?fields=id,thumbnail,title). Filters are answered from the ImageLabel index:
+      ?category=Animals / ?categories=Animals,People   exact category names
+      ?labels=dog,cat                                  exact label names
+      ?search=do,ca                                    label prefixes
+      ?match=any                                       OR within a filter (default: all = AND)
+    Near-duplicates (see duplicates.py):
+      ?collapse=duplicates                             one image per cluster
+      ?duplicate_group=<id>                            the images of one cluster
+    """
     serializer_class = ProcessedImageSerializer
     permission_classes = [IsAuthenticated]  # <-- FIXED: Require user to be logged in
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
+        params = self.request.query_params
         # FIXED: Only return images owned by the current logged-in user
-        queryset = ProcessedImage.objects.filter(owner=user).order_by('-uploaded_at')
-        
-        category_name = self.request.query_params.get('category')
-        if category_name is not None:
-            queryset = queryset.filter(general_categories__icontains=category_name)
+        queryset = ProcessedImage.objects.filter(owner=user).select_related('owner', 'sold_to').order_by('-uploaded_at')
+        if params.get('duplicate_group', '').isdigit():
+            queryset = queryset.filter(duplicate_group=int(params['duplicate_group']))
+        elif params.get('collapse') == 'duplicates':
+            queryset = collapse_duplicates(queryset)
+        return filter_images_from_params(queryset, user, params)
+
 
-        search_term = self.request.query_params.get('search')
-        if search_term is not None:
-            queryset = queryset.filter(detailed_labels__icontains=search_term)
-            
-        return queryset
+class ImageClustersView(APIView):
+    """
+    The user's near-duplicate clusters, largest first (?offset=, ?limit=),
+    each with its size, cover image (the oldest) and member ids. List a
+    cluster's images with /api/images/?duplicate_group=<group>.
+    """
+    permission_classes = [IsAuthenticated]
+    MAX_LIMIT = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            offset = max(0, int(request.query_params.get('offset', 0)))
+            limit = max(1, min(int(request.query_params.get('limit', 20)), self.MAX_LIMIT))
+        except ValueError:
+            return Response({'error': 'offset and limit must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        clusters = cluster_sizes(request.user)
+        page = list(clusters[offset:offset + limit])
+        groups = [row['duplicate_group'] for row in page]
+        members = {}
+        for image_id, group in (ProcessedImage.objects.filter(owner=request.user, duplicate_group__in=groups)
+                                .order_by('id').values_list('id', 'duplicate_group')):
+            members.setdefault(group, []).append(image_id)
+        covers = ProcessedImage.objects.select_related('owner', 'sold_to').in_bulk(groups)
+        results = [
+            {
+                'group': row['duplicate_group'],
+                'size': row['size'],
+                'cover': ProcessedImageSerializer(covers[row['duplicate_group']], context={'request': request}).data
+                if row['duplicate_group'] in covers else None,
+                'image_ids': members.get(row['duplicate_group'], []),
+            }
+            for row in page
+        ]
+        return Response({'count': clusters.count(), 'offset': offset, 'results': results}, status=status.HTTP_200_OK)
+
+
+class ImageFacetsView(APIView):
+    """Image counts per category and per label, for the same filters as ImageListView."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        image_ids = None
+        if any(key in request.query_params for key in ('category', 'categories', 'labels', 'search')):
+            filtered = filter_images_from_params(ProcessedImage.objects.filter(owner=request.user), request.user,
+                                                 request.query_params)
+            image_ids = filtered.values('id')
+        return Response(facet_counts(request.user, image_ids=image_ids), status=status.HTTP_200_OK)
+
+
+def filter_images_from_params(queryset, user, params):
+    categories = parse_terms(params.get('categories')) + parse_terms(params.get('category'))
+    match = MATCH_ANY if params.get('match') == MATCH_ANY else MATCH_ALL
+    return filter_images(
+        queryset, user,
+        categories=categories,
+        labels=parse_terms(params.get('labels')),
+        search=parse_terms(params.get('search')),
+        match=match,
+    )
 
 
 class ImageDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -68,7 +218,86 @@ class ImageDetailView(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         user = self.request.user
         # FIXED: Only allow access to images owned by the current logged-in user
-        return ProcessedImage.objects.filter(owner=user)
+        return ProcessedImage.objects.filter(owner=user).select_related('owner', 'sold_to')
+
+    def perform_update(self, serializer):
+        old = (serializer.instance.detailed_labels, serializer.instance.general_categories)
+        before = image_state(serializer.instance)
+        feed_before = feed_cache.feed_state(serializer.instance)
+        image = serializer.save()
+        feed_cache.record_change(feed_before, feed_cache.feed_state(image))
+        if (image.detailed_labels, image.general_categories) != old:
+            sync_image_labels(image)
+        record_change(image.owner_id, before, image_state(image))
+
+    def perform_destroy(self, instance):
+        before = image_state(instance)
+        feed_before = feed_cache.feed_state(instance)
+        owner_id = instance.owner_id
+        detach(instance, deleted=True)
+        instance.delete()
+        record_change(owner_id, before, None)
+        feed_cache.record_change(feed_before, None)
+
+
+class ImageSimilarView(APIView):
+    """
+    Images that look like image <pk>, by cosine similarity of their ResNet
+    embeddings (see embeddings.py), best first.
+
+    ?scope=library  the caller's own images (default; requires login)
+    ?scope=marketplace  unsold listings of any seller
+    ?k=20  number of results (max SIMILAR_MAX_RESULTS)
+    """
+    permission_classes = [AllowAny]
+    SCOPES = ('library', 'marketplace')
+    SIMILAR_MAX_RESULTS = 100
+
+    def get(self, request, pk, *args, **kwargs):
+        scope = request.query_params.get('scope', 'library')
+        if scope not in self.SCOPES:
+            return Response({'error': f"scope must be one of {', '.join(self.SCOPES)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if scope == 'library' and not request.user.is_authenticated:
+            return Response({'error': 'Log in to search your library.'}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            k = max(1, min(int(request.query_params.get('k', 20)), self.SIMILAR_MAX_RESULTS))
+        except ValueError:
+            return Response({'error': 'k must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The query image must be one the caller may see
+        visible = Q(is_public__in=[True]) | Q(for_sale__in=[True], sold_to__isnull=True)
+        if request.user.is_authenticated:
+            visible |= Q(owner=request.user) | Q(sold_to=request.user)
+        if not ProcessedImage.objects.filter(visible, pk=pk).exists():
+            return Response({'error': 'Image not found.'}, status=status.HTTP_404_NOT_FOUND)
+        store = get_store()
+        vector = store.get(pk)
+        if vector is None:
+            return Response({'error': 'This image has not been indexed for similarity yet.'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        if scope == 'library':
+            candidates = ProcessedImage.objects.filter(owner=request.user)
+            serializer_class = ProcessedImageSerializer
+        else:
+            candidates = ProcessedImage.objects.filter(for_sale__in=[True], sold_to__isnull=True)
+            serializer_class = PublicImageSerializer
+        # Small scopes are searched exactly; large ones go through the ANN index and are filtered after
+        candidate_ids = list(candidates.values_list('id', flat=True)[:BRUTE_FORCE_MAX + 1])
+        if len(candidate_ids) <= BRUTE_FORCE_MAX:
+            hits = store.search(vector, k=k, candidate_ids=candidate_ids, exclude_id=pk)
+        else:
+            hits = store.search(vector, k=k, exclude_id=pk, accept=lambda ids: set(
+                candidates.filter(id__in=ids).values_list('id', flat=True)))
+
+        images = candidates.select_related('owner', 'sold_to').in_bulk([image_id for image_id, _ in hits])
+        results = []
+        for image_id, score in hits:
+            if image_id in images:
+                data = serializer_class(images[image_id], context={'request': request}).data
+                results.append({**data, 'similarity': round(score, 4)})
+        return Response({'scope': scope, 'results': results}, status=status.HTTP_200_OK)
 
 
 class SignupView(generics.CreateAPIView):
@@ -83,6 +312,11 @@ class UserDeleteView(generics.DestroyAPIView):
 
     def get_object(self):
         return self.request.user
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        # Their public images and listings went with them
+        feed_cache.invalidate(*feed_cache.FEEDS)
     
 
 class UserStatsView(APIView):
@@ -90,27 +324,29 @@ class UserStatsView(APIView):
 
     def get(self, request, *args, **kwargs):
         user = self.request.user
-        images = ProcessedImage.objects.filter(owner=user)
-        image_count = images.count()
-        
-        categories = images.values_list('general_categories', flat=True)
-        unique_categories = set(cat for sublist in categories if sublist for cat in sublist)
-        
+        # One row, maintained incrementally by user_stats.record_change
+        library = get_user_stats(user.pk)
+
         stats = {
-            'image_count': image_count,
-            'category_count': len(unique_categories),
+            'image_count': library.image_count,
+            'category_count': len(library.category_counts or {}),
+            'category_counts': library.category_counts or {},
+            'for_sale_count': library.for_sale_count,
+            'sold_count': library.sold_count,
             'user_since': user.date_joined.strftime("%B %Y"),
         }
         return Response(stats, status=status.HTTP_200_OK)
     
-class PublicImageListView(APIView):
+class PublicImageListView(CachedFeedMixin, SparseListMixin, generics.ListAPIView):
+    serializer_class = PublicImageSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
+    feed_name = feed_cache.PUBLIC_FEED
 
-    def get(self, request, *args, **kwargs):
-        all_images = list(ProcessedImage.objects.order_by('-uploaded_at'))
-        public_images = [img for img in all_images if img.is_public]
-        serializer = PublicImageSerializer(public_images, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        # `__in=[True]` rather than `=True`: djongo can't translate a bare boolean WHERE clause.
+        # Served by the (is_public, uploaded_at, id) index.
+        return ProcessedImage.objects.filter(is_public__in=[True]).select_related('owner')
     
 class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserProfileSerializer
@@ -121,55 +357,76 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
         profile, created = UserProfile.objects.get_or_create(user=self.request.user)
         return profile
 
-class MarketplaceListView(APIView):
+class MarketplaceListView(CachedFeedMixin, SparseListMixin, generics.ListAPIView):
     """
-    Lists all images for sale using a manual Python filter for djongo compatibility.
+    Lists all unsold images for sale, newest first, one keyset page at a time.
+    Pages are cached (see feed_cache.py) and invalidated when a listing changes.
     """
+    serializer_class = PublicImageSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
+    feed_name = feed_cache.MARKETPLACE_FEED
 
-    def get(self, request, *args, **kwargs):
-        # Fetch all images and then filter in Python
-        all_images = list(ProcessedImage.objects.order_by('-uploaded_at'))
-        for_sale_images = [
-            img for img in all_images if img.for_sale and img.sold_to is None
-        ]
-        serializer = PublicImageSerializer(for_sale_images, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        # Served by the (for_sale, sold_to, uploaded_at, id) index
+        return ProcessedImage.objects.filter(for_sale__in=[True], sold_to__isnull=True).select_related('owner')
 
-class MyPurchasesListView(generics.ListAPIView):
+class MyPurchasesListView(SparseListMixin, generics.ListAPIView):
     serializer_class = ProcessedImageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return ProcessedImage.objects.filter(sold_to=self.request.user).order_by('-uploaded_at')
+        return ProcessedImage.objects.filter(sold_to=self.request.user).select_related('owner', 'sold_to').order_by('-uploaded_at')
 
 class PurchaseImageView(APIView):
-    """Handles the purchase of an image."""
+    """
+    Handles the purchase of an image: one compare-and-set update, so
+    concurrent buyers can't both win. Send an `Idempotency-Key` header to
+    make retries safe; a repeated key returns the original purchase.
+    """
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk, *args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip()[:64] or None
         try:
-            image = ProcessedImage.objects.get(pk=pk)
-        except ProcessedImage.DoesNotExist:
+            purchase, replayed = purchase_image(pk, request.user, idempotency_key)
+        except PurchaseError as e:
+            return Response({'error': e.message}, status=e.status_code)
+
+        image = ProcessedImage.objects.select_related('owner', 'sold_to').filter(pk=purchase.image_id).first()
+        if image is None:
             return Response({'error': 'Image not found.'}, status=status.HTTP_404_NOT_FOUND)
+        serializer = ProcessedImageSerializer(image, context={'request': request})
+        headers = {'Idempotent-Replayed': 'true'} if replayed else {}
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
+
+
+class MetricsView(APIView):
+    """
+    Prometheus text exposition of this process plus every worker's snapshot.
+    Scrapers send `Authorization: Bearer <METRICS_TOKEN>`; without a token
+    configured the endpoint is closed. (The client address proves nothing:
+    behind the nginx front server every request comes from 127.0.0.1.)
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, *args, **kwargs):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        supplied = request.META.get('HTTP_AUTHORIZATION', '')
+        if not token or not constant_time_compare(supplied, f"Bearer {token}"):
+            return Response({'error': 'Forbidden.'}, status=status.HTTP_403_FORBIDDEN)
+
+        queue_depth = {
+            ((('status', row['status']),)): row['n']
+            for row in AnalysisJob.objects.values('status').annotate(n=Count('id'))
+        }
+        for job_status, _ in AnalysisJob.STATUS_CHOICES:
+            queue_depth.setdefault((('status', job_status),), 0)
 
-        if not image.for_sale or image.sold_to is not None:
-            return Response({'error': 'Image is not available for purchase.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        if image.owner == request.user:
-            return Response({'error': 'You cannot purchase your own image.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # --- FIX: Convert the price to a standard Decimal BEFORE saving ---
-        if image.price is not None:
-            try:
-                # Convert from string or MongoDB's Decimal128 to Python's Decimal
-                image.price = Decimal(str(image.price))
-            except Exception as e:
-                return Response({'error': f'Invalid price format: {e}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        image.sold_to = request.user
-        image.for_sale = False
-        image.save() # Now, the save method will have the correct data type
-        
-        serializer = ProcessedImageSerializer(image)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        body = metrics.registry.render(
+            snapshots=metrics.load_snapshots(getattr(settings, 'METRICS_DIR', None)),
+            gauges={'pixsort_analysis_jobs': ("Analysis jobs by status (queue depth).", queue_depth)},
+        )
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
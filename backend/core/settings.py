@@ -94,6 +94,23 @@ DATABASES = {
     }
 }
 
+# PIXSORT_DB=sqlite or PIXSORT_DB=postgres switches to a relational backend,
+# e.g. to run the test suite without a MongoDB server.
+if os.environ.get('PIXSORT_DB') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+elif os.environ.get('PIXSORT_DB') == 'postgres':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('PGDATABASE', 'image_sorted_db'),
+        'USER': os.environ.get('PGUSER', ''),
+        'PASSWORD': os.environ.get('PGPASSWORD', ''),
+        'HOST': os.environ.get('PGHOST', ''),
+        'PORT': os.environ.get('PGPORT', ''),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -146,13 +163,47 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 # IMPORTANT: Use port 3000 for create-react-app
+from corsheaders.defaults import default_headers
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
 ]
+# Purchases accept an Idempotency-Key header
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Media is served by api.media.serve_media. Private files need signed URLs, valid this long:
+MEDIA_URL_TTL_SECONDS = 24 * 3600
+# Hand the bytes to the front server after the access check: None, 'x-accel-redirect' or 'x-sendfile'.
+# For nginx: location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Image uploads are hashed and spooled here while streaming in; inside MEDIA_ROOT so
+# storing them is a rename (see api/uploads.py)
+UPLOAD_INCOMING_DIR = os.path.join(MEDIA_ROOT, '.incoming')
+# Where image blobs live: 'local' (MEDIA_ROOT), 's3' (any S3-compatible store, needs boto3)
+# or 'emulated' (an object store emulated in STORAGE_EMULATED_DIR). See api/storage.py;
+# move existing files with `manage.py migrate_storage`.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+# images/ab/cd/<hash>.jpg
+STORAGE_SHARD_DEPTH = 2
+STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET')
+# e.g. http://localhost:9000 for MinIO; unset for AWS
+STORAGE_S3_ENDPOINT_URL = os.environ.get('STORAGE_S3_ENDPOINT_URL')
+STORAGE_S3_REGION = os.environ.get('STORAGE_S3_REGION')
+STORAGE_S3_ACCESS_KEY = os.environ.get('STORAGE_S3_ACCESS_KEY')
+STORAGE_S3_SECRET_KEY = os.environ.get('STORAGE_S3_SECRET_KEY')
+STORAGE_EMULATED_DIR = os.path.join(BASE_DIR, 'object_store')
+# Objects are downloaded once into this cache for decoding and serving; least recently read evicted
+STORAGE_CACHE_DIR = os.path.join(BASE_DIR, 'storage_cache')
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+# Uploads above this size go in parts of this size, STORAGE_UPLOAD_CONCURRENCY at a time
+STORAGE_MULTIPART_SIZE = 8 * 1024 * 1024
+STORAGE_UPLOAD_CONCURRENCY = 4
+# While moving to an object store: read blobs not copied yet from MEDIA_ROOT
+STORAGE_FALLBACK_LOCAL = os.environ.get('STORAGE_FALLBACK_LOCAL', '') == '1'
 # This configures Django Rest Framework to use JWT Authentication by default
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -170,6 +221,129 @@ SITE_ID = 1
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 
+
+# --- Image analysis ---
+# Device passed to the YOLO/ResNet models by the analysis workers
+ANALYSIS_DEVICE = 'cpu'
+CATEGORY_FILE = BASE_DIR / 'categories.json'
+# Precomputed label -> category table, rebuilt when categories.json or the models change
+CATEGORY_INDEX_FILE = BASE_DIR / 'category_index.json'
+# Store a DCT perceptual hash with every analyzed image (near-duplicate detection)
+ANALYSIS_PERCEPTUAL_HASH = True
+# Upload guards, enforced while the body streams in (see api/image_limits.py)
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('IMAGE_MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 100_000_000))
+# Decode JPEGs at the smallest DCT scale (1/2, 1/4, 1/8) that still covers every stage
+ANALYSIS_REDUCED_DECODE = True
+# Images whose perceptual hashes differ in at most this many bits are near-duplicates
+# (clustered per library, see api/duplicates.py); up to 7 is found with one-bit chunk probes
+DUPLICATE_MAX_DISTANCE = 6
+# How a person is suspected before running YOLO: 'hog' (Haar faces + HOG people)
+# or 'yolo' (YOLO on every image, its 'person' class is the gate)
+ANALYSIS_PERSON_GATE = os.environ.get('ANALYSIS_PERSON_GATE', 'hog')
+# The hog gate works on a copy no larger than this (0 = full resolution)
+ANALYSIS_GATE_MAX_SIDE = 640
+
+# Inference backend: 'torch' (eager PyTorch) or 'onnx' (ONNX Runtime on CPU; export the
+# models first with `manage.py export_inference_models [--quantize]`)
+ANALYSIS_BACKEND = os.environ.get('ANALYSIS_BACKEND', 'torch')
+# Use the int8 dynamically quantized ONNX models
+ANALYSIS_ONNX_QUANTIZE = os.environ.get('ANALYSIS_ONNX_QUANTIZE', '') == '1'
+ONNX_MODEL_DIR = BASE_DIR / 'onnx_models'
+# Threads per worker process (None: CPU count / worker processes); inter-op defaults to 1
+ANALYSIS_INTRA_OP_THREADS = int(os.environ['ANALYSIS_INTRA_OP_THREADS']) if os.environ.get('ANALYSIS_INTRA_OP_THREADS') else None
+ANALYSIS_INTER_OP_THREADS = None
+
+# Keep ResNet's 2048-d penultimate-layer embedding of every image for "find similar"
+# (see api/embeddings.py; `manage.py build_embedding_index --backfill` for older images)
+ANALYSIS_EMBEDDINGS = True
+EMBEDDING_DIR = BASE_DIR / 'embeddings'
+# 'float16' (4 KB per image) or 'int8' with a per-row scale (2 KB per image)
+EMBEDDING_DTYPE = os.environ.get('EMBEDDING_DTYPE', 'float16')
+# Exact search up to this many vectors/candidates, IVF above it
+EMBEDDING_BRUTE_FORCE_MAX = 50000
+EMBEDDING_IVF_NPROBE = 16
+
+# Background job queue (see api/jobs.py and `manage.py run_analysis_worker`)
+ANALYSIS_JOB_MAX_ATTEMPTS = 3
+ANALYSIS_JOB_RETRY_BACKOFF_SECONDS = 10
+ANALYSIS_JOB_LEASE_SECONDS = 600
+
+# Batched inference: images are grouped into one forward pass per model,
+# up to this many images or this long after the first image arrives.
+ANALYSIS_BATCH_MAX_SIZE = int(os.environ.get('ANALYSIS_BATCH_MAX_SIZE', 8))
+ANALYSIS_BATCH_MAX_WAIT_MS = int(os.environ.get('ANALYSIS_BATCH_MAX_WAIT_MS', 50))
+# Store routing/timing details of each analysis on ProcessedImage.analysis_debug
+ANALYSIS_STORE_DEBUG = True
+
+# Metrics: worker processes write snapshots here, /api/metrics/ merges them.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+# Scrapers of /api/metrics/ send "Authorization: Bearer <token>"; unset keeps the endpoint closed
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Bulk upload (POST /api/upload/bulk/)
+BULK_UPLOAD_MAX_FILES = 5000
+BULK_UPLOAD_MAX_MEMBER_BYTES = 50 * 1024 * 1024
+BULK_UPLOAD_RESULT_TIMEOUT_SECONDS = 600
+
+# Anonymous feed cache (api/feed_cache.py): PIXSORT_FEED_CACHE=file|redis|locmem.
+# Invalidations come from the analysis workers and every API process, so the cache must be
+# shared: file works for everything on one host, redis (needs django-redis) across hosts.
+# locmem is per process and only suits single-process development (runserver, tests).
+FEED_CACHE = os.environ.get('PIXSORT_FEED_CACHE', 'file')
+FEED_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pixsort-feeds',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'feed_cache'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('FEED_CACHE_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'feeds': {**FEED_CACHE_BACKENDS[FEED_CACHE], 'KEY_PREFIX': 'pixsort', 'TIMEOUT': 600},
+}
+FEED_CACHE_ALIAS = 'feeds'
+# Pages are fresh this long, then served stale (while one request rebuilds) for up to this long
+FEED_CACHE_SECONDS = 30
+FEED_CACHE_STALE_SECONDS = 300
+
+# Gallery derivatives written next to each original (see api/thumbnails.py)
+THUMBNAIL_WIDTHS = (160, 320, 640, 1280)
+THUMBNAIL_FORMATS = ('webp', 'jpg')
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_DEFAULT_WIDTH = 320
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'standard': {
+            'format': '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'standard',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.environ.get('PIXSORT_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+
 from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
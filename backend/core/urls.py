@@ -1,8 +1,8 @@
 from django.contrib import admin
-from django.urls import path,include
+from django.urls import path,include,re_path
 from django.conf import settings 
-from django.conf.urls.static import static
 from rest_framework_simplejwt.views import TokenRefreshView
+from api.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -14,4 +14,7 @@ urlpatterns = [
 ]
 
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Access-checked, cacheable, range-capable media (see api/media.py)
+urlpatterns += [
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
+]
\ No newline at end of file
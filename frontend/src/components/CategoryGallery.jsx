@@ -2,22 +2,24 @@ import React, { useState, useEffect } from 'react';
 import { useParams, Link } from 'react-router-dom';
 import axios from '../utils/axiosInstance';
 import './CategoryGallery.css'; // Import new CSS
+import ResponsiveImage from './ResponsiveImage';
 
 function CategoryGallery() {
     const [images, setImages] = useState([]);
     const [isLoading, setIsLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
     const { categoryName } = useParams(); // Get category name from URL
+    const formattedCategory = categoryName.charAt(0).toUpperCase() + categoryName.slice(1);
+    const params = { category: formattedCategory, fields: 'id,image_file,thumbnail,srcset,detailed_labels' };
 
     useEffect(() => {
-        // Capitalize the first letter for the title
-        const formattedCategory = categoryName.charAt(0).toUpperCase() + categoryName.slice(1);
-
         const fetchImages = async () => {
             setIsLoading(true);
             try {
                 // Fetch images using the new category filter
-                const response = await axios.get(`/api/images/?category=${formattedCategory}`);
-                setImages(response.data);
+                const response = await axios.get('/api/images/', { params });
+                setImages(response.data.results);
+                setNextCursor(response.data.next_cursor);
             } catch (error) {
                 console.error(`Failed to fetch images for category ${formattedCategory}:`, error);
             } finally {
@@ -28,6 +30,16 @@ function CategoryGallery() {
         fetchImages();
     }, [categoryName]); // Re-fetch if the categoryName changes
 
+    const loadMore = async () => {
+        try {
+            const response = await axios.get('/api/images/', { params: { ...params, cursor: nextCursor } });
+            setImages(prev => [...prev, ...response.data.results]);
+            setNextCursor(response.data.next_cursor);
+        } catch (error) {
+            console.error(`Failed to fetch more images for category ${formattedCategory}:`, error);
+        }
+    };
+
     if (isLoading) {
         return <div className="loading-message">Loading {categoryName} images...</div>;
     }
@@ -41,13 +53,14 @@ function CategoryGallery() {
             <div className="category-image-grid">
                 {images.map(image => (
                     <div key={image.id} className="category-image-card">
-                        <img src={image.image_file} alt="Processed" />
+                        <ResponsiveImage image={image} alt="Processed" />
                         <div className="category-image-info">
                             <p>{image.detailed_labels.join(', ') || 'N/A'}</p>
                         </div>
                     </div>
                 ))}
             </div>
+            {nextCursor && <button className="back-link" onClick={loadMore}>Load more</button>}
         </div>
     );
 }
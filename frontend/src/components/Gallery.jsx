@@ -2,19 +2,33 @@ import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import axios from '../utils/axiosInstance';
 import './Gallery.css';
+import ResponsiveImage from './ResponsiveImage';
 
 function Gallery() {
     const [images, setImages] = useState([]);
     const [isLoading, setIsLoading] = useState(true);
     const [searchTerm, setSearchTerm] = useState(''); // State for the search input
+    const [nextCursor, setNextCursor] = useState(null);
+    const [activeQuery, setActiveQuery] = useState('');
+    const [hideDuplicates, setHideDuplicates] = useState(false); // One image per burst / re-edit cluster
 
+    // Only what the grid renders; the API paginates with a cursor
+    const GRID_FIELDS = 'id,image_file,thumbnail,srcset,general_categories,detailed_labels';
 
-     const fetchImages = async (query = '') => {
+     const fetchImages = async (query = '', collapse = hideDuplicates) => {
         setIsLoading(true);
-        const url = query ? `/api/images/?search=${query}` : '/api/images/';
+        const params = { fields: GRID_FIELDS, page_size: 100 };
+        if (query) {
+            params.search = query;
+        }
+        if (collapse) {
+            params.collapse = 'duplicates';
+        }
         try {
-            const response = await axios.get(url);
-            setImages(response.data);
+            const response = await axios.get('/api/images/', { params });
+            setImages(response.data.results);
+            setNextCursor(response.data.next_cursor);
+            setActiveQuery(query);
         } catch (error) {
             console.error("Failed to fetch images:", error);
         } finally {
@@ -22,6 +36,23 @@ function Gallery() {
         }
     };
 
+    const loadMore = async () => {
+        const params = { fields: GRID_FIELDS, page_size: 100, cursor: nextCursor };
+        if (activeQuery) {
+            params.search = activeQuery;
+        }
+        if (hideDuplicates) {
+            params.collapse = 'duplicates';
+        }
+        try {
+            const response = await axios.get('/api/images/', { params });
+            setImages(prev => [...prev, ...response.data.results]);
+            setNextCursor(response.data.next_cursor);
+        } catch (error) {
+            console.error("Failed to fetch more images:", error);
+        }
+    };
+
     useEffect(() => {
         fetchImages(); // Fetch all images on initial load
     }, []);
@@ -31,6 +62,11 @@ function Gallery() {
         fetchImages(searchTerm);
     };
 
+    const handleToggleDuplicates = (e) => {
+        setHideDuplicates(e.target.checked);
+        fetchImages(activeQuery, e.target.checked);
+    };
+
     // --- Function to handle deleting an image ---
     const handleDelete = async (imageId) => {
         if (window.confirm("Are you sure you want to delete this image?")) {
@@ -70,6 +106,10 @@ function Gallery() {
                     onChange={(e) => setSearchTerm(e.target.value)}
                 />
                 <button type="submit" className="search-button">Search</button>
+                <label className="collapse-toggle">
+                    <input type="checkbox" checked={hideDuplicates} onChange={handleToggleDuplicates} />
+                    Hide near-duplicates
+                </label>
             </form>
             {Object.keys(groupedImages).length > 0 ? (
                 Object.keys(groupedImages).map(category => (
@@ -83,7 +123,7 @@ function Gallery() {
                         <div className="image-grid">
                             {groupedImages[category].slice(0, 3).map(image => (
                                 <div key={image.id} className="image-card">
-                                    <img src={image.image_file} alt="Processed" />
+                                    <ResponsiveImage image={image} alt="Processed" />
                                     <div className="image-info">
                                         <p><strong>Labels:</strong> {image.detailed_labels.join(', ') || 'N/A'}</p>
                                         
@@ -103,6 +143,7 @@ function Gallery() {
             ) : (
                 <p className="no-results-message">No images found. Try a different search or upload some images!</p>
             )}
+            {nextCursor && <button className="search-button" onClick={loadMore}>Load more</button>}
         </div>
     );
 }
@@ -3,6 +3,11 @@ import axiosInstance from '../utils/axiosInstance';
 import { useNavigate } from 'react-router-dom';
 import './ImageUploader.css';
 
+// How long to wait for the analysis before telling the user to check the gallery later
+const ANALYSIS_TIMEOUT_MS = 2 * 60 * 1000;
+
+class AnalysisPending extends Error {}
+
 function ImageUploader() {
     const [selectedFile, setSelectedFile] = useState(null);
     const [preview, setPreview] = useState(null);
@@ -39,6 +44,21 @@ function ImageUploader() {
         }
     };
     
+    // Uploads are analyzed in the background; poll the job until it settles,
+    // backing off, and give up after a while (e.g. when no worker is running).
+    const waitForAnalysis = async (statusUrl) => {
+        const deadline = Date.now() + ANALYSIS_TIMEOUT_MS;
+        let delay = 1000;
+        while (Date.now() < deadline) {
+            const { data: job } = await axiosInstance.get(statusUrl);
+            if (job.status === 'succeeded') return job.image;
+            if (job.status === 'failed') throw new Error(job.last_error || 'Analysis failed.');
+            await new Promise(resolve => setTimeout(resolve, delay));
+            delay = Math.min(delay * 1.5, 5000);
+        }
+        throw new AnalysisPending();
+    };
+
     const handleUpload = async () => {
         if (!selectedFile) {
             setError("Please select a file first!");
@@ -53,11 +73,16 @@ function ImageUploader() {
             const response = await axiosInstance.post('/api/upload/', formData, {
                 headers: { 'Content-Type': 'multipart/form-data' },
             });
-            setAnalysisResult(response.data);
+            const analyzedImage = await waitForAnalysis(response.data.status_url);
+            setAnalysisResult(analyzedImage);
             setUploadStep('analyzed'); // Move to the next step
         } catch (err) {
-            setError("Upload failed. Please try again.");
-            console.error('Upload error:', err);
+            if (err instanceof AnalysisPending) {
+                setError("Your image is uploaded and still being processed. Check your gallery in a few minutes.");
+            } else {
+                setError("Upload failed. Please try again.");
+                console.error('Upload error:', err);
+            }
         } finally {
             setIsLoading(false);
         }
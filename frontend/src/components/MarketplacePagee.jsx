@@ -1,12 +1,14 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect, useContext, useRef } from 'react';
 import axios from '../utils/axiosInstance';
 import AuthContext from '../context/AuthContext';
 import PaymentModal from './PaymentModal';
 import './MarketplacePage.css';
+import ResponsiveImage from './ResponsiveImage';
 
 function MarketplacePagee() {
     const [images, setImages] = useState([]);
     const [isLoading, setIsLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
     const { user } = useContext(AuthContext);
 
     const [selectedImage, setSelectedImage] = useState(null);
@@ -17,7 +19,9 @@ function MarketplacePagee() {
         const fetchMarketplaceImages = async () => {
             try {
                 const response = await axios.get('/api/marketplace/');
-                setImages(response.data);
+                // Feeds are paginated: { results, next_cursor }
+                setImages(response.data.results);
+                setNextCursor(response.data.next_cursor);
             } catch (error) {
                 console.error("Failed to fetch marketplace images:", error);
             } finally {
@@ -27,6 +31,19 @@ function MarketplacePagee() {
         fetchMarketplaceImages();
     }, []);
 
+    const loadMore = async () => {
+        try {
+            const response = await axios.get('/api/marketplace/', { params: { cursor: nextCursor } });
+            setImages(prev => [...prev, ...response.data.results]);
+            setNextCursor(response.data.next_cursor);
+        } catch (error) {
+            console.error("Failed to fetch more marketplace images:", error);
+        }
+    };
+
+    // One Idempotency-Key per listing, so a retried or double-submitted purchase is only charged once
+    const purchaseKeys = useRef({});
+
     const handlePurchase = async (e) => {
         e.preventDefault();
         if (!user) {
@@ -35,7 +52,12 @@ function MarketplacePagee() {
         }
         setIsProcessing(true);
         try {
-            await axios.post(`/api/images/${selectedImage.id}/purchase/`);
+            if (!purchaseKeys.current[selectedImage.id]) {
+                purchaseKeys.current[selectedImage.id] = crypto.randomUUID();
+            }
+            await axios.post(`/api/images/${selectedImage.id}/purchase/`, null, {
+                headers: { 'Idempotency-Key': purchaseKeys.current[selectedImage.id] },
+            });
             alert(`Successfully purchased "${selectedImage.title}"!`);
             setIsModalOpen(false);
             setImages(images.filter(img => img.id !== selectedImage.id));
@@ -58,7 +80,7 @@ function MarketplacePagee() {
             <div className="marketplace-grid">
                 {images.map(image => (
                     <div key={image.id} className="item-card">
-                        <img src={image.image_file} alt={image.title} />
+                        <ResponsiveImage image={image} alt={image.title} />
                         <div className="item-info">
                             <h3>{image.title || 'Untitled'}</h3>
                             <p className="item-description">{image.description || 'No description available.'}</p>
@@ -83,6 +105,7 @@ function MarketplacePagee() {
                     </div>
                 ))}
             </div>
+            {nextCursor && <button className="buy-button" onClick={loadMore}>Load more</button>}
             <PaymentModal 
                 isOpen={isModalOpen}
                 onClose={() => setIsModalOpen(false)}
@@ -1,16 +1,20 @@
 import React, { useState, useEffect } from 'react';
 import axios from '../utils/axiosInstance';
 import './Gallery.css'; // Reuse the gallery styles
+import ResponsiveImage from './ResponsiveImage';
 
 function MyPurchasesPage() {
     const [images, setImages] = useState([]);
     const [isLoading, setIsLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
+    const params = { fields: 'id,image_file,thumbnail,srcset,title,owner_username' };
 
     useEffect(() => {
         const fetchPurchasedImages = async () => {
             try {
-                const response = await axios.get('/api/my-purchases/');
-                setImages(response.data);
+                const response = await axios.get('/api/my-purchases/', { params });
+                setImages(response.data.results);
+                setNextCursor(response.data.next_cursor);
             } catch (error) {
                 console.error("Failed to fetch purchased images:", error);
             } finally {
@@ -21,6 +25,16 @@ function MyPurchasesPage() {
         fetchPurchasedImages();
     }, []);
 
+    const loadMore = async () => {
+        try {
+            const response = await axios.get('/api/my-purchases/', { params: { ...params, cursor: nextCursor } });
+            setImages(prev => [...prev, ...response.data.results]);
+            setNextCursor(response.data.next_cursor);
+        } catch (error) {
+            console.error("Failed to fetch more purchased images:", error);
+        }
+    };
+
     if (isLoading) {
         return <div className="loading-message">Loading your purchased images...</div>;
     }
@@ -32,7 +46,7 @@ function MyPurchasesPage() {
                 {images.length > 0 ? (
                     images.map(image => (
                         <div key={image.id} className="image-card">
-                            <img src={image.image_file} alt={image.title} />
+                            <ResponsiveImage image={image} alt={image.title} />
                             <div className="image-info">
                                 <p><strong>Title:</strong> {image.title || 'N/A'}</p>
                                 <p><strong>From:</strong> {image.owner_username}</p>
@@ -43,6 +57,7 @@ function MyPurchasesPage() {
                     <p>You haven't purchased any images yet.</p>
                 )}
             </div>
+            {nextCursor && <button className="search-button" onClick={loadMore}>Load more</button>}
         </div>
     );
 }
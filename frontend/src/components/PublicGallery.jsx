@@ -1,17 +1,24 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios'; // <-- Use the standard axios library
 import './Gallery.css';
+import ResponsiveImage from './ResponsiveImage';
+
+// Only what the grid shows
+const PUBLIC_FIELDS = 'id,image_file,thumbnail,srcset,owner_username,detailed_labels';
 
 function PublicGallery() {
     const [images, setImages] = useState([]);
     const [isLoading, setIsLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
 
     useEffect(() => {
         const fetchPublicImages = async () => {
             try {
                 // --- Use a relative URL to leverage the proxy ---
-                const response = await axios.get('/api/public-images/');
-                setImages(response.data);
+                const response = await axios.get('/api/public-images/', { params: { fields: PUBLIC_FIELDS } });
+                // Feeds are paginated: { results, next_cursor }
+                setImages(response.data.results);
+                setNextCursor(response.data.next_cursor);
             } catch (error) {
                 console.error("Failed to fetch public images:", error);
             } finally {
@@ -22,6 +29,16 @@ function PublicGallery() {
         fetchPublicImages();
     }, []);
 
+    const loadMore = async () => {
+        try {
+            const response = await axios.get('/api/public-images/', { params: { fields: PUBLIC_FIELDS, cursor: nextCursor } });
+            setImages(prev => [...prev, ...response.data.results]);
+            setNextCursor(response.data.next_cursor);
+        } catch (error) {
+            console.error("Failed to fetch more public images:", error);
+        }
+    };
+
     if (isLoading) {
         return <div className="loading-message">Loading public gallery...</div>;
     }
@@ -34,7 +51,7 @@ function PublicGallery() {
                     images.map(image => (
                         <div key={image.id} className="image-card">
                             {/* --- Use a relative path for the image source --- */}
-                            <img src={image.image_file} alt="Processed" />
+                            <ResponsiveImage image={image} alt="Processed" />
                             <div className="image-info">
                                 <p><strong>Uploaded by:</strong> {image.owner_username}</p>
                                 <p><strong>Labels:</strong> {image.detailed_labels.join(', ') || 'N/A'}</p>
@@ -45,6 +62,7 @@ function PublicGallery() {
                     <p>No public images have been shared yet.</p>
                 )}
             </div>
+            {nextCursor && <button className="search-button" onClick={loadMore}>Load more</button>}
         </div>
     );
 }
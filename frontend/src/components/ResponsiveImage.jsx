@@ -0,0 +1,24 @@
+import React from 'react';
+
+// Serves a gallery tile from the server-generated derivatives instead of the original:
+// `thumbnail` is a small fallback URL, `srcset` maps a format ('webp', 'jpg') to a srcset string.
+function ResponsiveImage({ image, alt, sizes = '(max-width: 600px) 50vw, 320px', className }) {
+    const srcset = image.srcset || {};
+    const src = image.thumbnail || image.image_file;
+    return (
+        <picture>
+            {srcset.webp && <source type="image/webp" srcSet={srcset.webp} sizes={sizes} />}
+            <img
+                src={src}
+                srcSet={srcset.jpg}
+                sizes={srcset.jpg ? sizes : undefined}
+                alt={alt}
+                className={className}
+                loading="lazy"
+                decoding="async"
+            />
+        </picture>
+    );
+}
+
+export default ResponsiveImage;